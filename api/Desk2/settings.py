@@ -32,6 +32,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'utils.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,14 +81,40 @@ DATABASES = {
 REDIS_HOST = config('REDIS_HOST', default='localhost')
 REDIS_PORT = config('REDIS_PORT', default='6379')
 REDIS_TOKENS_STORAGE = 0
+REDIS_CACHE_STORAGE = 1
+REDIS_CELERY_STORAGE = 2
+
+# the shared redis clients (see utils.redis_client), the pool size is per database and process
+REDIS_MAX_CONNECTIONS = config('REDIS_MAX_CONNECTIONS', default=20, cast=int)
+# in seconds
+REDIS_POOL_TIMEOUT = config('REDIS_POOL_TIMEOUT', default=0.5, cast=float)
+REDIS_SOCKET_TIMEOUT = config('REDIS_SOCKET_TIMEOUT', default=0.5, cast=float)
+REDIS_SOCKET_CONNECT_TIMEOUT = config('REDIS_SOCKET_CONNECT_TIMEOUT', default=0.5, cast=float)
+REDIS_HEALTH_CHECK_INTERVAL = 30
+# a timed out command is not retried, the circuit breaker stops sending commands to a slow server instead
+REDIS_RETRY_ON_TIMEOUT = False
+REDIS_CIRCUIT_FAILURE_THRESHOLD = 5
+# in seconds
+REDIS_CIRCUIT_RECOVERY_TIMEOUT = 10
+
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_CELERY_STORAGE}')
+# the tasks are published without waiting for the broker to come back, e.g. the outbox is delivered periodically then
+CELERY_BROKER_TRANSPORT_OPTIONS = {'max_retries': 1, 'interval_start': 0, 'interval_step': 0.2}
+# the messages left in the outbox (e.g. when the broker was not available) are sent by the periodic delivery
+CELERY_BEAT_SCHEDULE = {
+    'deliver-outbox': {
+        'task': 'user_accounts.tasks.deliver_outbox',
+        'schedule': 60,
+    },
+}
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user_accounts.authentication.RequestCachedJWTAuthentication',
     ),
 
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.ScopedRateThrottle',
+        'utils.throttling.ScopedRateThrottle',
     ],
 
     'DEFAULT_THROTTLE_RATES': {
@@ -149,9 +176,25 @@ EMAIL_USE_TLS = True
 EMAIL_PORT = 587
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
+EMAIL_TIMEOUT = 10
+DEFAULT_FROM_EMAIL = 'noreply@desk2.com'
+
+# the outgoing emails are queued in the outbox and sent by celery workers (see user_accounts.outbox)
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+# in seconds, doubled by every failed attempt
+EMAIL_OUTBOX_RETRY_DELAY = 30
+# in seconds, the messages claimed by a worker that has died are sent again after it
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 5 * 60
+# in seconds, the failed messages and the expired claims are removed after it by the periodic delivery
+EMAIL_OUTBOX_RETENTION = 24 * 60 * 60
 
 # auth app settings
-REDIS_STORED_TOKENS = True
+# the storage of the tokens sent to the users: user_accounts.token_stores.RedisTokenStore, LocalTokenStore (a single
+# process only) or DatabaseTokenStore
+TOKEN_STORE = config('TOKEN_STORE', default='user_accounts.token_stores.RedisTokenStore')
+# the maximum number of tokens kept by LocalTokenStore
+LOCAL_TOKEN_STORE_SIZE = 10000
 
 PASSWORD_RESET_TOKEN_LENGTH = 7
 EMAIL_CONFIRM_TOKEN_LENGTH = 7
@@ -162,6 +205,39 @@ PASSWORD_RESET_TOKEN_TIMEOUT = 5 * 60
 EMAIL_CONFIRM_TOKEN_TIMEOUT = 5 * 60
 TWO_FA_TOKEN_TIMEOUT = 5 * 60
 
+# courses app settings
+# caches a course membership map of every user in redis and in a process-local LRU cache
+COURSE_MEMBERSHIP_CACHE = True
+
+# in seconds
+COURSE_MEMBERSHIP_CACHE_TIMEOUT = 60 * 60
+COURSE_MEMBERSHIP_LOCAL_CACHE_TIMEOUT = 5
+COURSE_MEMBERSHIP_LOCAL_CACHE_SIZE = 2048
+
+# caches the serialized chapters of a course for each role class in redis and in a process-local LRU cache
+CHAPTER_LIST_CACHE = True
+
+# in seconds
+CHAPTER_LIST_CACHE_TIMEOUT = 10 * 60
+CHAPTER_LIST_LOCAL_CACHE_TIMEOUT = 5
+CHAPTER_LIST_LOCAL_CACHE_SIZE = 512
+
+# the enrollment lists longer than the limit are enrolled by a celery worker, the progress is stored in redis
+BULK_ENROLLMENT_SYNC_LIMIT = 1000
+BULK_ENROLLMENT_MAX_MEMBERS = 20000
+# the number of the emails resolved by a single query
+BULK_ENROLLMENT_CHUNK_SIZE = 500
+
+# in seconds
+BULK_ENROLLMENT_JOB_TIMEOUT = 24 * 60 * 60
+
+# the metrics (see utils.metrics.metrics_view) are exported to the scrapers that send the token as
+# "Authorization: Bearer <token>", the endpoint is disabled if it is empty
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# serves the hottest read endpoints by async views, should be enabled for ASGI deployments only
+ASYNC_READ_VIEWS = config('ASYNC_READ_VIEWS', default=False, cast=bool)
+
 CORS_ORIGIN_WHITELIST = [
      'http://localhost:3000'
 ]
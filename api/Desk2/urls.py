@@ -1,9 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from utils.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('user_accounts.urls')),
     path('api/structures/', include('university_structures.urls')),
     path('api/', include('courses.urls')),
+    path('metrics/', metrics_view, name='metrics'),
 ]
@@ -1,12 +1,23 @@
-from django.contrib import admin
+from collections import defaultdict
+
+from django.contrib import admin, messages
+from django.db import transaction
 from django.contrib.contenttypes.admin import GenericTabularInline
-from . import models
+from . import enrollment, models
 from utils.admin import ReadOnlyInlineMixin
 
 
 class CourseMemberInline(admin.TabularInline):
     model = models.CourseMember
     #readonly_fields = ['user']
+    exclude = ['course_group']
+    extra = 0
+
+
+class CourseGroupInline(admin.TabularInline):
+    model = models.CourseGroup
+    fields = ['group', 'sync_members', 'created_at']
+    readonly_fields = ['created_at']
     extra = 0
 
 
@@ -60,10 +71,25 @@ class ChapterAdmin(admin.ModelAdmin):
 
 class CourseAdmin(admin.ModelAdmin):
     model = models.Course
-    inlines = [CourseMemberInline, ChapterInline]
+    inlines = [CourseMemberInline, CourseGroupInline, ChapterInline]
     list_display = ['title', 'department', 'speciality', 'status', 'owner']
     list_filter = ['department', 'speciality', 'status']
     search_fields = ['owner__first_name', 'owner__last_name', 'title']
+    actions = ['enroll_groups']
+
+    @admin.action(description='Enroll the students of the linked groups')
+    def enroll_groups(self, request, queryset):
+        group_ids = defaultdict(list)
+        for course_id, group_id in models.CourseGroup.objects.filter(course__in=queryset).values_list('course_id',
+                                                                                                      'group_id'):
+            group_ids[course_id].append(group_id)
+
+        added_number = 0
+        with transaction.atomic():
+            for course in queryset.filter(pk__in=group_ids):
+                added_number += enrollment.enroll_groups(course, group_ids[course.pk])
+
+        self.message_user(request, f'{added_number} students were enrolled.', messages.SUCCESS)
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoursesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courses'
+
+    def ready(self):
+        from . import signals
+
+        # the migrations are generated on deployment, so the existing rows are backfilled after migrating
+        post_migrate.connect(signals.backfill_task_stats, sender=self)
@@ -0,0 +1,204 @@
+import json
+from threading import Lock
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from utils.cache import LocalLRUCache
+from utils.redis_client import lazy_redis_client
+from .models import CourseMember
+
+redis_client = lazy_redis_client(settings.REDIS_CACHE_STORAGE)
+
+
+class CourseMembershipCache:
+    """
+    Caches a map of course_id -> (course_member_id, role) for every user. The map is stored in redis and in a small
+    process-local LRU cache in front of it. It is invalidated by *post_save* and *post_delete* signals of the
+    **CourseMember** model (see courses.signals), the code that bypasses signals (bulk operations, raw queries)
+    should call **invalidate** by itself.
+
+    NOTE: other processes can see the stale map until its local entry expires, so the local timeout should be small.
+    """
+    redis_key_basename = 'memberships'
+
+    def __init__(self):
+        self._local_cache = LocalLRUCache(
+            settings.COURSE_MEMBERSHIP_LOCAL_CACHE_SIZE,
+            settings.COURSE_MEMBERSHIP_LOCAL_CACHE_TIMEOUT
+        )
+
+    @property
+    def enabled(self):
+        return settings.COURSE_MEMBERSHIP_CACHE
+
+    def get(self, user):
+        """
+        Returns a membership map of a given user.
+        :param user: a UserAccount object
+        :return: a dict in format course_id:(course_member_id, role) or None if the cache is disabled
+        """
+        if not self.enabled:
+            return None
+
+        memberships = self._local_cache.get(user.pk)
+        if memberships is not None:
+            return memberships
+
+        redis_key_name = self._get_redis_key_name(user.pk)
+        try:
+            raw_memberships = redis_client.get(redis_key_name)
+        except redis.RedisError:
+            raw_memberships = None
+
+        if raw_memberships:
+            memberships = {int(course_id): tuple(value) for course_id, value in json.loads(raw_memberships).items()}
+        else:
+            memberships = {
+                course_id: (course_member_id, role) for course_id, course_member_id, role in
+                CourseMember.objects.filter(user=user).values_list('course_id', 'id', 'role')
+            }
+
+            try:
+                redis_client.set(redis_key_name, json.dumps(memberships), ex=settings.COURSE_MEMBERSHIP_CACHE_TIMEOUT)
+            except redis.RedisError:
+                pass
+
+        self._local_cache.set(user.pk, memberships)
+        return memberships
+
+    def invalidate(self, user_id):
+        self._local_cache.delete(user_id)
+        try:
+            redis_client.delete(self._get_redis_key_name(user_id))
+        except redis.RedisError:
+            pass
+
+    def invalidate_many(self, user_ids):
+        """Invalidates the maps of many users by a single redis command, e.g. after a bulk insert."""
+        if not user_ids:
+            return
+
+        for user_id in user_ids:
+            self._local_cache.delete(user_id)
+        try:
+            redis_client.delete(*[self._get_redis_key_name(user_id) for user_id in user_ids])
+        except redis.RedisError:
+            pass
+
+    def clear_local(self):
+        self._local_cache.clear()
+
+    def _get_redis_key_name(self, user_id):
+        return self.redis_key_basename + '_' + str(user_id)
+
+
+membership_cache = CourseMembershipCache()
+
+
+class ChapterListCache:
+    """
+    Caches the serialized chapters of a course (the chapter list and the chapter details with their posts) for each
+    role class: the teachers see the archived and planned posts, the other members do not. The entries of a course
+    are stored in a redis hash and in a small process-local LRU cache in front of it.
+
+    An entry expires at the nearest time boundary of the course posts (the next *published_at* of a planned post or
+    the next task *deadline*) at the latest, so the planned posts appear on time. The entries of a course are
+    invalidated by *post_save* and *post_delete* signals of **Chapter**, **Material**, **Task** and **Attachment** models
+    (see courses.signals), the code that bypasses signals should call **invalidate** by itself.
+
+    NOTE: other processes can see the stale entries until their local entries expire, so the local timeout should be
+    small.
+    """
+    redis_key_basename = 'chapters'
+
+    def __init__(self):
+        self._local_cache = LocalLRUCache(
+            settings.CHAPTER_LIST_LOCAL_CACHE_SIZE,
+            settings.CHAPTER_LIST_LOCAL_CACHE_TIMEOUT
+        )
+        # the local entries of a course are invalidated at once by changing the version of its keys
+        self._local_versions = {}
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return settings.CHAPTER_LIST_CACHE
+
+    def get(self, course_id, key):
+        """
+        :param key: a string that identifies the chapter set and its representation within a course, e.g. a role
+        class and an absolute url
+        :return: the cached data or None
+        """
+        if not self.enabled:
+            return None
+
+        local_key = self._get_local_key(course_id, key)
+        entry = self._local_cache.get(local_key)
+
+        if entry is None:
+            try:
+                raw_entry = redis_client.hget(self._get_redis_key_name(course_id), key)
+            except redis.RedisError:
+                raw_entry = None
+
+            if not raw_entry:
+                return None
+
+            entry = tuple(json.loads(raw_entry))
+            self._local_cache.set(local_key, entry)
+
+        data, expires_at = entry
+        if expires_at <= timezone.now().timestamp():
+            return None
+
+        return data
+
+    def set(self, course_id, key, data, expires_at=None):
+        """
+        :param data: JSON serializable data
+        :param expires_at: the datetime of the nearest time boundary of the course posts
+        """
+        if not self.enabled:
+            return
+
+        timeout_expires_at = timezone.now().timestamp() + settings.CHAPTER_LIST_CACHE_TIMEOUT
+        entry = (data, min(expires_at.timestamp(), timeout_expires_at) if expires_at else timeout_expires_at)
+        raw_entry = json.dumps(entry, cls=JSONEncoder)
+        # the local entry is decoded as well, so it does not keep the serializer of the data
+        self._local_cache.set(self._get_local_key(course_id, key), tuple(json.loads(raw_entry)))
+
+        redis_key_name = self._get_redis_key_name(course_id)
+        try:
+            pipeline = redis_client.pipeline()
+            pipeline.hset(redis_key_name, key, raw_entry)
+            pipeline.expire(redis_key_name, settings.CHAPTER_LIST_CACHE_TIMEOUT)
+            pipeline.execute()
+        except redis.RedisError:
+            pass
+
+    def invalidate(self, course_id):
+        with self._lock:
+            self._local_versions[course_id] = self._local_versions.get(course_id, 0) + 1
+
+        try:
+            redis_client.delete(self._get_redis_key_name(course_id))
+        except redis.RedisError:
+            pass
+
+    def clear_local(self):
+        with self._lock:
+            self._local_versions.clear()
+        self._local_cache.clear()
+
+    def _get_local_key(self, course_id, key):
+        return course_id, self._local_versions.get(course_id, 0), key
+
+    def _get_redis_key_name(self, course_id):
+        return self.redis_key_basename + '_' + str(course_id)
+
+
+chapter_list_cache = ChapterListCache()
@@ -0,0 +1,82 @@
+from django.db.models import Count, F, Max, Min, OuterRef, Q, Subquery
+
+from courses.models import Course, Chapter, Material, Task
+
+
+def get_posts_aggregates(model, now):
+    """
+    The aggregates of the state that the serialized posts depend on: the number of posts, their last edit and the
+    nearest time boundaries - a planned post becomes visible at *published_at* and *deadline_passed* of a task changes
+    at *deadline*. The next boundaries are a part of the state, so it changes when a boundary is passed.
+    :param model: Material or Task model
+    """
+    aggregates = {'count': Count('pk'), 'edited_at': Max('edited_at')}
+    for field in _get_time_fields(model):
+        aggregates[f'last_{field}'] = Max(field, filter=Q(**{f'{field}__lte': now}))
+        aggregates[f'next_{field}'] = Min(field, filter=Q(**{f'{field}__gt': now}))
+
+    return aggregates
+
+
+def get_aggregate_subqueries(queryset, outer_field, aggregates):
+    """
+    :param outer_field: the field of the queryset model that references the row of the outer query, e.g.
+    *chapter__course*
+    :return: dict of the scalar subqueries that compute the aggregates over the rows related to the outer row
+    """
+    queryset = queryset.filter(**{outer_field: OuterRef('pk')}).order_by().values(outer_field)
+    return {name: Subquery(queryset.annotate(value=aggregate).values('value')) for name, aggregate in aggregates.items()}
+
+
+def get_posts_state(queryset, now, related_modifications=()):
+    """
+    Selects the state of the posts of a queryset by a single aggregate query (see **get_posts_aggregates**).
+    :param queryset: a queryset of Material or Task model, not filtered by the visibility of the posts
+    :param related_modifications: the lookups of the modification times of the related rows that are serialized
+    with the posts, e.g. *stats__updated_at*
+    :return: a tuple (state, last_modified), where *last_modified* is the time of the last edit, the last passed
+    boundary or the last modification of the related rows
+    """
+    aggregates = get_posts_aggregates(queryset.model, now)
+    aggregates.update({f'{lookup}_max': Max(lookup) for lookup in related_modifications})
+
+    values = queryset.order_by().aggregate(**aggregates)
+    modification_times = [values['edited_at']] + [values[f'last_{field}'] for field in _get_time_fields(queryset.model)]
+    modification_times += [values[f'{lookup}_max'] for lookup in related_modifications]
+    last_modified = max((time for time in modification_times if time is not None), default=None)
+
+    return [values[name] for name in sorted(values)], last_modified
+
+
+def get_chapters_state(course, now, chapter_id=None):
+    """
+    Selects the state of the chapters of a course (or of a single chapter) and their posts by a single query.
+    :return: a tuple (state, next_boundary), where *next_boundary* is the nearest time boundary of the posts. The
+    state is None if the chapter does not exist.
+    """
+    if chapter_id is None:
+        queryset = Course.objects.filter(pk=course.pk)
+        annotations = get_aggregate_subqueries(Chapter.objects.all(), 'course', {
+            'chapters_count': Count('pk'),
+            'chapters_edited_at': Max('edited_at'),
+        })
+        posts_outer_field = 'chapter__course'
+    else:
+        queryset = Chapter.objects.filter(pk=chapter_id, course=course)
+        annotations = {'chapter_edited_at': F('edited_at')}
+        posts_outer_field = 'chapter'
+
+    for model in (Material, Task):
+        subqueries = get_aggregate_subqueries(model.objects.all(), posts_outer_field, get_posts_aggregates(model, now))
+        annotations.update({f'{model._meta.model_name}_{name}': subquery for name, subquery in subqueries.items()})
+
+    values = queryset.annotate(**annotations).values(*annotations).first()
+    if values is None:
+        return None, None
+
+    next_boundaries = [time for name, time in values.items() if '_next_' in name and time is not None]
+    return [values[name] for name in sorted(values)], min(next_boundaries, default=None)
+
+
+def _get_time_fields(model):
+    return ['published_at'] + (['deadline'] if model is Task else [])
@@ -0,0 +1,216 @@
+import csv
+import io
+import json
+from uuid import uuid4
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, CharField, DateTimeField, Exists, OuterRef, Subquery, Value
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from user_accounts.models import UserAccount, StudentProfile
+from utils.querysets import insert_from_select, insert_values
+from .cache import membership_cache, redis_client
+from .models import CourseGroup, CourseMember, StudentWork
+
+ENROLLMENT_ROLES = {'student': CourseMember.STUDENT, 'teacher': CourseMember.TEACHER}
+
+
+def read_enrollment_csv(file):
+    """
+    Reads the members of a bulk enrollment from an uploaded CSV file. The first row is a header, the *email* column is
+    required and the *member_type* column is optional.
+    :return: a list of dicts in format {email, member_type}
+    """
+    try:
+        rows = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig'))
+        if 'email' not in (rows.fieldnames or []):
+            raise ValidationError({'file': ['The file should have a header with an email column.']})
+
+        return [
+            {key: value for key, value in row.items() if key in ('email', 'member_type') and value}
+            for row in rows
+        ]
+    except (UnicodeDecodeError, csv.Error):
+        raise ValidationError({'file': ['The file is not a valid CSV file.']})
+
+
+def enroll_members(course, members, on_progress=None):
+    """
+    Enrolls the users to a course by their emails. The members are processed in chunks of
+    *BULK_ENROLLMENT_CHUNK_SIZE*: the users of a chunk are selected together with their membership by a single query
+    and the new members are created by a single insert. The users enrolled concurrently are skipped by the unique
+    constraint of (user, course) and are reported as already enrolled, the insert returns the users it has enrolled.
+    :param members: a list of dicts in format {email, role}, the emails should be unique
+    :param on_progress: a callable (processed, total) that is called after every chunk
+    :return: a report dict of the lists of emails: *added*, *already_enrolled*, *unknown* and *not_teachers* (the
+    accounts that are not teachers, but are listed as teachers of the course)
+    """
+    report = {'added': [], 'already_enrolled': [], 'unknown': [], 'not_teachers': []}
+    chunk_size = settings.BULK_ENROLLMENT_CHUNK_SIZE
+
+    for start in range(0, len(members), chunk_size):
+        chunk = members[start:start + chunk_size]
+        users = {
+            email: (user_id, profile_type, is_enrolled) for email, user_id, profile_type, is_enrolled in
+            UserAccount.objects.filter(email__in=[member['email'] for member in chunk]).annotate(
+                is_enrolled=Exists(CourseMember.objects.filter(course=course, user=OuterRef('pk')))
+            ).values_list('email', 'pk', 'profile_type', 'is_enrolled')
+        }
+
+        new_members = []
+        for member in chunk:
+            user_id, profile_type, is_enrolled = users.get(member['email'], (None, None, False))
+            if user_id is None:
+                report['unknown'].append(member['email'])
+            elif is_enrolled:
+                report['already_enrolled'].append(member['email'])
+            elif member['role'] == CourseMember.TEACHER and profile_type != UserAccount.TEACHER:
+                report['not_teachers'].append(member['email'])
+            else:
+                new_members.append((member['email'], user_id, member['role']))
+
+        # the users enrolled concurrently are skipped by the insert and are not returned by it
+        now = timezone.now()
+        inserted_user_ids = set(insert_values(
+            CourseMember, ['user', 'course', 'role', 'created_at'],
+            [(user_id, course.pk, role, now) for _, user_id, role in new_members],
+            returning='user'
+        ))
+        for email, user_id, _ in new_members:
+            report['added' if user_id in inserted_user_ids else 'already_enrolled'].append(email)
+
+        # the bulk insert does not send the signals that invalidate the membership maps (see courses.signals)
+        user_ids = list(inserted_user_ids)
+        membership_cache.invalidate_many(user_ids)
+        transaction.on_commit(lambda user_ids=user_ids: membership_cache.invalidate_many(user_ids))
+
+        if on_progress is not None:
+            on_progress(start + len(chunk), len(members))
+
+    return report
+
+
+def link_groups(course, group_ids, sync_members):
+    """
+    Links academic groups to a course (see CourseGroup), the links that exist already are updated with a given
+    *sync_members* flag.
+    """
+    CourseGroup.objects.bulk_create([
+        CourseGroup(course=course, group_id=group_id, sync_members=sync_members) for group_id in group_ids
+    ], ignore_conflicts=True)
+    CourseGroup.objects.filter(course=course, group__in=group_ids).exclude(sync_members=sync_members).update(
+        sync_members=sync_members
+    )
+
+
+def enroll_groups(course, group_ids):
+    """
+    Enrolls all the students of academic groups as students of a course by a single *INSERT ... SELECT* query, the
+    users that are members of the course already are skipped. The groups should be linked to the course (see
+    **link_groups**), the new members refer to the link of their group.
+    :return: the number of the added members
+    """
+    students = UserAccount.objects.filter(student_profile__group__in=group_ids).exclude(
+        Exists(CourseMember.objects.filter(course=course, user=OuterRef('pk')))
+    ).annotate(
+        member_course_id=Value(course.pk, output_field=BigIntegerField()),
+        member_role=Value(CourseMember.STUDENT, output_field=CharField()),
+        member_created_at=Value(timezone.now(), output_field=DateTimeField()),
+        member_course_group_id=Subquery(
+            CourseGroup.objects.filter(course=course, group=OuterRef('student_profile__group')).values('pk')[:1]
+        ),
+    ).values_list('pk', 'member_course_id', 'member_role', 'member_created_at', 'member_course_group_id')
+
+    added_number = insert_from_select(
+        CourseMember, ['user', 'course', 'role', 'created_at', 'course_group'], students
+    )
+
+    # the insert does not send the signals that invalidate the membership maps (see courses.signals)
+    if added_number:
+        user_ids = list(StudentProfile.objects.filter(group__in=group_ids).values_list('user_id', flat=True))
+        membership_cache.invalidate_many(user_ids)
+        transaction.on_commit(lambda: membership_cache.invalidate_many(user_ids))
+
+    return added_number
+
+
+def sync_student_group(user_id, previous_group_id, group_id):
+    """
+    Enrolls a student that joined a group to the courses that keep their members in sync with the group and removes
+    a student that left a group from such courses of the previous group (see CourseGroup.sync_members). Only the
+    memberships created by a group link are removed, so the students added by hand stay. The members that have
+    submitted works are not removed, so their works and grades are kept.
+    """
+    joined_links = {}
+    left_links = {}
+    for link_id, link_group_id, course_id in CourseGroup.objects.filter(
+        group__in=[pk for pk in (previous_group_id, group_id) if pk is not None],
+        sync_members=True
+    ).values_list('pk', 'group_id', 'course_id'):
+        (joined_links if link_group_id == group_id else left_links)[course_id] = link_id
+
+    if joined_links:
+        CourseMember.objects.bulk_create([
+            CourseMember(user_id=user_id, course_id=course_id, role=CourseMember.STUDENT, course_group_id=link_id)
+            for course_id, link_id in joined_links.items()
+        ], ignore_conflicts=True)
+        # a course of both groups keeps the member, it is moved to the link of the new group
+        for course_id in joined_links.keys() & left_links.keys():
+            CourseMember.objects.filter(user=user_id, course_group=left_links[course_id]).update(
+                course_group=joined_links[course_id]
+            )
+
+        membership_cache.invalidate(user_id)
+        transaction.on_commit(lambda: membership_cache.invalidate(user_id))
+
+    removed_link_ids = [link_id for course_id, link_id in left_links.items() if course_id not in joined_links]
+    if removed_link_ids:
+        # the signals of the deleted members invalidate the membership map
+        CourseMember.objects.filter(
+            user=user_id,
+            course_group__in=removed_link_ids,
+            role=CourseMember.STUDENT
+        ).exclude(Exists(StudentWork.objects.filter(owner=OuterRef('pk')))).delete()
+
+
+class EnrollmentJob:
+    """
+    The state of a bulk enrollment run by a celery worker (see courses.tasks.enroll_course_members). The state is
+    stored in redis for *BULK_ENROLLMENT_JOB_TIMEOUT* seconds under a key of the course, so it can be read only in
+    the context of the course.
+    """
+    redis_key_basename = 'enrollment'
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, course_id, job_id=None):
+        self.course_id = course_id
+        self.job_id = job_id or uuid4().hex
+
+    def get_state(self):
+        """
+        :return: a dict in format {status, processed, total, report} or None if the job does not exist or redis is
+        not available
+        """
+        try:
+            raw_state = redis_client.get(self._get_redis_key_name())
+        except redis.RedisError:
+            return None
+
+        return json.loads(raw_state) if raw_state else None
+
+    def set_state(self, status, processed=0, total=0, report=None):
+        state = {'status': status, 'processed': processed, 'total': total, 'report': report}
+        try:
+            redis_client.set(self._get_redis_key_name(), json.dumps(state), ex=settings.BULK_ENROLLMENT_JOB_TIMEOUT)
+        except redis.RedisError:
+            pass
+
+    def _get_redis_key_name(self):
+        return f'{self.redis_key_basename}_{self.course_id}_{self.job_id}'
@@ -0,0 +1,124 @@
+from django.db.models import Avg, Count, FloatField, Max, Min, Q
+
+from courses.models import CourseMember, StudentWork, Task
+
+# the statuses of the works the teachers can see (see courses.views.StudentWorkViewSet.get_queryset)
+VISIBLE_STATUSES = (StudentWork.SUBMITTED, StudentWork.GRADED)
+
+
+class Gradebook:
+    """
+    A students x tasks matrix of a course: a cell is the work of a student for a task (its status, submission time and
+    grade amount) or None if the student has not submitted the work. The works that have not been submitted are not
+    shown to the teachers, so they are neither in the cells nor in the statistics. It is selected by a fixed number of
+    queries regardless of the course size:
+
+    * the tasks of the course with their statistics, computed by a single aggregate query.
+
+    * the students of the course.
+
+    * the works of the students, ordered as the matrix rows and streamed by a server-side cursor.
+    """
+    csv_task_columns = ('status', 'submitted_at', 'grade')
+
+    def __init__(self, course):
+        self.course = course
+
+    def get_tasks(self):
+        """
+        :return: a list of dicts, the columns of the matrix ordered by the chapter and the publication time
+        """
+        tasks = Task.objects.filter(chapter__course=self.course).order_by('chapter_id', 'published_at', 'pk').values(
+            'id', 'title', 'chapter_id', 'max_grade', 'deadline'
+        ).annotate(
+            works=Count('studentwork', filter=Q(studentwork__status__in=VISIBLE_STATUSES)),
+            # the works that wait for a grade
+            submitted=Count('studentwork', filter=Q(studentwork__status=StudentWork.SUBMITTED)),
+            graded=Count('studentwork__grade'),
+            average_grade=Avg('studentwork__grade__amount', output_field=FloatField()),
+            lowest_grade=Min('studentwork__grade__amount'),
+            highest_grade=Max('studentwork__grade__amount'),
+        )
+
+        statistics_fields = ('works', 'submitted', 'graded', 'average_grade', 'lowest_grade', 'highest_grade')
+        return [{
+            'id': task['id'],
+            'title': task['title'],
+            'chapter': task['chapter_id'],
+            'max_grade': task['max_grade'],
+            'deadline': task['deadline'],
+            'statistics': {field: task[field] for field in statistics_fields},
+        } for task in tasks]
+
+    def get_students(self):
+        """
+        :return: a list of dicts, the rows of the matrix ordered by the primary key
+        """
+        students = CourseMember.objects.filter(course=self.course, role=CourseMember.STUDENT).order_by('pk').values(
+            'id', 'user_id', 'user__first_name', 'user__last_name', 'user__email'
+        )
+
+        return [{
+            'id': student['id'],
+            'user': {
+                'id': student['user_id'],
+                'first_name': student['user__first_name'],
+                'last_name': student['user__last_name'],
+                'email': student['user__email'],
+            },
+        } for student in students]
+
+    def iter_rows(self, tasks, students):
+        """
+        Merges the works into the rows of the students, the works are not loaded at once.
+        :return: an iterator of tuples (student, cells), where the cells are ordered as the tasks
+        """
+        task_indexes = {task['id']: index for index, task in enumerate(tasks)}
+        works = StudentWork.objects.filter(
+            task__chapter__course=self.course,
+            owner__role=CourseMember.STUDENT,
+            status__in=VISIBLE_STATUSES
+        ).order_by('owner_id').values_list('owner_id', 'task_id', 'status', 'submitted_at', 'grade__amount').iterator()
+
+        work = next(works, None)
+        for student in students:
+            cells = [None] * len(tasks)
+            while work is not None and work[0] <= student['id']:
+                owner_id, task_id, status, submitted_at, grade = work
+                if owner_id == student['id'] and task_id in task_indexes:
+                    cells[task_indexes[task_id]] = {'status': status, 'submitted_at': submitted_at, 'grade': grade}
+                work = next(works, None)
+
+            yield student, cells
+
+    def get_matrix(self):
+        tasks = self.get_tasks()
+        students = self.get_students()
+
+        return {
+            'tasks': tasks,
+            'students': [{**student, 'works': cells} for student, cells in self.iter_rows(tasks, students)],
+        }
+
+    def iter_csv_rows(self):
+        """
+        :return: an iterator of the CSV rows: a header and a row per student with the status, the submission time and
+        the grade of every task
+        """
+        tasks = self.get_tasks()
+        students = self.get_students()
+
+        yield ['student_id', 'first_name', 'last_name', 'email'] + [
+            f'{task["title"]} #{task["id"]} {column}' for task in tasks for column in self.csv_task_columns
+        ]
+
+        for student, cells in self.iter_rows(tasks, students):
+            row = [student['id'], student['user']['first_name'], student['user']['last_name'], student['user']['email']]
+            for cell in cells:
+                if cell is None:
+                    row += [''] * len(self.csv_task_columns)
+                else:
+                    submitted_at = cell['submitted_at'].isoformat() if cell['submitted_at'] else ''
+                    row += [cell['status'], submitted_at, cell['grade'] if cell['grade'] is not None else '']
+
+            yield row
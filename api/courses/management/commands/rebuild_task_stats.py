@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from courses.models import Task
+from courses.stats import rebuild_task_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the statistics of the works of the tasks from their works and grades.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', dest='course_ids',
+                            help='The id of a course to rebuild the statistics of its tasks, can be repeated.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='The number of the tasks rebuilt by a single query.')
+
+    def handle(self, *args, course_ids=None, batch_size=500, **options):
+        tasks = Task.objects.order_by('pk')
+        if course_ids:
+            tasks = tasks.filter(chapter__course__in=course_ids)
+
+        rebuilt_number = 0
+        last_task_id = 0
+        while True:
+            task_ids = list(tasks.filter(pk__gt=last_task_id).values_list('pk', flat=True)[:batch_size])
+            if not task_ids:
+                break
+
+            rebuilt_number += rebuild_task_stats(Task.objects.filter(pk__in=task_ids))
+            last_task_id = task_ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the statistics of {rebuilt_number} tasks.'))
@@ -1,10 +1,15 @@
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
-from django.urls import resolve
+import asyncio
+
+from django.http import JsonResponse, Http404
 from rest_framework.status import HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
-from rest_framework_simplejwt.authentication import JWTAuthentication, InvalidToken
+from rest_framework.exceptions import AuthenticationFailed
+
+from user_accounts.authentication import RequestCachedJWTAuthentication
+from utils.db import database_sync_to_async
 
+from .cache import membership_cache
 from .models import Course
+from .routing import CourseRouteTable
 from .views import CourseMemberViewSet
 
 
@@ -19,25 +24,72 @@ class CourseMiddleware:
 
     * if two previous requirements are satisfied, sets corresponding *Course* and *CourseMember* objects as an
     attributes of the request object. They can be accessed in a view as *request.course* and *request.course_member*.
+
+    All the objects (including *Chapter* and *Task* for the chapter and task related paths) are fetched in a single
+    query, see **CourseManager.get_context**. The *CourseMember* object is built from the cached membership map of the
+    user (see courses.cache), so the permission classes that check *request.course_member* do not query it.
+
+    The course-scoped paths are classified by a **CourseRouteTable** compiled at startup, the other paths are passed
+    through after a single prefix check.
+
+    The middleware is async-capable. Under ASGI the database work of a course-scoped path is done in a single
+    thread pool hop (see utils.db), the other paths are passed through without leaving the event loop.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        # compiled once, so the path is not resolved by the middleware in addition to the request handler
+        self.route_table = CourseRouteTable()
+
+        if asyncio.iscoroutinefunction(self.get_response):
+            # the request handler checks it to await the middleware instead of wrapping it into async_to_sync
+            self._is_coroutine = asyncio.coroutines._is_coroutine
 
     def __call__(self, request):
-        jwt_authenticator = JWTAuthentication()
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        route = self.route_table.match(request.path_info)  # to get url params of a path
+        response = self.process_course_context(request, route) if route else None
+
+        return response if response is not None else self.get_response(request)
+
+    async def __acall__(self, request):
+        route = self.route_table.match(request.path_info)
+        response = await database_sync_to_async(self.process_course_context)(request, route) if route else None
+
+        return response if response is not None else await self.get_response(request)
+
+    def process_course_context(self, request, route):
+        """
+        Sets the course context of a course-scoped path as attributes of the request.
+        :param route: a tuple (view, kwargs) returned by the route table
+        :return: an error response or None if the request should be passed to the view
+        """
+        jwt_authenticator = RequestCachedJWTAuthentication()
         user = request.user
 
         try:
+            # the result is reused by DRF authentication of the view
             authentication_result = jwt_authenticator.authenticate(request)
             user = authentication_result[0] if authentication_result else request.user
-        except InvalidToken:
+        except AuthenticationFailed:
             pass
 
-        view, _, kwargs = resolve(request.path)  # to get url params of a path
-        if user.is_authenticated and 'course_id' in kwargs.keys():
-            course = get_object_or_404(Course, pk=kwargs['course_id'])
-
-            course_member = course.get_course_member_if_exists(user)
+        if user.is_authenticated:
+            view, kwargs = route
+            try:
+                course, course_member, chapter, task = Course.objects.get_context(
+                    user,
+                    kwargs['course_id'],
+                    chapter_id=kwargs.get('chapter_id', None),
+                    task_id=kwargs.get('task_id', None),
+                    memberships=membership_cache.get(user)
+                )
+            except Course.DoesNotExist:
+                raise Http404('No Course matches the given query.')
 
             if not course_member:
                 if view.__name__ is not CourseMemberViewSet.__name__ or request.method != 'POST':
@@ -47,7 +99,6 @@ class CourseMiddleware:
             setattr(request, 'course_member', course_member)
 
             if 'chapter_id' in kwargs.keys():
-                chapter = course.get_chapter_if_exists(kwargs['chapter_id'])
                 if not chapter:
                     return JsonResponse(
                         {'detail': f'This course does not have chapter with id {kwargs["chapter_id"]}.'},
@@ -57,7 +108,6 @@ class CourseMiddleware:
                 setattr(request, 'chapter', chapter)
 
                 if 'task_id' in kwargs.keys():
-                    task = chapter.get_task_if_exists(kwargs['task_id'])
                     if not task:
                         return JsonResponse(
                             {'detail': f'This course does not have a task with id {kwargs["task_id"]}.'},
@@ -66,6 +116,4 @@ class CourseMiddleware:
 
                     setattr(request, 'task', task)
 
-        response = self.get_response(request)
-
-        return response
+        return None
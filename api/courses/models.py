@@ -1,5 +1,9 @@
 from os import path
+from collections import namedtuple
+
 from django.db import models
+from django.db.models import F, FilteredRelation, Q
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinLengthValidator
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
@@ -7,10 +11,84 @@ from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 
 from user_accounts.models import UserAccount
-from university_structures.models import Department, Speciality
+from university_structures.models import Department, Group, Speciality
 from utils.validators import get_regex_validator
 
 
+CourseContext = namedtuple('CourseContext', ['course', 'course_member', 'chapter', 'task'])
+
+
+class CourseManager(models.Manager):
+
+    def get_context(self, user, course_id, chapter_id=None, task_id=None, memberships=None):
+        """
+        Resolves the course-scoped objects of a request in a single query. The deepest requested object is selected
+        together with its parents and the *CourseMember* object of a given user is joined to it.
+        If the requested object does not exist, the lookup falls back one level up, so a caller can find out which
+        part of the path is broken.
+        :param user: a UserAccount object
+        :param memberships: an optional cached membership map of the user in format course_id:(id, role),
+        if it is given, the *CourseMember* object is built from it instead of being joined
+        :return: a CourseContext object, *course_member*, *chapter* and *task* are None if they do not exist
+        :raises Course.DoesNotExist: if the course with a given id does not exist
+        """
+        if task_id is not None:
+            queryset = Task.objects.filter(pk=task_id, chapter__pk=chapter_id, chapter__course__pk=course_id)\
+                .select_related('chapter__course')
+            course_lookup = 'chapter__course'
+        elif chapter_id is not None:
+            queryset = Chapter.objects.filter(pk=chapter_id, course__pk=course_id).select_related('course')
+            course_lookup = 'course'
+        else:
+            queryset = self.filter(pk=course_id)
+            course_lookup = ''
+
+        if memberships is None:
+            member_lookup = f'{course_lookup}__coursemember' if course_lookup else 'coursemember'
+            queryset = queryset.annotate(
+                user_membership=FilteredRelation(member_lookup, condition=Q(**{f'{member_lookup}__user': user})),
+                membership_id=F('user_membership__id'),
+                membership_role=F('user_membership__role'),
+                membership_created_at=F('user_membership__created_at'),
+            )
+
+        try:
+            obj = queryset.get()
+        except ObjectDoesNotExist:
+            if chapter_id is None:
+                raise
+
+            return self.get_context(
+                user,
+                course_id,
+                chapter_id=chapter_id if task_id is not None else None,
+                memberships=memberships
+            )
+
+        task = obj if task_id is not None else None
+        chapter = task.chapter if task else (obj if chapter_id is not None else None)
+        course = chapter.course if chapter else obj
+
+        field_names = ['id', 'user_id', 'course_id', 'role']
+        if memberships is None:
+            membership = (obj.membership_id, obj.membership_role, obj.membership_created_at)
+            field_names.append('created_at')
+        else:
+            membership = memberships.get(course.pk, (None, None))
+
+        course_member = None
+        if membership[0] is not None:
+            course_member = CourseMember.from_db(
+                self.db,
+                field_names,
+                [membership[0], user.pk, course.pk, *membership[1:]]
+            )
+            course_member.user = user
+            course_member.course = course
+
+        return CourseContext(course, course_member, chapter, task)
+
+
 class Course(models.Model):
     title = models.CharField(max_length=128, validators=[MinLengthValidator(2), get_regex_validator('title')])
     description = models.TextField(blank=True)
@@ -23,12 +101,14 @@ class Course(models.Model):
         (ARCHIVED, 'Archived'),
     )
     status = models.CharField(max_length=1, choices=STATUSES, default=ONGOING)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     department = models.ForeignKey(Department, null=True, on_delete=models.SET_NULL)
     speciality = models.ForeignKey(Speciality, null=True, on_delete=models.SET_NULL)
     owner = models.ForeignKey(UserAccount, null=True, on_delete=models.SET_NULL)
 
+    objects = CourseManager()
+
     def __str__(self):
         return self.title
 
@@ -51,6 +131,7 @@ class Course(models.Model):
 class CourseMember(models.Model):
     class Meta:
         unique_together = ('user', 'course')
+        indexes = [models.Index(fields=['course', 'created_at'], name='coursemember_created_idx')]
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
@@ -67,6 +148,9 @@ class CourseMember(models.Model):
 
     role = models.CharField(max_length=1, choices=STATUSES, default=AUDITOR)
     created_at = models.DateTimeField(auto_now_add=True)
+    # the group link that enrolled the member, null if the member was added by hand. Only the members enrolled by
+    # a link are removed by the sync of its group (see courses.enrollment.sync_student_group).
+    course_group = models.ForeignKey('CourseGroup', null=True, blank=True, on_delete=models.SET_NULL)
 
     @property
     def is_teacher(self):
@@ -76,10 +160,28 @@ class CourseMember(models.Model):
         return f'{self.user.first_name}  {self.user.last_name}'
 
 
+class CourseGroup(models.Model):
+    """
+    An academic group enrolled to a course. If *sync_members* is set, the students that join the group are enrolled
+    to the course and the students that leave it are removed from the course (see courses.enrollment).
+    """
+    class Meta:
+        unique_together = ('course', 'group')
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE)
+    sync_members = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.group} - {self.course}'
+
+
 class Chapter(models.Model):
     title = models.CharField(max_length=128, validators=[MinLengthValidator(3), get_regex_validator('title')])
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    edited_at = models.DateTimeField(auto_now=True)
 
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
 
@@ -124,6 +226,8 @@ class Post(models.Model):
     class Meta:
         abstract = True
         ordering = ['-created_at']
+        # the ordering of the cursor pagination of a chapter posts
+        indexes = [models.Index(fields=['chapter', '-created_at'], name='%(class)s_chapter_created_idx')]
 
     @property
     def is_planned(self):
@@ -149,10 +253,33 @@ class Task(Post):
         return self.title
 
 
+class TaskStats(models.Model):
+    """
+    The counters of the works of a task by their status and the sum of their grades. The counters are maintained
+    incrementally by the views that change the works (see courses.stats), so they are read without scanning the works.
+    The rows are updated by F() expressions only, a task is never saved with stale counters.
+    """
+    task = models.OneToOneField(Task, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    assigned_count = models.IntegerField(default=0)
+    submitted_count = models.IntegerField(default=0)
+    graded_count = models.IntegerField(default=0)
+    grade_sum = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @property
+    def average_grade(self):
+        return self.grade_sum / self.graded_count if self.graded_count else None
+
+    def __str__(self):
+        return f'Statistics of the {self.task_id} task'
+
+
 class StudentWork(models.Model):
     class Meta:
         unique_together = ('task', 'owner')
         ordering = ['submitted_at']
+        # the ordering of the cursor pagination of a task works
+        indexes = [models.Index(fields=['task', 'id'], name='studentwork_task_id_idx')]
 
     task = models.ForeignKey(Task, on_delete=models.CASCADE)
     owner = models.ForeignKey(CourseMember, on_delete=models.CASCADE)
@@ -187,7 +314,7 @@ class StudentWork(models.Model):
 class Grade(models.Model):
     description = models.CharField(max_length=128, blank=True, validators=[get_regex_validator('description')])
     amount = models.PositiveSmallIntegerField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     work = models.OneToOneField(StudentWork, on_delete=models.CASCADE)
     grader = models.ForeignKey(CourseMember, on_delete=models.SET_NULL, null=True)
@@ -1,11 +1,15 @@
+from django.core.exceptions import FieldDoesNotExist
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
-from user_accounts.models import TeacherProfile
 from courses.models import CourseMember
 
 
 class BaseIsOwnerOrAllowMethods(BasePermission):
-    """Inherit from this class and specify the below fields to create a concrete IsOwner permission."""
+    """
+    Inherit from this class and specify the below fields to create a concrete IsOwner permission.
+    If *course_member* is True, the owner field should be a foreign key to the CourseMember model, it is compared to the
+    *request.course_member* object set by the CourseMiddleware.
+    """
     owner_field = ''
     course_member = False
     allow_methods = ()
@@ -16,14 +20,17 @@ class BaseIsOwnerOrAllowMethods(BasePermission):
         if request.method in self.allow_methods:
             return True
 
-        owner = getattr(obj, self.owner_field, None)
-        if owner:
-            if self.course_member:
-                return owner.user == request.user
+        # compares ids to not load the related owner object
+        try:
+            owner_id = getattr(obj, obj._meta.get_field(self.owner_field).attname)
+        except FieldDoesNotExist:
+            raise AttributeError('The specified owner field does not exist on a given model.')
 
-            return owner == request.user
+        if self.course_member:
+            course_member = getattr(request, 'course_member', None)
+            return course_member is not None and owner_id == course_member.pk
 
-        raise AttributeError('The specified owner field does not exist on a given model.')
+        return owner_id == request.user.pk
 
 
 class IsGlobalTeacher(BasePermission):
@@ -33,7 +40,7 @@ class IsGlobalTeacher(BasePermission):
     message = 'Only teacher account can perform this action.'
 
     def has_permission(self, request, view):
-        return isinstance(request.user.profile, TeacherProfile)
+        return request.user.is_teacher
 
 
 class IsGlobalTeacherOrReadOnly(IsGlobalTeacher):
@@ -0,0 +1,74 @@
+import re
+
+from django.urls import get_resolver, URLResolver
+
+REGEX_SPECIAL_CHARS = re.compile(r'[\\.^$*+?{}\[\]|()]')
+
+
+class CourseRouteTable:
+    """
+    Classifies request paths as course-scoped (the ones that have a *course_id* parameter) without calling
+    **django.urls.resolve**. The table is compiled once from the URL configuration:
+
+    * every endpoint is compiled into a single full path regex together with the converters of its parameters.
+
+    * the paths that do not start with one of the course-scoped prefixes (e.g. *api/<int:course_id>/*) are rejected by
+    a single prefix check, so non-course paths cost one regex match.
+
+    The endpoints that are not course-scoped are kept in the table if they can shadow a course-scoped one, so the
+    first matched endpoint is the same that the resolver would return.
+    """
+    course_parameter = 'course_id'
+
+    def __init__(self, urlconf=None):
+        self.prefixes = []
+        self.routes = []
+
+        resolver = get_resolver(urlconf)
+        routes = list(self._collect_routes(resolver.url_patterns, resolver.pattern.regex.pattern, {}))
+        literal_prefixes = [self._get_literal_prefix(prefix.pattern) for prefix in self.prefixes]
+
+        for regex, converters, callback in routes:
+            literal_prefix = self._get_literal_prefix(regex)
+            if any(literal_prefix.startswith(prefix) or prefix.startswith(literal_prefix)
+                   for prefix in literal_prefixes):
+                self.routes.append((re.compile(regex), converters, callback))
+
+    def match(self, path):
+        """
+        :param path: a path info of the request
+        :return: a tuple (view, kwargs) if the path is course-scoped, otherwise None
+        """
+        if not any(prefix.match(path) for prefix in self.prefixes):
+            return None
+
+        for regex, converters, callback in self.routes:
+            match = regex.match(path)
+            if match:
+                if self.course_parameter not in converters:
+                    return None
+
+                kwargs = {key: converters[key].to_python(value) if key in converters else value
+                          for key, value in match.groupdict().items() if value is not None}
+                return callback, kwargs
+
+        return None
+
+    def _collect_routes(self, url_patterns, parent_regex, parent_converters):
+        for pattern in url_patterns:
+            regex = parent_regex + pattern.pattern.regex.pattern.lstrip('^')
+            converters = {**parent_converters, **pattern.pattern.converters}
+
+            if isinstance(pattern, URLResolver):
+                if self.course_parameter in pattern.pattern.converters:
+                    self.prefixes.append(re.compile(regex))
+
+                yield from self._collect_routes(pattern.url_patterns, regex, converters)
+            else:
+                yield regex, converters, pattern.callback
+
+    def _get_literal_prefix(self, regex):
+        regex = regex.lstrip('^')
+        special_char = REGEX_SPECIAL_CHARS.search(regex)
+
+        return regex[:special_char.start()] if special_char else regex
@@ -1,5 +1,6 @@
 from rest_framework.serializers import HyperlinkedIdentityField
-from rest_framework.reverse import reverse
+
+from utils.urls import reverse_from_template
 
 
 class CourseRelatedHyperlinkedIdentityField(HyperlinkedIdentityField):
@@ -10,15 +11,16 @@ class CourseRelatedHyperlinkedIdentityField(HyperlinkedIdentityField):
             'pk': obj.pk
         }
 
-        return reverse(view_name, kwargs=url_kwargs, request=request, format=format)
+        return reverse_from_template(view_name, url_kwargs, request=request, format=format)
 
 
 class ChapterRelatedHyperlinkedIdentityField(HyperlinkedIdentityField):
     def get_url(self, obj, view_name, request, format):
         url_kwargs = {
             'course_id': request.resolver_match.kwargs['course_id'],
-            'chapter_id': obj.chapter.pk,
+            # the foreign key column, so the chapter is not loaded for every post
+            'chapter_id': obj.chapter_id,
             'pk': obj.pk
         }
 
-        return reverse(view_name, kwargs=url_kwargs, request=request, format=format)
+        return reverse_from_template(view_name, url_kwargs, request=request, format=format)
@@ -1,29 +1,41 @@
-from courses.models import Course, CourseMember, Material, Task, Grade, Chapter, Attachment, StudentWork
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from courses.models import Course, CourseMember, Material, Task, TaskStats, Grade, Chapter, Attachment, \
+    StudentWork
 from rest_framework import serializers
 
-from utils.serializers import NormalizedModelSerializer
+from utils.serializers import NormalizedModelSerializer, BatchLoadingListSerializer, BulkListSerializer, \
+    SparseFieldsetMixin
 from utils.normalizers import Normalizer
 from user_accounts.serializers import UserAccountPublicSerializer
+from university_structures.models import Group
+from .enrollment import ENROLLMENT_ROLES
+from .stats import update_tasks_stats
 from .serializer_fields import CourseRelatedHyperlinkedIdentityField, ChapterRelatedHyperlinkedIdentityField
 
 
-class CourseSerializer(NormalizedModelSerializer):
+class CourseSerializer(SparseFieldsetMixin, NormalizedModelSerializer):
     owner = UserAccountPublicSerializer(read_only=True)
 
     class Meta:
         model = Course
         fields = '__all__'
         normalize_for_field = {'title': Normalizer.first_capital}
+        expandable_fields = ['owner']
 
 
-class CourseMemberSerializer(serializers.ModelSerializer):
+class CourseMemberSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user = UserAccountPublicSerializer(read_only=True)
     role = serializers.SerializerMethodField()
 
     class Meta:
         model = CourseMember
-        exclude = ['course']
+        exclude = ['course', 'course_group']
         read_only_fields = ['user', 'course', 'role']
+        expandable_fields = ['user']
+        attribute_sources = {'role': ['role']}
 
     def get_role(self, obj):
         for status in obj.STATUSES:
@@ -52,7 +64,7 @@ class AttachmentSerializer(serializers.ModelSerializer):
         return False
 
 
-class BasePostSerializer(NormalizedModelSerializer):
+class BasePostSerializer(SparseFieldsetMixin, NormalizedModelSerializer):
     author = CourseMemberSerializer(read_only=True)
     attachment_set = AttachmentSerializer(many=True, read_only=True)
 
@@ -62,6 +74,10 @@ class BasePostSerializer(NormalizedModelSerializer):
 
         read_only_fields = ['author', 'chapter']
         normalize_for_field = {'title': Normalizer.first_capital}
+        list_serializer_class = BatchLoadingListSerializer
+        batch_loaded_relations = ['attachment_set']
+        expandable_fields = ['author', 'attachment_set']
+        attribute_sources = {'is_planned': ['published_at']}
 
 
 class MaterialSerializer(BasePostSerializer):
@@ -75,12 +91,32 @@ class MaterialNestedSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         fields = ['id', 'title', 'published_at', 'detail_url', 'is_archived', 'is_planned']
         model = Material
+        attribute_sources = {'detail_url': ['chapter'], 'is_planned': ['published_at']}
+
+
+class TaskStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TaskStats
+        fields = ['assigned_count', 'submitted_count', 'graded_count', 'average_grade']
+        attribute_sources = {'average_grade': ['grade_sum', 'graded_count']}
 
 
 class TaskSerializer(BasePostSerializer):
+    """The statistics of the works are selected together with a task and are serialized for the teachers only."""
+    stats = TaskStatsSerializer(read_only=True)
+
     class Meta(BasePostSerializer.Meta):
         model = Task
-        fields = BasePostSerializer.Meta.fields + ['deadline', 'max_grade', 'deadline_passed']
+        fields = BasePostSerializer.Meta.fields + ['deadline', 'max_grade', 'deadline_passed', 'stats']
+        attribute_sources = {**BasePostSerializer.Meta.attribute_sources, 'deadline_passed': ['deadline']}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        course_member = getattr(self.context.get('request'), 'course_member', None)
+        if course_member is not None and not course_member.is_teacher:
+            fields.pop('stats', None)
+
+        return fields
 
 
 class TaskNestedSerializer(serializers.HyperlinkedModelSerializer):
@@ -89,9 +125,10 @@ class TaskNestedSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         fields = ['id', 'title', 'published_at', 'deadline', 'detail_url', 'is_archived', 'is_planned', 'deadline_passed']
         model = Task
+        attribute_sources = {'detail_url': ['chapter'], 'is_planned': ['published_at'], 'deadline_passed': ['deadline']}
 
 
-class ChapterSerializer(NormalizedModelSerializer):
+class ChapterSerializer(SparseFieldsetMixin, NormalizedModelSerializer):
     task_set = TaskNestedSerializer(read_only=True, many=True)
     material_set = MaterialNestedSerializer(read_only=True, many=True)
 
@@ -99,28 +136,135 @@ class ChapterSerializer(NormalizedModelSerializer):
         model = Chapter
         fields = ['id', 'title', 'description', 'created_at', 'task_set', 'material_set']
         normalize_for_field = {'title': Normalizer.first_capital}
+        expandable_fields = ['task_set', 'material_set']
 
 
-class GradeSerializer(serializers.ModelSerializer):
+class GradeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     grader = CourseMemberSerializer(read_only=True)
+    # the task is selected with the work, its max_grade is validated without another query
+    work = serializers.PrimaryKeyRelatedField(queryset=StudentWork.objects.select_related('task'))
 
     class Meta:
         model = Grade
         fields = '__all__'
+        expandable_fields = ['grader']
 
     def validate(self, attrs):
         if not attrs['work'].is_submitted:
             # teacher shouldn`t know that work exists if it has not been yet submitted due to ethical reasons.
             raise serializers.ValidationError('This work is already graded or do not exist.')
 
-        task_instance = StudentWork.objects.get(pk=attrs['work'].pk).task
-        if attrs['amount'] > task_instance.max_grade:
+        if attrs['amount'] > attrs['work'].task.max_grade:
             raise serializers.ValidationError('The amount exceeds the maximum grade for this task.')
 
         return attrs
 
 
-class StudentWorkSerializer(serializers.ModelSerializer):
+class BulkGradeListSerializer(BulkListSerializer):
+    """
+    Validates the grades of many works by a single query: the works must belong to the course of the request, be
+    submitted and not graded, and the amounts must not exceed the maximum grades of their tasks. The grades are
+    created by a single insert and the works are marked as graded by a single update, the caller should save it in a
+    transaction.
+    """
+    def validate_items(self, items, errors):
+        work_ids = [item['work_id'] for item in items if item is not None]
+        # the works are locked, so they are not graded concurrently until the transaction is committed
+        works = {work['pk']: work for work in StudentWork.objects.filter(
+            pk__in=work_ids,
+            task__chapter__course=self.context['request'].course
+        ).select_for_update(of=('self', )).values('pk', 'status', 'task_id', 'task__max_grade')}
+
+        # the tasks of the works are used to update their statistics
+        self.work_task_ids = {work['pk']: work['task_id'] for work in works.values()}
+
+        graded_work_ids = set()
+        for item, item_errors in zip(items, errors):
+            if item is None:
+                continue
+
+            work = works.get(item['work_id'])
+            if work is None or work['status'] != StudentWork.SUBMITTED:
+                item_errors['work'] = ['This work is already graded or do not exist.']
+            elif item['work_id'] in graded_work_ids:
+                item_errors['work'] = ['This work is graded more than once.']
+            elif item['amount'] > work['task__max_grade']:
+                item_errors['amount'] = ['The amount exceeds the maximum grade for this task.']
+
+            graded_work_ids.add(item['work_id'])
+
+    def create(self, validated_data):
+        work_ids = [item['work_id'] for item in validated_data]
+        Grade.objects.bulk_create([Grade(**item) for item in validated_data])
+        # bulk_create() does not set the primary keys on every backend (e.g. SQLite), the grades are selected back
+        grades = {grade.work_id: grade for grade in Grade.objects.filter(work__in=work_ids)}
+        StudentWork.objects.filter(pk__in=work_ids).update(
+            status=StudentWork.GRADED
+        )
+
+        deltas = defaultdict(Counter)
+        for item in validated_data:
+            task_deltas = deltas[self.work_task_ids[item['work_id']]]
+            task_deltas.update({'submitted_count': -1, 'graded_count': 1, 'grade_sum': item['amount']})
+        update_tasks_stats(deltas)
+
+        return [grades[work_id] for work_id in work_ids]
+
+
+class BulkGradeSerializer(serializers.ModelSerializer):
+    """An item of the bulk grading, use it with many=True (see **BulkGradeListSerializer**)."""
+    work = serializers.IntegerField(source='work_id')
+
+    class Meta:
+        model = Grade
+        fields = ['id', 'work', 'amount', 'description']
+        list_serializer_class = BulkGradeListSerializer
+
+
+class BulkEnrollmentListSerializer(BulkListSerializer):
+    """Rejects the emails that are listed more than once, the users are resolved by courses.enrollment."""
+    @property
+    def max_items(self):
+        return settings.BULK_ENROLLMENT_MAX_MEMBERS
+
+    def validate_items(self, items, errors):
+        emails = set()
+        for item, item_errors in zip(items, errors):
+            if item is None:
+                continue
+
+            if item['email'] in emails:
+                item_errors['email'] = ['This email is listed more than once.']
+            emails.add(item['email'])
+
+
+class BulkEnrollmentSerializer(serializers.Serializer):
+    """An item of the bulk enrollment, use it with many=True. The member type is validated into a *role*."""
+    email = serializers.EmailField()
+    member_type = serializers.ChoiceField(choices=list(ENROLLMENT_ROLES), default='student')
+
+    class Meta:
+        list_serializer_class = BulkEnrollmentListSerializer
+
+    def validate(self, attrs):
+        return {'email': attrs['email'], 'role': ENROLLMENT_ROLES[attrs['member_type']]}
+
+
+class GroupEnrollmentSerializer(serializers.Serializer):
+    """Validates the groups of a group enrollment by a single query."""
+    groups = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=100)
+    sync_members = serializers.BooleanField(default=False)
+
+    def validate_groups(self, value):
+        group_ids = set(value)
+        missing_ids = group_ids - set(Group.objects.filter(pk__in=group_ids).values_list('pk', flat=True))
+        if missing_ids:
+            raise serializers.ValidationError(f'Groups {sorted(missing_ids)} do not exist.')
+
+        return sorted(group_ids)
+
+
+class StudentWorkSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     owner = CourseMemberSerializer(read_only=True)
     attachment_set = AttachmentSerializer(read_only=True, many=True)
     grade = GradeSerializer(read_only=True)
@@ -129,3 +273,6 @@ class StudentWorkSerializer(serializers.ModelSerializer):
         model = StudentWork
         fields = '__all__'
         read_only_fields = ['owner', 'submitted_at', 'task', 'status']
+        list_serializer_class = BatchLoadingListSerializer
+        batch_loaded_relations = ['attachment_set']
+        expandable_fields = ['owner', 'attachment_set', 'grade']
@@ -0,0 +1,181 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from user_accounts.models import UserAccount, StudentProfile
+from utils.cache import LocalLRUCache
+from .cache import membership_cache, chapter_list_cache
+from .enrollment import sync_student_group
+from .stats import rebuild_task_stats, schedule_rebuild
+from .models import Attachment, Chapter, Course, CourseMember, Grade, Material, StudentWork, Task, TaskStats
+
+# chapter_id -> course_id, a chapter is never moved to another course. It lets the posts deleted by the cascade of
+# a chapter find their course without a query per post.
+chapter_courses = LocalLRUCache(4096)
+
+
+@receiver(post_save, sender=CourseMember)
+@receiver(post_delete, sender=CourseMember)
+def invalidate_course_memberships(sender, instance, **kwargs):
+    membership_cache.invalidate(instance.user_id)
+    # the map could be cached again by a concurrent request before the transaction is committed
+    transaction.on_commit(lambda: membership_cache.invalidate(instance.user_id))
+
+
+@receiver(post_save, sender=UserAccount)
+def invalidate_new_user_memberships(sender, instance, created, **kwargs):
+    # a stale map could be left for a reused primary key (e.g. after a rolled back transaction)
+    if created:
+        membership_cache.invalidate(instance.pk)
+
+
+@receiver(post_init, sender=StudentProfile)
+def remember_student_group(sender, instance, **kwargs):
+    # the group is read from __dict__, so a deferred field is not loaded
+    instance._synced_group_id = instance.__dict__.get('group_id')
+
+
+@receiver(post_save, sender=StudentProfile)
+def sync_joined_student_group(sender, instance, created, **kwargs):
+    previous_group_id = None if created else instance._synced_group_id
+    if previous_group_id != instance.group_id:
+        sync_student_group(instance.user_id, previous_group_id, instance.group_id)
+        instance._synced_group_id = instance.group_id
+
+
+@receiver(post_delete, sender=StudentProfile)
+def sync_left_student_group(sender, instance, **kwargs):
+    sync_student_group(instance.user_id, instance.group_id, None)
+
+
+def invalidate_chapter_list(course_id):
+    if course_id is None:
+        return
+
+    chapter_list_cache.invalidate(course_id)
+    # the chapters could be cached again by a concurrent request before the transaction is committed
+    transaction.on_commit(lambda: chapter_list_cache.invalidate(course_id))
+
+
+def get_chapter_course_id(chapter_id):
+    course_id = chapter_courses.get(chapter_id)
+    if course_id is None:
+        course_id = Chapter.objects.filter(pk=chapter_id).values_list('course_id', flat=True).first()
+        chapter_courses.set(chapter_id, course_id)
+
+    return course_id
+
+
+@receiver(post_save, sender=Course)
+def invalidate_new_course_chapters(sender, instance, created, **kwargs):
+    # stale chapters could be left for a reused primary key
+    if created:
+        chapter_list_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Task)
+def create_task_stats(sender, instance, created, **kwargs):
+    if created:
+        TaskStats.objects.create(task=instance)
+
+
+# the fields of the works and the grades that the statistics of the tasks are computed from
+WORK_COUNTED_FIELDS = ('task_id', 'status')
+GRADE_COUNTED_FIELDS = ('work_id', 'amount')
+
+
+def get_counted_state(instance, fields):
+    # the fields are read from __dict__, so a deferred field is not loaded
+    return tuple(instance.__dict__.get(field) for field in fields)
+
+
+def is_counted_change(instance, fields, created, update_fields):
+    if created:
+        return True
+    # update_fields may name a foreign key by its field name or by its attname
+    field_names = set(fields) | {field[:-len('_id')] for field in fields if field.endswith('_id')}
+    if update_fields is not None and not field_names & set(update_fields):
+        return False
+
+    return get_counted_state(instance, fields) != instance._counted_state
+
+
+@receiver(post_init, sender=StudentWork)
+@receiver(post_init, sender=Grade)
+def remember_counted_state(sender, instance, **kwargs):
+    instance._counted_state = get_counted_state(
+        instance, WORK_COUNTED_FIELDS if sender is StudentWork else GRADE_COUNTED_FIELDS
+    )
+
+
+@receiver(post_save, sender=StudentWork)
+def rebuild_saved_work_task_stats(sender, instance, created, update_fields=None, **kwargs):
+    # the saves that do not change the counters (e.g. an edited answer) do not rebuild them
+    if is_counted_change(instance, WORK_COUNTED_FIELDS, created, update_fields):
+        previous_task_id, _ = instance._counted_state
+        if previous_task_id not in (None, instance.task_id):
+            schedule_rebuild(task_id=previous_task_id)
+
+        schedule_rebuild(task_id=instance.task_id)
+        instance._counted_state = get_counted_state(instance, WORK_COUNTED_FIELDS)
+
+
+@receiver(post_delete, sender=StudentWork)
+def rebuild_deleted_work_task_stats(sender, instance, **kwargs):
+    # the works deleted by a cascade (e.g. of a course member) are counted by a single rebuild per transaction
+    schedule_rebuild(task_id=instance.task_id)
+
+
+@receiver(post_save, sender=Grade)
+def rebuild_saved_grade_task_stats(sender, instance, created, update_fields=None, **kwargs):
+    if is_counted_change(instance, GRADE_COUNTED_FIELDS, created, update_fields):
+        previous_work_id, _ = instance._counted_state
+        if previous_work_id not in (None, instance.work_id):
+            schedule_rebuild(work_id=previous_work_id)
+
+        schedule_rebuild(work_id=instance.work_id)
+        instance._counted_state = get_counted_state(instance, GRADE_COUNTED_FIELDS)
+
+
+@receiver(post_delete, sender=Grade)
+def rebuild_deleted_grade_task_stats(sender, instance, **kwargs):
+    schedule_rebuild(work_id=instance.work_id)
+
+
+def backfill_task_stats(sender, using='default', **kwargs):
+    """Creates the statistics of the tasks that have not got them, e.g. the ones created before the counters."""
+    rebuild_task_stats(Task.objects.using(using).filter(stats__isnull=True))
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(pre_delete, sender=Chapter)
+def remember_chapter_course(sender, instance, **kwargs):
+    chapter_courses.set(instance.pk, instance.course_id)
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_delete, sender=Chapter)
+def invalidate_course_chapters(sender, instance, **kwargs):
+    invalidate_chapter_list(instance.course_id)
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def invalidate_post_chapters(sender, instance, **kwargs):
+    if sender.chapter.is_cached(instance):
+        invalidate_chapter_list(instance.chapter.course_id)
+    else:
+        invalidate_chapter_list(get_chapter_course_id(instance.chapter_id))
+
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def invalidate_attachment_chapters(sender, instance, **kwargs):
+    model = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    if model in (Material, Task):
+        chapter_id = model.objects.filter(pk=instance.object_id).values_list('chapter_id', flat=True).first()
+        if chapter_id is not None:
+            invalidate_chapter_list(get_chapter_course_id(chapter_id))
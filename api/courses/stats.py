@@ -0,0 +1,154 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import StudentWork, Task, TaskStats
+
+STATUS_COUNTERS = {
+    StudentWork.ASSIGNED: 'assigned_count',
+    StudentWork.SUBMITTED: 'submitted_count',
+    StudentWork.GRADED: 'graded_count',
+}
+
+# set by **tracked_changes**, the changes are counted by the caller
+_tracked = ContextVar('task_stats_tracked', default=False)
+
+
+def update_task_stats(task_id, **deltas):
+    """
+    Adds the deltas to the counters of a task by a single UPDATE with F() expressions, so the concurrent updates are
+    not lost. The statistics of a task that has not got them yet are rebuilt.
+    :param deltas: the counter names (see TaskStats) and the numbers that are added to them
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    updated_number = TaskStats.objects.filter(task=task_id).update(
+        updated_at=timezone.now(),
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+    if not updated_number:
+        rebuild_task_stats(Task.objects.filter(pk=task_id))
+
+
+def move_work(task_id, previous_status, status, grade_delta=0):
+    """
+    Moves a work of a task from the counter of its previous status to the counter of its current one.
+    :param previous_status: the previous status of the work, None if the work is created
+    :param status: the current status of the work, None if the work is deleted
+    :param grade_delta: the amount of a grade that is added to (or subtracted from) the sum of the grades
+    """
+    deltas = Counter({'grade_sum': grade_delta})
+    if previous_status != status:
+        if previous_status is not None:
+            deltas[STATUS_COUNTERS[previous_status]] -= 1
+        if status is not None:
+            deltas[STATUS_COUNTERS[status]] += 1
+
+    update_task_stats(task_id, **deltas)
+
+
+def update_tasks_stats(deltas):
+    """
+    :param deltas: a dict in format task_id:deltas, the statistics are updated by a query per task
+    """
+    # the rows are locked in the same order by the concurrent transactions
+    for task_id in sorted(deltas):
+        update_task_stats(task_id, **deltas[task_id])
+
+
+def rebuild_task_stats(tasks):
+    """
+    Computes the statistics of the tasks from their works and grades by a single aggregate query and replaces the
+    stored ones, e.g. after the works were changed by the code that does not maintain the counters.
+    :param tasks: a queryset of the Task model
+    :return: the number of the rebuilt statistics
+    """
+    annotations = {
+        name: Count('studentwork', filter=Q(studentwork__status=status)) for status, name in STATUS_COUNTERS.items()
+    }
+    annotations['grade_sum'] = Sum('studentwork__grade__amount')
+
+    with transaction.atomic():
+        # the concurrent updates of the counters wait for the rebuild, so they are not lost
+        list(TaskStats.objects.select_for_update().filter(task__in=tasks.order_by()).values_list('pk'))
+
+        now = timezone.now()
+        stats = [
+            TaskStats(task_id=values.pop('pk'), updated_at=now, **{**values, 'grade_sum': values['grade_sum'] or 0})
+            for values in tasks.order_by().annotate(**annotations).values('pk', *annotations)
+        ]
+
+        TaskStats.objects.filter(task__in=[task_stats.task_id for task_stats in stats]).delete()
+        TaskStats.objects.bulk_create(stats)
+
+    return len(stats)
+
+
+@contextmanager
+def tracked_changes():
+    """
+    Marks the changes of the works and the grades made in the block as counted by the caller (see **move_work**), so
+    the signal handlers do not schedule the rebuild of their statistics.
+    """
+    token = _tracked.set(True)
+    try:
+        yield
+    finally:
+        _tracked.reset(token)
+
+
+class PendingRebuild:
+    """
+    The tasks whose statistics are rebuilt after the transaction is committed. A single instance is registered by
+    a transaction, so the tasks changed by a cascade are rebuilt by one aggregate query.
+    """
+    def __init__(self):
+        self.task_ids = set()
+        self.work_ids = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        task_ids = set(self.task_ids)
+        if self.work_ids:
+            task_ids.update(StudentWork.objects.filter(pk__in=self.work_ids).values_list('task_id', flat=True))
+
+        rebuild_task_stats(Task.objects.filter(pk__in=task_ids))
+
+
+def schedule_rebuild(task_id=None, work_id=None):
+    """
+    Schedules the rebuild of the statistics of a task whose works or grades were changed by the code that does not
+    count the changes: the cascades (e.g. of a user account or of the members removed by a group link), the admin
+    site, the shell. It is called by the signal handlers of StudentWork and Grade, the changes made in
+    **tracked_changes** block are skipped.
+
+    NOTE: bulk_create(), update() and the raw queries do not send the signals, the code that uses them should update
+    the counters (see **update_tasks_stats**) or rebuild the statistics itself.
+    :param work_id: a work of the task, used if the task is not known (e.g. by a grade)
+    """
+    if _tracked.get():
+        return
+
+    connection = transaction.get_connection()
+    pending = next((
+        entry[1] for entry in connection.run_on_commit if isinstance(entry[1], PendingRebuild) and not entry[1].done
+    ), None)
+    is_new = pending is None
+    if is_new:
+        pending = PendingRebuild()
+
+    if task_id is not None:
+        pending.task_ids.add(task_id)
+    if work_id is not None:
+        pending.work_ids.add(work_id)
+
+    if is_new:
+        # called at once outside of a transaction
+        transaction.on_commit(pending)
@@ -0,0 +1,31 @@
+from Desk2.celery import app
+
+from .enrollment import enroll_members, EnrollmentJob
+from .models import Course
+
+
+@app.task
+def enroll_course_members(course_id, job_id, members):
+    """
+    Enrolls a long list of members to a course asynchronously using celery queue. Every chunk is committed by
+    itself, so the progress stored by **EnrollmentJob** is the number of the processed members.
+    """
+    job = EnrollmentJob(course_id, job_id)
+    course = Course.objects.filter(pk=course_id).first()
+    if course is None:
+        job.set_state(EnrollmentJob.FAILED, total=len(members))
+        return None
+
+    job.set_state(EnrollmentJob.RUNNING, total=len(members))
+    try:
+        report = enroll_members(
+            course,
+            members,
+            on_progress=lambda processed, total: job.set_state(EnrollmentJob.RUNNING, processed, total)
+        )
+    except Exception:
+        job.set_state(EnrollmentJob.FAILED, total=len(members))
+        raise
+
+    job.set_state(EnrollmentJob.DONE, len(members), len(members), report)
+    return report
@@ -1,8 +1,10 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
 from courses.views import CourseViewSet, GradeViewSet, TaskViewSet, ChapterViewSet, CourseMemberViewSet, \
-    StudentWorkViewSet, MaterialViewSet
+    StudentWorkViewSet, MaterialViewSet, GradebookView
+from utils.views import with_async_read_views
 
 display_per_course_router = DefaultRouter()
 
@@ -21,9 +23,24 @@ student_work_router.register('student-works', StudentWorkViewSet)
 courses_router = DefaultRouter()
 courses_router.register('courses', CourseViewSet)
 
-urlpatterns = [
-    path('', include(courses_router.urls)),
-    path('<int:course_id>/', include(display_per_course_router.urls)),
-    path('<int:course_id>/<int:chapter_id>/', include(display_per_chapter_router.urls)),
-    path('<int:course_id>/<int:chapter_id>/tasks/<int:task_id>/', include(student_work_router.urls)),
-]
+# the url names of the hottest read endpoints: students polling a course list its chapters and open their content
+ASYNC_READ_VIEW_NAMES = ('course-list', 'chapter-list', 'material-detail', 'task-detail')
+
+
+def get_urlpatterns(async_read_views=False):
+    """
+    :param async_read_views: whether to serve the endpoints of *ASYNC_READ_VIEW_NAMES* by async views
+    """
+    def get_router_urls(router):
+        return with_async_read_views(router.urls, ASYNC_READ_VIEW_NAMES) if async_read_views else router.urls
+
+    return [
+        path('', include(get_router_urls(courses_router))),
+        path('<int:course_id>/gradebook/', GradebookView.as_view(), name='gradebook'),
+        path('<int:course_id>/', include(get_router_urls(display_per_course_router))),
+        path('<int:course_id>/<int:chapter_id>/', include(get_router_urls(display_per_chapter_router))),
+        path('<int:course_id>/<int:chapter_id>/tasks/<int:task_id>/', include(student_work_router.urls)),
+    ]
+
+
+urlpatterns = get_urlpatterns(settings.ASYNC_READ_VIEWS)
@@ -1,25 +1,45 @@
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Prefetch
 from django.contrib.contenttypes.models import ContentType
+from django.core.handlers.asgi import ASGIRequest
 from django.core.validators import validate_email, ValidationError
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from kombu.exceptions import OperationalError
 
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 from rest_framework import mixins
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 
 from courses.models import Course, CourseMember, Task, Grade, Chapter, Attachment, StudentWork, Material
 from courses.serializers import CourseSerializer, GradeSerializer, TaskSerializer, AttachmentSerializer, \
-    ChapterSerializer, CourseMemberSerializer, StudentWorkSerializer, MaterialSerializer
+    ChapterSerializer, CourseMemberSerializer, StudentWorkSerializer, MaterialSerializer, BulkGradeSerializer, \
+    BulkEnrollmentSerializer, GroupEnrollmentSerializer
+from .cache import membership_cache, chapter_list_cache
+from .conditional import get_chapters_state, get_posts_state
+from .enrollment import ENROLLMENT_ROLES, EnrollmentJob, enroll_groups, enroll_members, link_groups, \
+    read_enrollment_csv
+from .gradebook import Gradebook
 from .permissions import IsGlobalTeacherOrReadOnly, BaseIsOwnerOrAllowMethods, BaseIsTeacherOrAllowMethods, IsTeacher,\
     IsStudent, IsActiveTask, IsEditableStudentWork
-from user_accounts.models import TeacherProfile, UserAccount
+from .stats import move_work, tracked_changes
+from .tasks import enroll_course_members
+from user_accounts.models import UserAccount
+from utils.pagination import CursorPagination
+from utils.renderers import CSVRenderer, iter_csv
+from utils.views import ConditionalGetMixin, QuerysetOptimizationMixin, ResponseCacheMixin, SparseFieldsetViewMixin
 
 
-class CourseViewSet(ModelViewSet):
+class CourseViewSet(QuerysetOptimizationMixin, SparseFieldsetViewMixin, ModelViewSet):
     class IsOwnerOrReadOnly(BaseIsOwnerOrAllowMethods):
         owner_field = 'owner'
         allow_methods = SAFE_METHODS
@@ -27,6 +47,8 @@ class CourseViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated, IsGlobalTeacherOrReadOnly, IsOwnerOrReadOnly]
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
+    pagination_class = CursorPagination
+    ordering = '-created_at'
 
     def perform_create(self, serializer):
         course = serializer.save(owner=self.request.user)
@@ -34,12 +56,19 @@ class CourseViewSet(ModelViewSet):
 
     def get_queryset(self):
         if self.request.GET.get('enrolled', False):
+            memberships = membership_cache.get(self.request.user)
+            if memberships is not None:
+                return self.queryset.filter(pk__in=memberships.keys())
+
             return self.queryset.filter(coursemember__in=self.request.user.get_course_members_queryset())
 
-        return self.queryset
+        # the class-level queryset is not returned as is, otherwise its result cache is shared by the requests
+        return super().get_queryset()
 
 
-class CourseMemberViewSet(mixins.CreateModelMixin,
+class CourseMemberViewSet(QuerysetOptimizationMixin,
+                          SparseFieldsetViewMixin,
+                          mixins.CreateModelMixin,
                           mixins.RetrieveModelMixin,
                           mixins.ListModelMixin,
                           mixins.DestroyModelMixin,
@@ -54,6 +83,9 @@ class CourseMemberViewSet(mixins.CreateModelMixin,
     permission_classes = [IsAuthenticated, IsTeacherOrForbidDelete | IsOwnerOrForbidDelete]
     queryset = CourseMember.objects.all()
     serializer_class = CourseMemberSerializer
+    pagination_class = CursorPagination
+    ordering = 'created_at'
+    page_size = 50
     db_exception_msg = 'You are already enrolled in this course.'
 
     def get_queryset(self):
@@ -84,18 +116,78 @@ class CourseMemberViewSet(mixins.CreateModelMixin,
             return Response({'email': 'Please enter a valid email.'}, status=status.HTTP_400_BAD_REQUEST)
 
         user = get_object_or_404(UserAccount, email=email)
-        if not isinstance(user.profile, TeacherProfile) and member_type == 'teacher':
+        if not user.is_teacher and member_type == 'teacher':
             return Response({'detail': 'Only teacher accounts can be added as teacher to the course.'})
 
         CourseMember.objects.create(user=user, course=self.request.course, role=role)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    def _get_role(self, member_type):
-        if member_type == 'teacher':
-            return CourseMember.TEACHER
+    @action(methods=['POST'], detail=False, url_path='bulk', permission_classes=[IsAuthenticated, IsTeacher],
+            parser_classes=[JSONParser, MultiPartParser])
+    def bulk_add(self, request, **kwargs):
+        """
+        Adds many teachers and students to the course by their email addresses. Expects a list of objects in format
+        {email, member_type} or a CSV file uploaded as *file* with the same columns (the member type is a student by
+        default). Returns the lists of the added, already enrolled and unknown emails (see
+        courses.enrollment.enroll_members). The lists longer than *BULK_ENROLLMENT_SYNC_LIMIT* are enrolled by a celery
+        worker, the response refers to the status of the job.
+        """
+        data = read_enrollment_csv(request.FILES['file']) if 'file' in request.FILES else request.data
+        serializer = BulkEnrollmentSerializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        members = [dict(member) for member in serializer.validated_data]
+
+        if len(members) > settings.BULK_ENROLLMENT_SYNC_LIMIT:
+            job = EnrollmentJob(request.course.pk)
+            job.set_state(EnrollmentJob.PENDING, total=len(members))
+            try:
+                enroll_course_members.apply_async((request.course.pk, job.job_id, members), task_id=job.job_id,
+                                                  retry=False)
+            except OperationalError:
+                job.set_state(EnrollmentJob.FAILED, total=len(members))
+                return Response({'detail': 'The enrollment queue is not available, try again later.'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            return Response({
+                'job': job.job_id,
+                'status': reverse('coursemember-bulk-status', kwargs={'course_id': request.course.pk,
+                                                                      'job_id': job.job_id}, request=request),
+                'total': len(members),
+            }, status=status.HTTP_202_ACCEPTED)
+
+        with transaction.atomic():
+            report = enroll_members(request.course, members)
+
+        return Response(report)
+
+    @action(methods=['GET'], detail=False, url_path=r'bulk/(?P<job_id>[0-9a-f]{32})',
+            permission_classes=[IsAuthenticated, IsTeacher])
+    def bulk_status(self, request, job_id, **kwargs):
+        """Returns the progress of a bulk enrollment job of the course, the report is set when the job is done."""
+        state = EnrollmentJob(request.course.pk, job_id).get_state()
+        if state is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(state)
+
+    @action(methods=['POST'], detail=False, url_path='add-groups', permission_classes=[IsAuthenticated, IsTeacher])
+    def add_groups(self, request, **kwargs):
+        """
+        Enrolls all the students of academic groups as students of the course, expects an object in format
+        {groups, sync_members}. If *sync_members* is set, the students that join or leave the groups later are
+        enrolled to or removed from the course (see courses.enrollment.sync_student_group).
+        """
+        serializer = GroupEnrollmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            link_groups(request.course, serializer.validated_data['groups'], serializer.validated_data['sync_members'])
+            added_number = enroll_groups(request.course, serializer.validated_data['groups'])
+
+        return Response({'added': added_number})
 
-        if member_type == 'student':
-            return CourseMember.STUDENT
+    def _get_role(self, member_type):
+        return ENROLLMENT_ROLES.get(member_type)
 
 
 class AttachmentMixin:
@@ -128,7 +220,8 @@ class AttachmentMixin:
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class MaterialViewSet(ModelViewSet, AttachmentMixin):
+class MaterialViewSet(QuerysetOptimizationMixin, SparseFieldsetViewMixin, ConditionalGetMixin, ModelViewSet,
+                      AttachmentMixin):
 
     class IsTeacherOrReadOnly(BaseIsTeacherOrAllowMethods):
         allow_methods = SAFE_METHODS
@@ -145,10 +238,13 @@ class MaterialViewSet(ModelViewSet, AttachmentMixin):
     permission_classes = [IsAuthenticated, IsTeacherOrReadOnly, IsOwnerOrAllowCreate]
     queryset = Material.objects.all()
     serializer_class = MaterialSerializer
+    pagination_class = CursorPagination
+    # the lookups of the modification times of the related rows serialized for the teachers
+    related_modifications = ()
 
     def get_queryset(self):
-        queryset = self.queryset.filter(chapter=self.request.chapter).\
-            select_related('chapter').select_related('author')
+        # the author is selected by QuerysetOptimizationMixin if it is serialized
+        queryset = self.queryset.filter(chapter=self.request.chapter)
 
         if not self.request.course_member.is_teacher:
             return queryset.filter(is_archived=False, published_at__lte=timezone.now())
@@ -158,6 +254,19 @@ class MaterialViewSet(ModelViewSet, AttachmentMixin):
     def perform_create(self, serializer):
         serializer.save(author=self.request.course_member, chapter=self.request.chapter)
 
+    def get_validators(self):
+        # the posts are not filtered by the visibility, the role and the boundaries determine the visible ones
+        posts = self.queryset.filter(chapter=self.request.chapter)
+        if self.action == 'retrieve':
+            if not self.kwargs['pk'].isdigit():
+                return None, None
+            posts = posts.filter(pk=self.kwargs['pk'])
+
+        related_modifications = self.related_modifications if self.request.course_member.is_teacher else ()
+        state, last_modified = get_posts_state(posts, timezone.now(), related_modifications)
+        # the deleted posts do not change the modification time of a list
+        return [self.request.course_member.role] + state, last_modified if self.action == 'retrieve' else None
+
     def get_permissions(self):
         permission_classes = self.permission_classes
 
@@ -170,9 +279,12 @@ class MaterialViewSet(ModelViewSet, AttachmentMixin):
 class TaskViewSet(MaterialViewSet):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
+    related_modifications = ('stats__updated_at', )
 
 
-class GradeViewSet(mixins.CreateModelMixin,
+class GradeViewSet(QuerysetOptimizationMixin,
+                   SparseFieldsetViewMixin,
+                   mixins.CreateModelMixin,
                    mixins.ListModelMixin,
                    mixins.DestroyModelMixin,
                    GenericViewSet):
@@ -187,6 +299,9 @@ class GradeViewSet(mixins.CreateModelMixin,
     permission_classes = [IsAuthenticated, IsTeacherOrReadOnly, IsOwnerOrAllowCreate]
     queryset = Grade.objects.all()
     serializer_class = GradeSerializer
+    pagination_class = CursorPagination
+    ordering = '-created_at'
+    page_size = 50
 
     def get_queryset(self):
         if not self.request.course_member.is_teacher:
@@ -207,48 +322,120 @@ class GradeViewSet(mixins.CreateModelMixin,
         return queryset
 
     def perform_create(self, serializer):
-        instance = serializer.save(grader=self.request.course_member)
-        student_work = instance.work
-        student_work.status = student_work.GRADED
-        student_work.save()
+        with transaction.atomic(), tracked_changes():
+            instance = serializer.save(grader=self.request.course_member)
+            student_work = instance.work
+            previous_status = student_work.status
+            student_work.status = student_work.GRADED
+            student_work.save()
+            move_work(student_work.task_id, previous_status, student_work.status, instance.amount)
 
     def perform_destroy(self, instance):
-        student_work = instance.work
-        student_work.status = student_work.SUBMITTED
-        student_work.save()
-        instance.delete()
-
-
-class ChapterViewSet(ModelViewSet):
+        with transaction.atomic(), tracked_changes():
+            student_work = instance.work
+            previous_status = student_work.status
+            student_work.status = student_work.SUBMITTED
+            student_work.save()
+            instance.delete()
+            move_work(student_work.task_id, previous_status, student_work.status, -instance.amount)
+
+    @action(methods=['POST'], detail=False, url_path='bulk')
+    def bulk_create(self, request, **kwargs):
+        """
+        Grades many works at once, expects a list of objects in format {work, amount, description}. Nothing is saved
+        if any item is invalid, the errors are returned per item.
+        """
+        serializer = BulkGradeSerializer(data=request.data, many=True, context=self.get_serializer_context())
+
+        with transaction.atomic():
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            serializer.save(grader=request.course_member)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class GradebookView(APIView):
+    """
+    Returns a students x tasks matrix of the grades of a course with the statistics of every task (see
+    courses.gradebook.Gradebook). The CSV output (*?format=csv* or *Accept: text/csv*) is streamed row by row.
+    """
+    permission_classes = [IsAuthenticated, IsTeacher]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CSVRenderer]
+
+    def get(self, request, **kwargs):
+        gradebook = Gradebook(request.course)
+        if request.accepted_renderer.format != CSVRenderer.format:
+            return Response(gradebook.get_matrix())
+
+        rows = gradebook.iter_csv_rows()
+        if isinstance(request._request, ASGIRequest):
+            # the ASGI handler iterates the streaming content in the event loop, where the database cannot be used
+            rows = list(rows)
+
+        response = StreamingHttpResponse(iter_csv(rows), content_type=CSVRenderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="gradebook-{request.course.pk}.csv"'
+        return response
+
+
+class ChapterViewSet(QuerysetOptimizationMixin, SparseFieldsetViewMixin, ConditionalGetMixin, ResponseCacheMixin,
+                     ModelViewSet):
     class IsTeacherOrReadOnly(BaseIsTeacherOrAllowMethods):
         allow_methods = SAFE_METHODS
 
     permission_classes = [IsAuthenticated, IsTeacherOrReadOnly]
     serializer_class = ChapterSerializer
     queryset = Chapter.objects.all()
+    next_boundary = None
 
     def get_queryset(self):
         queryset = self.queryset.filter(course=self.request.course)
         if not self.request.course_member.is_teacher:
-            return queryset.prefetch_related(
-                Prefetch('material_set', queryset=Material.objects.filter(
-                    is_archived=False,
-                    published_at__lte=timezone.now()
-                ))
-            ).prefetch_related(
-                Prefetch('task_set', queryset=Task.objects.filter(
-                    is_archived=False,
-                    published_at__lte=timezone.now()
-                ))
-            )
-
-        return queryset.prefetch_related('material_set').prefetch_related('task_set')
+            # the posts are prefetched only if they are serialized (see SparseFieldsetViewMixin), the teachers get
+            # them prefetched by QuerysetOptimizationMixin
+            optimization = self.get_queryset_optimization(Chapter)
+            for lookup, model in (('material_set', Material), ('task_set', Task)):
+                if lookup in optimization.prefetch_related:
+                    queryset = queryset.prefetch_related(Prefetch(lookup, queryset=optimization.get_prefetch_queryset(
+                        lookup,
+                        model.objects.filter(is_archived=False, published_at__lte=timezone.now())
+                    )))
+
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(course=self.request.course)
 
+    def get_validators(self):
+        chapter_id = None
+        if self.action == 'retrieve':
+            if not self.kwargs['pk'].isdigit():
+                return None, None
+            chapter_id = self.kwargs['pk']
+
+        # the boundary is selected before the posts are filtered by the publication time, so the cached data
+        # expires when the next post is published even if it is published while the request is processed
+        state, self.next_boundary = get_chapters_state(self.request.course, timezone.now(), chapter_id)
+        # the deleted chapters and posts do not change the modification time
+        return [self.request.course_member.role] + state if state is not None else None, None
+
+    def get_cached_data(self):
+        return chapter_list_cache.get(self.request.course.pk, self._get_cache_key())
+
+    def cache_data(self, data):
+        chapter_list_cache.set(self.request.course.pk, self._get_cache_key(), data, self.next_boundary)
 
-class StudentWorkViewSet(mixins.CreateModelMixin,
+    def _get_cache_key(self):
+        # the teachers see the archived and planned posts. The absolute url identifies the chapter set, the
+        # fieldset and the host of the hyperlinks.
+        role_class = 'teacher' if self.request.course_member.is_teacher else 'member'
+        return f'{role_class}:{self.request.build_absolute_uri()}'
+
+
+class StudentWorkViewSet(QuerysetOptimizationMixin,
+                         SparseFieldsetViewMixin,
+                         mixins.CreateModelMixin,
                          mixins.ListModelMixin,
                          mixins.DestroyModelMixin,
                          mixins.UpdateModelMixin,
@@ -260,6 +447,10 @@ class StudentWorkViewSet(mixins.CreateModelMixin,
 
     queryset = StudentWork.objects.all()
     serializer_class = StudentWorkSerializer
+    pagination_class = CursorPagination
+    # the cursor needs a non-null unique position, submitted_at is null for the works that are not submitted
+    ordering = 'id'
+    page_size = 50
     db_exception_msg = 'You have already created the StudentWork object for this task.'
 
     def get_queryset(self):
@@ -271,7 +462,14 @@ class StudentWorkViewSet(mixins.CreateModelMixin,
         return queryset.filter(status__in=(StudentWork.GRADED, StudentWork.SUBMITTED))
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.course_member, task=self.request.task)
+        with transaction.atomic(), tracked_changes():
+            instance = serializer.save(owner=self.request.course_member, task=self.request.task)
+            move_work(instance.task_id, None, instance.status)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(), tracked_changes():
+            instance.delete()
+            move_work(instance.task_id, instance.status, None)
 
     def get_permissions(self):
         permission_classes = [IsAuthenticated]
@@ -297,10 +495,13 @@ class StudentWorkViewSet(mixins.CreateModelMixin,
     def submit(self, request, **kwargs):
         instance = self.get_object()
         if not instance.is_graded:
+            previous_status = instance.status
             instance.status = instance.SUBMITTED
             instance.submitted_at = timezone.now()
 
-            instance.save()
+            with transaction.atomic(), tracked_changes():
+                instance.save()
+                move_work(instance.task_id, previous_status, instance.status)
             return Response(self.serializer_class(instance).data, status=status.HTTP_200_OK)
 
         return Response({'detail': 'This work is already graded.'}, status=status.HTTP_403_FORBIDDEN)
@@ -309,10 +510,13 @@ class StudentWorkViewSet(mixins.CreateModelMixin,
     def unsubmit(self, request, **kwargs):
         instance = self.get_object()
         if not instance.is_graded:
+            previous_status = instance.status
             instance.status = instance.ASSIGNED
             instance.submitted_at = None
 
-            instance.save()
+            with transaction.atomic(), tracked_changes():
+                instance.save()
+                move_work(instance.task_id, previous_status, instance.status)
             return Response(self.serializer_class(instance).data, status=status.HTTP_200_OK)
 
         return Response({'detail': 'This work is already graded.'}, status=status.HTTP_403_FORBIDDEN)
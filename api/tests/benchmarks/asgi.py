@@ -0,0 +1,81 @@
+"""
+Compares the concurrency scaling of many students polling the chapter list of one course under WSGI (a thread per
+connection), under ASGI with the synchronous views and under ASGI with the async read views.
+Run with: python manage.py test tests.benchmarks.asgi
+
+The database queries of the in-memory SQLite test database are CPU-bound, so the numbers are representative only
+when the benchmark is run against PostgreSQL (see the DATABASE_* settings).
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from time import perf_counter
+
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, Client, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from tests import utility_funcs
+from courses.cache import membership_cache
+
+
+class ConcurrentPollingBenchmark(TransactionTestCase):
+    members_number = 200
+    concurrency_levels = (1, 8, 32)
+    requests_per_client = 20
+
+    def setUp(self):
+        self.data_manager = utility_funcs.TestDataManager()
+        self.teacher = self.data_manager.create_teacher('teacher@test.com')
+        self.course = utility_funcs.populate_course(self.teacher, [])
+        for _ in range(5):
+            self.data_manager.create_chapter(self.course)
+
+        members = utility_funcs.populate_course_members(self.course, self.members_number)
+        self.url = reverse('chapter-list', kwargs={'course_id': self.course.pk})
+        self.tokens = [str(RefreshToken.for_user(member).access_token) for member in members]
+        membership_cache.clear_local()
+
+    def _run_wsgi(self, concurrency):
+        def poll(tokens):
+            client = Client()
+            for token in tokens[:self.requests_per_client]:
+                response = client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {token}')
+                self.assertEquals(200, response.status_code)
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(poll, self._get_client_tokens(concurrency)))
+
+    @async_to_sync
+    async def _run_asgi(self, concurrency):
+        async def poll(tokens):
+            client = AsyncClient()
+            for token in tokens[:self.requests_per_client]:
+                response = await client.get(self.url, authorization=f'Bearer {token}')
+                self.assertEquals(200, response.status_code)
+
+        await asyncio.gather(*[poll(tokens) for tokens in self._get_client_tokens(concurrency)])
+
+    def _get_client_tokens(self, concurrency):
+        tokens = cycle(self.tokens)
+        return [[next(tokens) for _ in range(self.requests_per_client)] for _ in range(concurrency)]
+
+    def _measure(self, func, concurrency):
+        func(1)  # warm-up: the route table, the membership cache and the connections of the threads
+
+        start = perf_counter()
+        func(concurrency)
+        return concurrency * self.requests_per_client / (perf_counter() - start)
+
+    def test_requests_per_second(self):
+        print('\nconcurrent students | WSGI | ASGI, sync views | ASGI, async read views (requests per second)')
+
+        for concurrency in self.concurrency_levels:
+            wsgi_rate = self._measure(self._run_wsgi, concurrency)
+            asgi_rate = self._measure(self._run_asgi, concurrency)
+
+            with override_settings(ROOT_URLCONF='tests.courses.integration.urls'):
+                async_rate = self._measure(self._run_asgi, concurrency)
+
+            print(f'{concurrency:>19} | {wsgi_rate:>4.0f} | {asgi_rate:>16.0f} | {async_rate:>22.0f}')
@@ -0,0 +1,54 @@
+"""
+Compares the logins per second (on a single core) of the token obtain view with the previous login pipeline, which
+verified the password by simplejwt and then by authenticate() once more.
+Run with: python manage.py test tests.benchmarks.login
+"""
+from django.contrib.auth import authenticate
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from tests import utility_funcs
+from user_accounts.models import UserAccount
+from user_accounts.views import TokenObtainView
+
+
+class PreviousTokenObtainView(TokenObtainPairView):
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        authenticate(username=request.data['email'], password=request.data['password'])
+
+        return response
+
+
+class LoginBenchmark(TestCase):
+    iterations = 20
+    password = 'Secret-password-1'
+
+    @classmethod
+    def setUpTestData(cls):
+        user = UserAccount.objects.create_user('user@test.com', cls.password, 'John', 'Loe')
+        UserAccount.objects.filter(pk=user.pk).update(email_confirmed=True, twoFA_enabled=False)
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def _get_login(self, view):
+        def login():
+            request = self.factory.post('/', {'email': 'user@test.com', 'password': self.password}, format='json')
+            response = view(request)
+            self.assertEquals(200, response.status_code)
+
+        return login
+
+    def test_logins_per_second(self):
+        previous_rate = utility_funcs.run_benchmark(
+            self._get_login(PreviousTokenObtainView.as_view()), self.iterations, warmup=2
+        )
+        # the throttling is not a part of the measured pipeline
+        rate = utility_funcs.run_benchmark(
+            self._get_login(TokenObtainView.as_view(throttle_classes=[])), self.iterations, warmup=2
+        )
+
+        print(f'\nlogins per second per core: {previous_rate:.1f} with the previous pipeline, {rate:.1f} with a '
+              f'single password hash')
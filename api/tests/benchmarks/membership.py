@@ -0,0 +1,46 @@
+"""
+Compares the throughput of course-scoped requests with and without the course membership cache.
+Run with: python manage.py test tests.benchmarks.membership
+"""
+from itertools import cycle
+
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from tests import utility_funcs
+from courses.cache import membership_cache
+
+
+class CourseMembershipCacheBenchmark(utility_funcs.ViewSetTestCase):
+    members_number = 1000
+    iterations = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+        cls.data_manager.create_chapter(cls.course)
+        cls.members = utility_funcs.populate_course_members(cls.course, cls.members_number)
+
+    def setUp(self):
+        self.client = Client()
+        self.url = reverse('chapter-list', kwargs={'course_id': self.course.pk})
+        self.headers = cycle([
+            f'Bearer {RefreshToken.for_user(member).access_token}' for member in self.members[:100]
+        ])
+
+    def _request(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=next(self.headers))
+        self.assertEquals(200, response.status_code)
+
+    def test_requests_per_second(self):
+        with override_settings(COURSE_MEMBERSHIP_CACHE=False):
+            uncached = utility_funcs.run_benchmark(self._request, self.iterations)
+
+        membership_cache.clear_local()
+        cached = utility_funcs.run_benchmark(self._request, self.iterations)
+
+        print(f'\n{self.members_number} course members, chapter list: '
+              f'{uncached:.0f} req/s without the membership cache, {cached:.0f} req/s with it')
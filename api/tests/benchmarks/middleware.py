@@ -0,0 +1,47 @@
+"""
+Measures the per-request overhead of CourseMiddleware on course-scoped and non-course paths.
+Run with: python manage.py test tests.benchmarks.middleware
+"""
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from tests import utility_funcs
+from courses.cache import membership_cache
+from courses.middleware import CourseMiddleware
+
+
+class CourseMiddlewareBenchmark(utility_funcs.ViewSetTestCase):
+    iterations = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = CourseMiddleware(lambda request: HttpResponse())
+        membership_cache.get(self.teacher)
+
+    def _report(self, path, iterations):
+        request = self.factory.get(path)
+        setattr(request, 'user', self.teacher)
+
+        resolve_rate = utility_funcs.run_benchmark(lambda: resolve(path), iterations)
+        match_rate = utility_funcs.run_benchmark(lambda: self.middleware.route_table.match(path), iterations)
+        middleware_rate = utility_funcs.run_benchmark(lambda: self.middleware(request), iterations)
+
+        print(f'\n{path}: resolve() {1e6 / resolve_rate:.1f} us, route table {1e6 / match_rate:.1f} us, '
+              f'whole middleware {1e6 / middleware_rate:.1f} us per request')
+
+    def test_non_course_paths(self):
+        for path in ('/admin/', '/api/auth/user/', '/api/structures/groups/1/', '/api/courses/'):
+            self._report(path, self.iterations)
+
+    def test_course_paths(self):
+        # the whole middleware call includes the context query
+        for path in (f'/api/{self.course.pk}/chapters/', f'/api/{self.course.pk}/{self.chapter.pk}/tasks/'):
+            self._report(path, self.iterations // 10)
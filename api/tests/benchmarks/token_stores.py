@@ -0,0 +1,36 @@
+"""
+Compares the token round trips (a token is stored and then consumed) per second of the token stores. The redis store
+runs against an in-process redis server (fakeredis), so its rate excludes the network round trips of a real server.
+Run with: python manage.py test tests.benchmarks.token_stores
+"""
+from unittest import mock
+
+import fakeredis
+from django.test import TestCase
+
+from tests import utility_funcs
+from user_accounts import token_stores
+
+
+class TokenStoreBenchmark(TestCase):
+    iterations = 2000
+
+    def _get_round_trip(self, store):
+        def round_trip():
+            store.set('benchmark_token', '1234567', 60)
+            self.assertTrue(store.consume('benchmark_token', '1234567'))
+
+        return round_trip
+
+    def test_round_trips_per_second(self):
+        patcher = mock.patch('utils.redis_client.get_redis_client', return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        stores = [token_stores.LocalTokenStore(), token_stores.DatabaseTokenStore(), token_stores.RedisTokenStore()]
+
+        rates = [
+            f'{type(store).__name__}: {utility_funcs.run_benchmark(self._get_round_trip(store), self.iterations):.0f}'
+            for store in stores
+        ]
+        print(f'\ntoken round trips per second: {", ".join(rates)}')
@@ -0,0 +1,56 @@
+"""
+Compares the serialization of a chapter list with the detail URLs built by rest_framework.reverse.reverse and by the
+precompiled URL templates of utils.urls.
+Run with: python manage.py test tests.benchmarks.urls
+"""
+from unittest import mock
+
+from django.test import RequestFactory
+from django.urls import reverse, resolve
+from rest_framework.reverse import reverse as drf_reverse
+
+from tests import utility_funcs
+from courses.models import Chapter
+from courses.serializers import ChapterSerializer
+
+
+class ChapterSerializerBenchmark(utility_funcs.ViewSetTestCase):
+    chapters_number = 10
+    posts_per_chapter = 20
+    iterations = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+        author = cls.course.get_course_member_if_exists(cls.teacher)
+
+        for _ in range(cls.chapters_number):
+            chapter = cls.data_manager.create_chapter(cls.course)
+            for _ in range(cls.posts_per_chapter // 2):
+                cls.data_manager.create_material(chapter, author)
+                cls.data_manager.create_task(chapter, author)
+
+    def setUp(self):
+        self.request = RequestFactory().get(reverse('chapter-list', kwargs={'course_id': self.course.pk}))
+        self.request.resolver_match = resolve(self.request.path_info)
+        self.chapters = list(Chapter.objects.filter(course=self.course).prefetch_related('task_set', 'material_set'))
+
+    def _serialize(self):
+        return ChapterSerializer(self.chapters, many=True, context={'request': self.request}).data
+
+    def test_serialize_chapter_list(self):
+        def reverse_by_resolver(view_name, kwargs, request=None, format=None):
+            return drf_reverse(view_name, kwargs=kwargs, request=request, format=format)
+
+        with mock.patch('courses.serializer_fields.reverse_from_template', reverse_by_resolver):
+            expected = self._serialize()
+            reverse_rate = utility_funcs.run_benchmark(self._serialize, self.iterations)
+
+        self.assertEquals(expected, self._serialize())
+        template_rate = utility_funcs.run_benchmark(self._serialize, self.iterations)
+
+        urls_number = self.chapters_number * self.posts_per_chapter
+        print(f'\n{urls_number} detail URLs: reverse() {1e3 / reverse_rate:.2f} ms, '
+              f'URL templates {1e3 / template_rate:.2f} ms per serialization')
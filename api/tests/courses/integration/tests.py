@@ -1,7 +1,28 @@
-from django.test import Client
+import asyncio
+import io
+import json
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, AsyncClient, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from kombu.exceptions import OperationalError
+from rest_framework_simplejwt.tokens import RefreshToken
 from tests import utility_funcs
 
+from courses.cache import membership_cache, chapter_list_cache
 from courses.models import *
+from courses.enrollment import enroll_members
+from courses.stats import PendingRebuild, rebuild_task_stats
+from courses.tasks import enroll_course_members
+from utils.querysets import insert_values
+from user_accounts.models import UserAccount
 
 
 class CourseViewSetTestCase(utility_funcs.AuthorizedViewSetTestCase):
@@ -23,11 +44,11 @@ class CourseViewSetTestCase(utility_funcs.AuthorizedViewSetTestCase):
 
     def test_get_courses(self):
         response = self.get_response('course-list', self.teacher)
-        self.assertEquals(self.course.title, response.data[0]['title'])
+        self.assertEquals(self.course.title, response.data['results'][0]['title'])
 
     def test_get_courses_enrolled(self):
         response = self.get_response('course-list', self.student, data={'enrolled': 'true'})
-        self.assertEquals(self.course.title, response.data[0]['title'])
+        self.assertEquals(self.course.title, response.data['results'][0]['title'])
 
     def test_create_course(self):
         response = self.get_response(
@@ -124,7 +145,7 @@ class TaskViewSetTestCase(utility_funcs.AuthorizedViewSetTestCase):
             url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk},
         )
 
-        self.assertEquals(self.task.pk, response.data[0]['id'])
+        self.assertEquals(self.task.pk, response.data['results'][0]['id'])
 
     def test_create_task(self):
         self.get_response(
@@ -156,7 +177,7 @@ class TaskViewSetTestCase(utility_funcs.AuthorizedViewSetTestCase):
             url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk},
         )
 
-        self.assertEquals(0, len(response.data))
+        self.assertEquals(0, len(response.data['results']))
 
         self.task.is_archived = False
         self.task.save()
@@ -211,6 +232,36 @@ class ChapterViewSetTestCase(utility_funcs.AuthorizedViewSetTestCase):
 
         self.assertEquals(self.chapter.pk, response.data[0]['id'])
 
+    def test_get_chapters_query_budget(self):
+        teacher_member = self.course.get_course_member_if_exists(self.teacher)
+        for _ in range(5):
+            chapter = self.data_manager.create_chapter(self.course)
+            self.data_manager.create_material(chapter, teacher_member)
+            self.data_manager.create_task(chapter, teacher_member)
+
+        for user in (self.teacher, self.student):
+            self.token = None
+            response = self.get_response('chapter-list', user, url_params={'course_id': self.course.pk})
+            self.assertEquals(6, len(response.data))
+
+    def test_prefetched_posts_columns(self):
+        task = self.data_manager.create_task(self.chapter, self.course.get_course_member_if_exists(self.teacher))
+        Task.objects.filter(pk=task.pk).update(published_at=timezone.now() - timedelta(days=1))
+
+        for user in (self.teacher, self.student):
+            self.token = None
+            chapter_list_cache.clear_local()
+            with CaptureQueriesContext(connection) as context:
+                response = self.get_response('chapter-list', user, url_params={'course_id': self.course.pk},
+                                             data={'fields': 'id,title,task_set', 'expand': 'task_set'})
+
+            task_queries = [query['sql'] for query in context.captured_queries
+                            if query['sql'].startswith('SELECT "courses_task"')]
+            self.assertEquals(1, len(task_queries))
+            self.assertNotIn('"body"', task_queries[0])
+            self.assertEquals(task.pk, response.data[0]['task_set'][0]['id'])
+            self.assertTrue(response.data[0]['task_set'][0]['detail_url'].endswith(f'/{self.chapter.pk}/tasks/{task.pk}/'))
+
     def test_get_chapter_detail(self):
         response = self.get_response(
             'chapter-detail',
@@ -293,8 +344,8 @@ class CourseMemberViewSetTestCase(utility_funcs.AuthorizedViewSetTestCase):
 
     def test_get_course_member(self):
         response = self.get_response('coursemember-list', self.student, url_params={'course_id': self.course.pk})
-        self.assertEquals(self.teacher.pk, response.data[0]['user']['id'])
-        self.assertEquals(self.student.pk, response.data[1]['user']['id'])
+        self.assertEquals(self.teacher.pk, response.data['results'][0]['user']['id'])
+        self.assertEquals(self.student.pk, response.data['results'][1]['user']['id'])
 
     def test_get_course_members_not_enrolled(self):
         self.get_response('coursemember-list', self.teacher_not_enrolled, url_params={'course_id': self.course.pk},
@@ -412,3 +463,1197 @@ class CourseMemberViewSetTestCase(utility_funcs.AuthorizedViewSetTestCase):
             method='POST',
             expected_status_code=400
         )
+
+
+class CursorPaginationTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    works_number = 25
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.task = cls.data_manager.create_task(cls.chapter, cls.course.get_course_member_if_exists(cls.teacher))
+
+        utility_funcs.populate_course_members(cls.course, cls.works_number)
+        submitted_at = timezone.now()
+        StudentWork.objects.bulk_create([
+            StudentWork(task=cls.task, owner=member, status=StudentWork.SUBMITTED,
+                        submitted_at=submitted_at + timedelta(minutes=i))
+            for i, member in enumerate(cls.course.coursemember_set.filter(role=CourseMember.STUDENT))
+        ])
+
+    def setUp(self):
+        membership_cache.get(self.teacher)
+        self.url_params = {'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'task_id': self.task.pk}
+
+    def test_pages(self):
+        response = self.get_response('studentwork-list', self.teacher, url_params=self.url_params,
+                                     data={'page-size': 10})
+        works = response.data['results']
+        self.assertIsNone(response.data['previous'])
+
+        while response.data['next']:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(response.data['next'], HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+            # a deep page costs the same as the first one: no OFFSET, no COUNT
+            works_query = context.captured_queries[-1]['sql']
+            self.assertNotIn('OFFSET', works_query)
+            self.assertNotIn('COUNT', works_query)
+            works += response.data['results']
+
+        expected_ids = list(StudentWork.objects.filter(task=self.task).order_by('id').values_list('id', flat=True))
+        self.assertEquals(expected_ids, [work['id'] for work in works])
+
+    def test_pages_without_submission_time(self):
+        work_ids = StudentWork.objects.filter(task=self.task).order_by('id').values_list('id', flat=True)
+        StudentWork.objects.filter(pk__in=work_ids[::2]).update(submitted_at=None)
+
+        response = self.get_response('studentwork-list', self.teacher, url_params=self.url_params,
+                                     data={'page-size': 10})
+        work_ids = [work['id'] for work in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'], HTTP_AUTHORIZATION=f'Bearer {self.token}')
+            work_ids += [work['id'] for work in response.data['results']]
+
+        self.assertEquals(list(StudentWork.objects.filter(task=self.task).order_by('id').values_list('id', flat=True)),
+                          work_ids)
+
+    def test_default_page_size(self):
+        response = self.get_response('studentwork-list', self.teacher, url_params=self.url_params)
+        self.assertEquals(self.works_number, len(response.data['results']))
+
+        response = self.get_response('coursemember-list', self.teacher, url_params={'course_id': self.course.pk})
+        self.assertEquals(self.works_number + 1, len(response.data['results']))
+
+    def test_max_page_size(self):
+        response = self.get_response('studentwork-list', self.teacher, url_params=self.url_params,
+                                     data={'page-size': 1000})
+        self.assertEquals(self.works_number, len(response.data['results']))
+        self.assertIsNone(response.data['next'])
+
+
+class ListQueriesTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    """Every list endpoint takes the same number of queries regardless of the number of rows."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+        cls.teacher_member = cls.course.get_course_member_if_exists(cls.teacher)
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.task = cls.data_manager.create_task(cls.chapter, cls.teacher_member)
+        cls.rows_number = 0
+
+    def setUp(self):
+        ContentType.objects.clear_cache()
+        membership_cache.get(self.teacher)
+
+    def _add_rows(self, rows_number=3):
+        for _ in range(rows_number):
+            i = self.__class__.rows_number = self.__class__.rows_number + 1
+
+            owner = UserAccount.objects.create(first_name='Mark', last_name='Brown', email=f'owner{i}@test.com')
+            utility_funcs.populate_course(owner, [self.teacher])
+
+            teacher = self.data_manager.create_teacher(f'teacher{i}@test.com')
+            author = CourseMember.objects.create(user=teacher, course=self.course, role=CourseMember.TEACHER)
+            student = UserAccount.objects.create(first_name='Dane', last_name='Green', email=f'student{i}@test.com')
+            student_member = CourseMember.objects.create(user=student, course=self.course, role=CourseMember.STUDENT)
+
+            chapter = self.data_manager.create_chapter(self.course)
+            for post in (self.data_manager.create_material(self.chapter, author),
+                         self.data_manager.create_task(self.chapter, author),
+                         self.data_manager.create_material(chapter, author)):
+                self._create_attachment(post)
+
+            work = StudentWork.objects.create(task=self.task, owner=student_member, status=StudentWork.SUBMITTED,
+                                              submitted_at=timezone.now())
+            self._create_attachment(work)
+            Grade.objects.create(work=work, amount=10, grader=author)
+
+        membership_cache.clear_local()
+
+    def _create_attachment(self, target_object):
+        Attachment.objects.create(
+            content_type=ContentType.objects.get_for_model(target_object),
+            object_id=target_object.pk,
+            file='attachments/answer.txt'
+        )
+
+    def _assert_constant_queries(self, url_name, url_params=None, data=None):
+        def get_queries_number():
+            membership_cache.get(self.teacher)
+            response = self.get_response(url_name, self.teacher, url_params=url_params, data=data or {})
+            return response.wsgi_request.metrics.queries, len(response.data['results'] if 'results' in response.data
+                                                              else response.data)
+
+        self._add_rows(1)
+        queries_number, rows_number = get_queries_number()
+        self._add_rows()
+        more_queries_number, more_rows_number = get_queries_number()
+
+        self.assertGreater(more_rows_number, rows_number)
+        self.assertEquals(queries_number, more_queries_number)
+
+    def test_courses(self):
+        self._assert_constant_queries('course-list')
+
+    def test_enrolled_courses(self):
+        self._assert_constant_queries('course-list', data={'enrolled': 'true'})
+
+    def test_course_members(self):
+        self._assert_constant_queries('coursemember-list', url_params={'course_id': self.course.pk})
+
+    def test_chapters(self):
+        self._assert_constant_queries('chapter-list', url_params={'course_id': self.course.pk})
+
+    def test_materials(self):
+        self._assert_constant_queries('material-list',
+                                      url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk})
+
+    def test_tasks(self):
+        self._assert_constant_queries('task-list',
+                                      url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk})
+
+    def test_grades(self):
+        self._assert_constant_queries('grade-list', url_params={'course_id': self.course.pk})
+
+    def test_student_works(self):
+        self._assert_constant_queries(
+            'studentwork-list',
+            url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'task_id': self.task.pk}
+        )
+
+
+class JWTAuthenticationTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+
+    def test_single_user_lookup(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_response('chapter-list', self.teacher, url_params={'course_id': self.course.pk})
+
+        user_lookups = [query for query in context.captured_queries
+                        if query['sql'].startswith('SELECT') and 'FROM "user_accounts_useraccount"' in query['sql']]
+        self.assertEquals(1, len(user_lookups))
+        self.assertEquals(1, response.wsgi_request.auth_lookups)
+
+    def test_invalid_token(self):
+        self._get_response(
+            'chapter-list',
+            url_params={'course_id': self.course.pk},
+            HTTP_AUTHORIZATION='Bearer invalid',
+            expected_status_code=401
+        )
+
+
+class ObjectPermissionQueriesTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    """
+    The ownership checks compare foreign key ids, so update and delete flows should not load the owner objects. The
+    expected numbers include one query of the JWT authentication and one query of the course context.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.student = cls.data_manager.create_student('student@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [cls.student])
+        cls.teacher_member = cls.course.get_course_member_if_exists(cls.teacher)
+        cls.student_member = cls.course.get_course_member_if_exists(cls.student)
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.material = cls.data_manager.create_material(cls.chapter, cls.teacher_member)
+        cls.task = cls.data_manager.create_task(cls.chapter, cls.teacher_member)
+        cls.task.deadline = timezone.now() + timezone.timedelta(days=1)
+        cls.task.save()
+        cls.student_work = StudentWork.objects.create(task=cls.task, owner=cls.student_member, status=StudentWork.GRADED)
+        cls.grade = Grade.objects.create(work=cls.student_work, grader=cls.teacher_member, amount=10)
+
+    def setUp(self):
+        ContentType.objects.clear_cache()
+        membership_cache.clear_local()
+        membership_cache.get(self.teacher)
+        membership_cache.get(self.student)
+
+    def _assert_request_queries(self, expected_queries, url_name, user, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            self.get_response(url_name, user, **kwargs)
+
+        queries = [query['sql'] for query in context.captured_queries]
+        self.assertEquals(expected_queries, len(queries), '\n'.join(queries))
+
+        # the owners are not loaded before the first write (the first query is the JWT authentication)
+        first_write = next(i for i, query in enumerate(queries) if query.startswith(('UPDATE', 'DELETE')))
+        self.assertFalse([query for query in queries[1:first_write]
+                          if 'FROM "courses_coursemember"' in query or 'FROM "user_accounts_useraccount"' in query])
+
+    def test_update_material(self):
+        self._assert_request_queries(
+            6, 'material-detail', self.teacher,
+            url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'pk': self.material.pk},
+            data={'title': 'Updated material'}, method='PATCH'
+        )
+
+    def test_delete_material(self):
+        self._assert_request_queries(
+            6, 'material-detail', self.teacher,
+            url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'pk': self.material.pk},
+            method='DELETE', expected_status_code=204
+        )
+
+    def test_update_task(self):
+        self._assert_request_queries(
+            6, 'task-detail', self.teacher,
+            url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'pk': self.task.pk},
+            data={'title': 'Updated task'}, method='PATCH'
+        )
+
+    def test_delete_task(self):
+        # the grades of the works are fetched for their signals (see courses.signals.rebuild_deleted_grade_task_stats)
+        self._assert_request_queries(
+            13, 'task-detail', self.teacher,
+            url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'pk': self.task.pk},
+            method='DELETE', expected_status_code=204
+        )
+
+    def test_delete_grade(self):
+        self._assert_request_queries(
+            9, 'grade-detail', self.teacher,
+            url_params={'course_id': self.course.pk, 'pk': self.grade.pk},
+            method='DELETE', expected_status_code=204
+        )
+
+    def test_update_student_work(self):
+        self.grade.delete()
+        StudentWork.objects.filter(pk=self.student_work.pk).update(status=StudentWork.ASSIGNED)
+        self._assert_request_queries(
+            6, 'studentwork-detail', self.student,
+            url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'task_id': self.task.pk,
+                        'pk': self.student_work.pk},
+            data={'answer': 'Updated answer'}, method='PATCH'
+        )
+
+    def test_delete_student_work(self):
+        self.grade.delete()
+        StudentWork.objects.filter(pk=self.student_work.pk).update(status=StudentWork.ASSIGNED)
+        self._assert_request_queries(
+            10, 'studentwork-detail', self.student,
+            url_params={'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'task_id': self.task.pk,
+                        'pk': self.student_work.pk},
+            method='DELETE', expected_status_code=204
+        )
+
+
+@override_settings(ROOT_URLCONF='tests.courses.integration.urls')
+class AsyncReadViewsTestCase(TransactionTestCase):
+    def setUp(self):
+        self.data_manager = utility_funcs.TestDataManager()
+        self.teacher = self.data_manager.create_teacher('teacher@test.com')
+        self.student = self.data_manager.create_student('student@test.com')
+        self.outsider = UserAccount.objects.create(first_name='Outside', last_name='User', email='outsider@gmail.com')
+        self.course = utility_funcs.populate_course(self.teacher, [self.student])
+        self.task, _ = utility_funcs.populate_course_content(
+            self.course,
+            self.course.get_course_member_if_exists(self.teacher),
+            self.course.get_course_member_if_exists(self.student)
+        )
+        self.chapter = self.task.chapter
+        self.material = self.data_manager.create_material(
+            self.chapter,
+            self.course.get_course_member_if_exists(self.teacher)
+        )
+        membership_cache.clear_local()
+
+    @async_to_sync
+    async def _request(self, url, method='get', **kwargs):
+        return await getattr(AsyncClient(), method)(url, **kwargs)
+
+    def _get_async_response(self, url, user, method='get', **kwargs):
+        token = str(RefreshToken.for_user(user).access_token)
+        return self._request(url, method=method, authorization=f'Bearer {token}', **kwargs)
+
+    def _assert_same_as_sync(self, url, user):
+        response = self._get_async_response(url, user)
+        self.assertEquals(200, response.status_code)
+
+        with override_settings(ROOT_URLCONF='Desk2.urls'):
+            token = str(RefreshToken.for_user(user).access_token)
+            sync_response = Client().get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        self.assertEquals(sync_response.json(), json.loads(response.content))
+        self.assertEquals(sync_response['Content-Type'], response['Content-Type'])
+        return response
+
+    def test_views_are_async(self):
+        urls = [
+            reverse('course-list'),
+            reverse('chapter-list', kwargs={'course_id': self.course.pk}),
+            reverse('material-detail', kwargs={'course_id': self.course.pk, 'chapter_id': self.chapter.pk,
+                                               'pk': self.material.pk}),
+            reverse('task-detail', kwargs={'course_id': self.course.pk, 'chapter_id': self.chapter.pk,
+                                           'pk': self.task.pk}),
+        ]
+
+        for url in urls:
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+
+    def test_chapter_list(self):
+        response = self._assert_same_as_sync(f'/api/{self.course.pk}/chapters/', self.student)
+        self.assertEquals(self.chapter.pk, json.loads(response.content)[0]['id'])
+
+    def test_enrolled_courses(self):
+        # the async client of django 3.2 ignores the data of GET requests
+        response = self._assert_same_as_sync('/api/courses/?enrolled=true', self.student)
+        self.assertEquals([self.course.pk], [course['id'] for course in json.loads(response.content)['results']])
+
+    def test_course_list(self):
+        utility_funcs.populate_course(self.teacher, [])
+        self._assert_same_as_sync('/api/courses/', self.student)
+
+    def test_material_detail(self):
+        self._assert_same_as_sync(f'/api/{self.course.pk}/{self.chapter.pk}/materials/{self.material.pk}/', self.student)
+
+    def test_task_detail(self):
+        self._assert_same_as_sync(f'/api/{self.course.pk}/{self.chapter.pk}/tasks/{self.task.pk}/', self.teacher)
+
+    def test_not_enrolled(self):
+        response = self._get_async_response(f'/api/{self.course.pk}/chapters/', self.outsider)
+        self.assertEquals(403, response.status_code)
+
+    def test_chapter_does_not_exist(self):
+        response = self._get_async_response(f'/api/{self.course.pk}/2001/tasks/{self.task.pk}/', self.student)
+        self.assertEquals(404, response.status_code)
+
+    def test_unauthenticated(self):
+        response = self._request(f'/api/{self.course.pk}/chapters/')
+        self.assertEquals(401, response.status_code)
+
+    def test_create_chapter(self):
+        response = self._get_async_response(
+            f'/api/{self.course.pk}/chapters/',
+            self.teacher,
+            method='post',
+            data={'title': 'New chapter', 'description': 'Dummy desc.'},
+            content_type='application/json'
+        )
+
+        self.assertEquals(201, response.status_code)
+        self.assertTrue(Chapter.objects.filter(title='New chapter').exists())
+
+
+class SparseFieldsetTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.student = cls.data_manager.create_student('student@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [cls.student])
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.task = cls.data_manager.create_task(cls.chapter, cls.course.get_course_member_if_exists(cls.teacher))
+        cls.task.published_at = timezone.now() - timedelta(days=1)
+        cls.task.save()
+
+    def setUp(self):
+        membership_cache.get(self.teacher)
+        self.url_params = {'course_id': self.course.pk, 'chapter_id': self.chapter.pk}
+
+    def _get_tasks(self, **data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_response('task-list', self.teacher, url_params=self.url_params, data=data)
+
+        return response.data['results'][0], [query['sql'] for query in context.captured_queries]
+
+    def test_fields(self):
+        task, queries = self._get_tasks(fields='id,title,deadline')
+
+        self.assertEquals({'id', 'title', 'deadline'}, set(task))
+        tasks_query = next(query for query in queries if 'FROM "courses_task"' in query)
+        self.assertNotIn('"courses_task"."body"', tasks_query)
+        self.assertNotIn('"courses_coursemember"', tasks_query)
+        self.assertFalse(any('"courses_attachment"' in query for query in queries))
+
+    def test_expand(self):
+        task, queries = self._get_tasks(fields='id,title', expand='author')
+
+        self.assertEquals({'id', 'title', 'author'}, set(task))
+        self.assertEquals(self.teacher.first_name, task['author']['user']['first_name'])
+
+    def test_nested_objects_not_expanded(self):
+        task, queries = self._get_tasks(expand='')
+
+        self.assertIn('body', task)
+        self.assertIn('deadline_passed', task)
+        self.assertNotIn('author', task)
+        self.assertNotIn('attachment_set', task)
+        self.assertFalse(any('"courses_attachment"' in query for query in queries))
+
+    def test_all_fields_by_default(self):
+        task, queries = self._get_tasks()
+        self.assertIn('author', task)
+        self.assertIn('attachment_set', task)
+
+    def test_posts_not_prefetched(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_response('chapter-list', self.student, url_params={'course_id': self.course.pk},
+                                         data={'fields': 'id,title'})
+
+        self.assertEquals({'id', 'title'}, set(response.data[0]))
+        self.assertFalse(any('"courses_task"."id"' in query['sql'] for query in context.captured_queries))
+
+        response = self.get_response('chapter-list', self.student, url_params={'course_id': self.course.pk},
+                                     data={'fields': 'id', 'expand': 'task_set'})
+        self.assertEquals(self.task.pk, response.data[0]['task_set'][0]['id'])
+
+
+class ConditionalGetTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.student = cls.data_manager.create_student('student@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [cls.student])
+        cls.teacher_member = cls.course.get_course_member_if_exists(cls.teacher)
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.material = cls.data_manager.create_material(cls.chapter, cls.teacher_member)
+        cls.task = cls.data_manager.create_task(cls.chapter, cls.teacher_member)
+
+    def setUp(self):
+        membership_cache.get(self.teacher)
+        membership_cache.get(self.student)
+        self.chapters_url_params = {'course_id': self.course.pk}
+        self.posts_url_params = {'course_id': self.course.pk, 'chapter_id': self.chapter.pk}
+
+    def _get_etag(self, url_name, user, url_params):
+        response = self.get_response(url_name, user, url_params=url_params)
+        self.assertIn('Authorization', response['Vary'])
+        return response['ETag']
+
+    def _assert_not_modified(self, url_name, user, url_params, etag, expected_status_code=304):
+        return self.get_response(url_name, user, url_params=url_params, HTTP_IF_NONE_MATCH=etag,
+                                 expected_status_code=expected_status_code)
+
+    def test_chapters_not_modified(self):
+        etag = self._get_etag('chapter-list', self.student, self.chapters_url_params)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self._assert_not_modified('chapter-list', self.student, self.chapters_url_params, etag)
+
+        self.assertEquals(etag, response['ETag'])
+        self.assertEquals(b'', response.content)
+        self.assertFalse(any('"courses_chapter"."description"' in query['sql']
+                             for query in context.captured_queries))
+
+    def test_chapters_modified(self):
+        etag = self._get_etag('chapter-list', self.student, self.chapters_url_params)
+
+        self.material.title = 'Edited material'
+        self.material.save()
+        self.assertNotEqual(etag, self._assert_not_modified('chapter-list', self.student, self.chapters_url_params,
+                                                            etag, expected_status_code=200)['ETag'])
+
+    def test_deleted_post(self):
+        etag = self._get_etag('material-list', self.student, self.posts_url_params)
+
+        Material.objects.filter(pk=self.material.pk).delete()
+        self._assert_not_modified('material-list', self.student, self.posts_url_params, etag,
+                                  expected_status_code=200)
+
+    def test_role(self):
+        self.assertNotEqual(self._get_etag('task-list', self.student, self.posts_url_params),
+                            self._get_etag('task-list', self.teacher, self.posts_url_params))
+
+    def test_planned_post_published(self):
+        self.data_manager.create_material(self.chapter, self.teacher_member)
+        Material.objects.filter(chapter=self.chapter).exclude(pk=self.material.pk).update(
+            published_at=timezone.now() + timedelta(hours=1)
+        )
+        etag = self._get_etag('chapter-list', self.student, self.chapters_url_params)
+        self._assert_not_modified('chapter-list', self.student, self.chapters_url_params, etag)
+
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(hours=2)):
+            response = self._assert_not_modified('chapter-list', self.student, self.chapters_url_params, etag,
+                                                 expected_status_code=200)
+
+        self.assertEquals(2, len(response.data[0]['material_set']))
+
+    def test_task_last_modified(self):
+        url_params = {**self.posts_url_params, 'pk': self.task.pk}
+        response = self.get_response('task-detail', self.student, url_params=url_params)
+
+        self.get_response('task-detail', self.student, url_params=url_params,
+                          HTTP_IF_MODIFIED_SINCE=response['Last-Modified'], expected_status_code=304)
+
+
+class ChapterListCacheTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.student = cls.data_manager.create_student('student@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [cls.student])
+        cls.teacher_member = cls.course.get_course_member_if_exists(cls.teacher)
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.material = cls.data_manager.create_material(cls.chapter, cls.teacher_member)
+
+    def setUp(self):
+        chapter_list_cache.clear_local()
+        membership_cache.get(self.teacher)
+        membership_cache.get(self.student)
+        self.url_params = {'course_id': self.course.pk}
+
+    def _get_chapters(self, user):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_response('chapter-list', user, url_params=self.url_params)
+
+        is_cached = not any('"courses_chapter"."description"' in query['sql'] for query in context.captured_queries)
+        return response.data, is_cached
+
+    def test_cached(self):
+        data, is_cached = self._get_chapters(self.student)
+        self.assertFalse(is_cached)
+
+        cached_data, is_cached = self._get_chapters(self.student)
+        self.assertTrue(is_cached)
+        self.assertEquals(json.loads(json.dumps(data)), cached_data)
+
+    def test_role_class(self):
+        planned_material = self.data_manager.create_material(self.chapter, self.teacher_member)
+        Material.objects.filter(pk=planned_material.pk).update(published_at=timezone.now() + timedelta(hours=1))
+        chapter_list_cache.invalidate(self.course.pk)
+
+        self._get_chapters(self.student)
+        data, is_cached = self._get_chapters(self.teacher)
+
+        self.assertFalse(is_cached)
+        self.assertEquals(2, len(data[0]['material_set']))
+        self.assertEquals(1, len(self._get_chapters(self.student)[0][0]['material_set']))
+
+    def test_invalidation(self):
+        self._get_chapters(self.student)
+
+        self.material.title = 'Edited material'
+        self.material.save()
+        data, is_cached = self._get_chapters(self.student)
+        self.assertFalse(is_cached)
+        self.assertEquals('Edited material', data[0]['material_set'][0]['title'])
+
+        Attachment.objects.create(content_type=ContentType.objects.get_for_model(Material),
+                                  object_id=self.material.pk, file='attachments/file.txt')
+        self.assertFalse(self._get_chapters(self.student)[1])
+
+        self.data_manager.create_chapter(self.course)
+        data, is_cached = self._get_chapters(self.student)
+        self.assertFalse(is_cached)
+        self.assertEquals(2, len(data))
+
+        self.chapter.delete()
+        self.assertEquals(1, len(self._get_chapters(self.student)[0]))
+
+    def test_expires_at_publish_time(self):
+        planned_material = self.data_manager.create_material(self.chapter, self.teacher_member)
+        # before the timeout of the cache
+        published_at = timezone.now() + timedelta(minutes=5)
+        Material.objects.filter(pk=planned_material.pk).update(published_at=published_at)
+        chapter_list_cache.invalidate(self.course.pk)
+
+        self._get_chapters(self.student)
+        data, is_cached = self._get_chapters(self.student)
+        self.assertTrue(is_cached)
+        self.assertEquals(1, len(data[0]['material_set']))
+
+        with mock.patch('django.utils.timezone.now', return_value=published_at - timedelta(seconds=1)):
+            self.assertTrue(self._get_chapters(self.student)[1])
+
+        with mock.patch('django.utils.timezone.now', return_value=published_at + timedelta(seconds=1)):
+            data, is_cached = self._get_chapters(self.student)
+
+        self.assertFalse(is_cached)
+        self.assertEquals(2, len(data[0]['material_set']))
+
+
+class GradebookTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    students_number = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+        cls.teacher_member = cls.course.get_course_member_if_exists(cls.teacher)
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.tasks = [cls.data_manager.create_task(cls.chapter, cls.teacher_member) for _ in range(2)]
+
+        utility_funcs.populate_course_members(cls.course, cls.students_number)
+        cls.students = list(cls.course.coursemember_set.filter(role=CourseMember.STUDENT).order_by('pk'))
+
+        # the first student has a graded and a submitted work, the second one has an assigned work
+        cls.graded_work = StudentWork.objects.create(task=cls.tasks[0], owner=cls.students[0], status=StudentWork.GRADED,
+                                                     submitted_at=timezone.now())
+        Grade.objects.create(work=cls.graded_work, amount=10, grader=cls.teacher_member)
+        StudentWork.objects.create(task=cls.tasks[1], owner=cls.students[0], status=StudentWork.SUBMITTED,
+                                   submitted_at=timezone.now())
+        StudentWork.objects.create(task=cls.tasks[0], owner=cls.students[1])
+
+    def setUp(self):
+        membership_cache.get(self.teacher)
+        self.url_params = {'course_id': self.course.pk}
+
+    def test_matrix(self):
+        data = self.get_response('gradebook', self.teacher, url_params=self.url_params).data
+
+        self.assertEquals([task.pk for task in self.tasks], [task['id'] for task in data['tasks']])
+        self.assertEquals([student.pk for student in self.students], [student['id'] for student in data['students']])
+
+        first_row, second_row, third_row = [student['works'] for student in data['students']]
+        self.assertEquals({'status': StudentWork.GRADED, 'submitted_at': self.graded_work.submitted_at, 'grade': 10},
+                          first_row[0])
+        self.assertEquals(StudentWork.SUBMITTED, first_row[1]['status'])
+        self.assertIsNone(first_row[1]['grade'])
+        # the assigned work is not submitted, so it is not shown to the teacher
+        self.assertEquals([None, None], second_row)
+        self.assertEquals([None, None], third_row)
+
+        self.assertEquals({'works': 1, 'submitted': 0, 'graded': 1, 'average_grade': 10.0, 'lowest_grade': 10,
+                           'highest_grade': 10}, data['tasks'][0]['statistics'])
+        self.assertEquals({'works': 1, 'submitted': 1, 'graded': 0, 'average_grade': None, 'lowest_grade': None,
+                           'highest_grade': None}, data['tasks'][1]['statistics'])
+
+    def test_constant_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            self.get_response('gradebook', self.teacher, url_params=self.url_params)
+
+        task = self.data_manager.create_task(self.chapter, self.teacher_member)
+        utility_funcs.populate_course_members(self.course, 5, email_template='new_member{}@test.com')
+        for student in self.course.coursemember_set.filter(role=CourseMember.STUDENT):
+            StudentWork.objects.create(task=task, owner=student, status=StudentWork.SUBMITTED)
+        membership_cache.clear_local()
+        membership_cache.get(self.teacher)
+
+        with self.assertNumQueries(len(context.captured_queries)):
+            response = self.get_response('gradebook', self.teacher, url_params=self.url_params)
+
+        self.assertEquals(self.students_number + 5, len(response.data['students']))
+
+    def test_csv(self):
+        response = self.get_response('gradebook', self.teacher, url_params=self.url_params, data={'format': 'csv'})
+
+        self.assertTrue(response.streaming)
+        self.assertEquals('text/csv', response['Content-Type'])
+        rows = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEquals(self.students_number + 1, len(rows))
+        self.assertEquals(4 + 3 * len(self.tasks), len(rows[0].split(',')))
+        self.assertTrue(rows[1].endswith(',10,S,' + self.students[0].studentwork_set.get(task=self.tasks[1])
+                                         .submitted_at.isoformat() + ','))
+
+    def test_student_forbidden(self):
+        student = self.students[0].user
+        membership_cache.get(student)
+        self.get_response('gradebook', student, url_params=self.url_params, expected_status_code=403)
+
+
+class BulkGradeTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+        cls.teacher_member = cls.course.get_course_member_if_exists(cls.teacher)
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.task = cls.data_manager.create_task(cls.chapter, cls.teacher_member)
+
+        utility_funcs.populate_course_members(cls.course, 10)
+        cls.works = [
+            StudentWork.objects.create(task=cls.task, owner=student, status=StudentWork.SUBMITTED,
+                                       submitted_at=timezone.now())
+            for student in cls.course.coursemember_set.filter(role=CourseMember.STUDENT).order_by('pk')
+        ]
+
+    def setUp(self):
+        membership_cache.get(self.teacher)
+        self.url_params = {'course_id': self.course.pk}
+
+    def _grade(self, data, expected_status_code=201):
+        return self.get_response('grade-bulk-create', self.teacher, url_params=self.url_params, method='POST',
+                                 data=data, expected_status_code=expected_status_code)
+
+    def test_bulk_create(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self._grade([{'work': work.pk, 'amount': 10, 'description': 'Good'} for work in self.works[:2]])
+        queries_number = len(context.captured_queries)
+
+        grade_ids = dict(Grade.objects.values_list('work_id', 'pk'))
+        self.assertEquals([{'id': grade_ids[work.pk], 'work': work.pk, 'amount': 10, 'description': 'Good'}
+                           for work in self.works[:2]], response.data)
+        self.assertEquals(2, Grade.objects.filter(work__in=self.works[:2], grader=self.teacher_member).count())
+        self.assertEquals(2, StudentWork.objects.filter(pk__in=[work.pk for work in self.works[:2]],
+                                                        status=StudentWork.GRADED).count())
+
+        with self.assertNumQueries(queries_number):
+            self._grade([{'work': work.pk, 'amount': 5} for work in self.works[2:]])
+
+        self.assertEquals(len(self.works), Grade.objects.count())
+
+    def test_per_item_errors(self):
+        other_course = utility_funcs.populate_course(self.teacher, [])
+        other_chapter = self.data_manager.create_chapter(other_course)
+        other_task = self.data_manager.create_task(other_chapter, other_course.get_course_member_if_exists(self.teacher))
+        other_work = StudentWork.objects.create(task=other_task, owner=self.works[0].owner, status=StudentWork.SUBMITTED)
+        StudentWork.objects.filter(pk=self.works[1].pk).update(status=StudentWork.ASSIGNED)
+
+        response = self._grade([
+            {'work': self.works[0].pk, 'amount': 10},
+            {'work': self.works[0].pk, 'amount': 10},
+            {'work': self.works[1].pk, 'amount': 10},
+            {'work': self.works[2].pk, 'amount': self.task.max_grade + 1},
+            {'work': other_work.pk, 'amount': 10},
+            {'work': self.works[3].pk, 'amount': 'ten'},
+        ], expected_status_code=400)
+
+        errors = response.json()
+        self.assertEquals({}, errors[0])
+        self.assertIn('work', errors[1])
+        self.assertIn('work', errors[2])
+        self.assertIn('amount', errors[3])
+        self.assertIn('work', errors[4])
+        self.assertIn('amount', errors[5])
+        self.assertFalse(Grade.objects.exists())
+
+    def test_not_a_list(self):
+        self._grade({'work': self.works[0].pk, 'amount': 10}, expected_status_code=400)
+
+
+
+class BulkEnrollmentTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.other_teacher = cls.data_manager.create_teacher('teacher1@test.com')
+        cls.student = cls.data_manager.create_student('student@test.com')
+        cls.enrolled_student = cls.data_manager.create_student('student1@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [cls.enrolled_student])
+
+    def setUp(self):
+        membership_cache.get(self.teacher)
+        self.url_params = {'course_id': self.course.pk}
+
+    def _enroll(self, data, expected_status_code=200, **kwargs):
+        return self.get_response('coursemember-bulk-add', self.teacher, url_params=self.url_params, method='POST',
+                                 data=data, expected_status_code=expected_status_code, **kwargs)
+
+    def _create_users(self, number):
+        emails = [f'user{i}@test.com' for i in range(number)]
+        UserAccount.objects.bulk_create([UserAccount(first_name='Dane', last_name='Green', email=email)
+                                         for email in emails])
+        return emails
+
+    def test_bulk_add(self):
+        membership_cache.get(self.student)
+        response = self._enroll([
+            {'email': self.student.email, 'member_type': 'student'},
+            {'email': self.other_teacher.email, 'member_type': 'teacher'},
+            {'email': self.enrolled_student.email},
+            {'email': 'unknown@test.com'},
+            {'email': 'student@test.com ', 'member_type': 'teacher'},
+        ], expected_status_code=400)
+        self.assertIn('email', response.json()[4])
+
+        response = self._enroll([
+            {'email': self.student.email},
+            {'email': self.other_teacher.email, 'member_type': 'teacher'},
+            {'email': self.enrolled_student.email},
+            {'email': 'unknown@test.com'},
+        ])
+
+        self.assertEquals({
+            'added': [self.student.email, self.other_teacher.email],
+            'already_enrolled': [self.enrolled_student.email],
+            'unknown': ['unknown@test.com'],
+            'not_teachers': [],
+        }, response.data)
+        self.assertEquals(CourseMember.STUDENT, self.course.get_course_member_if_exists(self.student).role)
+        self.assertEquals(CourseMember.TEACHER, self.course.get_course_member_if_exists(self.other_teacher).role)
+        # the bulk insert does not send the signals, the maps are invalidated explicitly
+        self.assertIn(self.course.pk, membership_cache.get(self.student))
+
+    def test_student_as_teacher(self):
+        response = self._enroll([{'email': self.student.email, 'member_type': 'teacher'}])
+
+        self.assertEquals([self.student.email], response.data['not_teachers'])
+        self.assertIsNone(self.course.get_course_member_if_exists(self.student))
+
+    def test_queries_do_not_depend_on_list_length(self):
+        emails = self._create_users(20)
+        with CaptureQueriesContext(connection) as context:
+            self._enroll([{'email': email} for email in emails[:2]])
+        queries_number = len(context.captured_queries)
+
+        with self.assertNumQueries(queries_number):
+            response = self._enroll([{'email': email} for email in emails])
+
+        self.assertEquals(emails[2:], response.data['added'])
+        self.assertEquals(emails[:2], response.data['already_enrolled'])
+        self.assertEquals(21, self.course.coursemember_set.filter(role=CourseMember.STUDENT).count())
+
+    @override_settings(BULK_ENROLLMENT_CHUNK_SIZE=10)
+    def test_queries_per_chunk(self):
+        emails = self._create_users(20)
+        # the users and the insert of every chunk
+        with self.assertNumQueries(4):
+            report = enroll_members(self.course, [{'email': email, 'role': CourseMember.STUDENT} for email in emails])
+
+        self.assertEquals(emails, report['added'])
+
+    def test_csv_upload(self):
+        file = SimpleUploadedFile('members.csv', '\n'.join([
+            'email,member_type',
+            f'{self.student.email},',
+            f'{self.other_teacher.email},teacher',
+            'unknown@test.com,student',
+        ]).encode('utf-8-sig'), content_type='text/csv')
+
+        response = self.client.post(reverse('coursemember-bulk-add', kwargs=self.url_params), {'file': file},
+                                    HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.teacher).access_token}')
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals([self.student.email, self.other_teacher.email], response.data['added'])
+        self.assertEquals(['unknown@test.com'], response.data['unknown'])
+
+    def test_csv_upload_without_header(self):
+        file = SimpleUploadedFile('members.csv', f'{self.student.email}\n'.encode(), content_type='text/csv')
+        response = self.client.post(reverse('coursemember-bulk-add', kwargs=self.url_params), {'file': file},
+                                    HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.teacher).access_token}')
+
+        self.assertEquals(400, response.status_code)
+        self.assertIn('file', response.json())
+
+    @override_settings(BULK_ENROLLMENT_SYNC_LIMIT=2)
+    def test_large_list_is_enrolled_by_job(self):
+        emails = self._create_users(5)
+        with mock.patch('courses.views.enroll_course_members.apply_async') as apply_async:
+            response = self._enroll([{'email': email} for email in emails], expected_status_code=202)
+
+        self.assertEquals(5, response.data['total'])
+        self.assertFalse(self.course.coursemember_set.filter(user__email__in=emails).exists())
+
+        (course_id, job_id, members), = apply_async.call_args[0]
+        self.assertEquals(response.data['job'], job_id)
+        self.assertEquals(emails, enroll_course_members(course_id, job_id, members)['added'])
+        self.assertEquals(5, self.course.coursemember_set.filter(user__email__in=emails).count())
+
+    def test_concurrently_enrolled_member(self):
+        def enroll_concurrently(*args, **kwargs):
+            # committed by another request right before the insert
+            CourseMember.objects.create(user=self.student, course=self.course, role=CourseMember.STUDENT)
+            return insert_values(*args, **kwargs)
+
+        with mock.patch('courses.enrollment.insert_values', side_effect=enroll_concurrently):
+            report = enroll_members(self.course, [{'email': self.student.email, 'role': CourseMember.STUDENT},
+                                                  {'email': self.other_teacher.email, 'role': CourseMember.TEACHER}])
+
+        self.assertEquals([self.other_teacher.email], report['added'])
+        self.assertEquals([self.student.email], report['already_enrolled'])
+
+    @override_settings(BULK_ENROLLMENT_SYNC_LIMIT=1)
+    def test_broker_not_available(self):
+        emails = self._create_users(2)
+        with mock.patch('courses.views.enroll_course_members.apply_async', side_effect=OperationalError):
+            response = self._enroll([{'email': email} for email in emails], expected_status_code=503)
+
+        self.assertIn('detail', response.data)
+        self.assertFalse(self.course.coursemember_set.filter(user__email__in=emails).exists())
+
+    def test_unknown_job(self):
+        self.get_response('coursemember-bulk-status', self.teacher,
+                          url_params={'course_id': self.course.pk, 'job_id': '0' * 32}, expected_status_code=404)
+
+    def test_not_a_teacher(self):
+        self.get_response('coursemember-bulk-add', self.enrolled_student, url_params=self.url_params,
+                          method='POST', data=[{'email': self.student.email}], expected_status_code=403)
+
+
+class TaskStatsCommitTestCase(TransactionTestCase):
+    """The rebuilds scheduled by the signals run after the commit, so they are tested with real transactions."""
+    def setUp(self):
+        self.data_manager = utility_funcs.TestDataManager()
+        self.teacher = self.data_manager.create_teacher('teacher@test.com')
+        self.student = self.data_manager.create_student('student@test.com')
+        self.course = utility_funcs.populate_course(self.teacher, [self.student])
+        self.chapter = self.data_manager.create_chapter(self.course)
+        self.task = self.data_manager.create_task(self.chapter, self.course.get_course_member_if_exists(self.teacher))
+        Task.objects.filter(pk=self.task.pk).update(deadline=timezone.now() + timedelta(days=1))
+        membership_cache.clear_local()
+
+        self.url_params = {'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'task_id': self.task.pk}
+        self.authorization = f'Bearer {RefreshToken.for_user(self.student).access_token}'
+        response = self.client.post(reverse('studentwork-list', kwargs=self.url_params), {'answer': 'Answer'},
+                                    content_type='application/json', HTTP_AUTHORIZATION=self.authorization)
+        self.work_id = response.data['id']
+
+    def test_answer_edit_keeps_stats(self):
+        stats = TaskStats.objects.get(task=self.task)
+
+        with mock.patch('courses.stats.rebuild_task_stats') as rebuild:
+            response = self.client.patch(reverse('studentwork-detail', kwargs={**self.url_params, 'pk': self.work_id}),
+                                         {'answer': 'Edited answer'}, content_type='application/json',
+                                         HTTP_AUTHORIZATION=self.authorization)
+
+        self.assertEquals(200, response.status_code)
+        rebuild.assert_not_called()
+        self.assertEquals(stats.updated_at, TaskStats.objects.get(task=self.task).updated_at)
+
+    def test_status_change_rebuilds_stats(self):
+        work = StudentWork.objects.get(pk=self.work_id)
+        work.status = StudentWork.SUBMITTED
+        work.save()
+
+        stats = TaskStats.objects.get(task=self.task)
+        self.assertEquals((0, 1), (stats.assigned_count, stats.submitted_count))
+
+
+class GroupEnrollmentTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.data_manager.create_group(cls.data_manager.departments[0], cls.data_manager.specialities[0],
+                                      name='ДА-93', study_year=3)
+        cls.group, cls.other_group = cls.data_manager.groups
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.students = [cls.data_manager.create_student(f'student{i}@test.com') for i in range(3)]
+        cls.other_student = cls.data_manager.create_student('student3@test.com', group=cls.other_group)
+        cls.course = utility_funcs.populate_course(cls.teacher, cls.students[:1])
+
+    def setUp(self):
+        membership_cache.get(self.teacher)
+        self.url_params = {'course_id': self.course.pk}
+
+    def _add_groups(self, data, expected_status_code=200):
+        return self.get_response('coursemember-add-groups', self.teacher, url_params=self.url_params, method='POST',
+                                 data=data, expected_status_code=expected_status_code)
+
+    def _get_student_ids(self):
+        return set(self.course.coursemember_set.filter(role=CourseMember.STUDENT).values_list('user_id', flat=True))
+
+    def test_add_groups(self):
+        membership_cache.get(self.students[1])
+        response = self._add_groups({'groups': [self.group.pk, self.other_group.pk]})
+
+        self.assertEquals(3, response.data['added'])
+        self.assertEquals({student.pk for student in self.students + [self.other_student]}, self._get_student_ids())
+        self.assertEquals(2, CourseGroup.objects.filter(course=self.course, sync_members=False).count())
+        # the insert does not send the signals, the maps are invalidated explicitly
+        self.assertIn(self.course.pk, membership_cache.get(self.students[1]))
+
+        response = self._add_groups({'groups': [self.group.pk], 'sync_members': True})
+        self.assertEquals(0, response.data['added'])
+        self.assertTrue(CourseGroup.objects.get(course=self.course, group=self.group).sync_members)
+
+    def test_unknown_group(self):
+        response = self._add_groups({'groups': [self.group.pk, 0]}, expected_status_code=400)
+
+        self.assertIn('groups', response.json())
+        self.assertEquals({self.students[0].pk}, self._get_student_ids())
+
+    def test_sync_members(self):
+        self._add_groups({'groups': [self.group.pk], 'sync_members': True})
+
+        student = self.data_manager.create_student('student4@test.com')
+        self.assertIn(student.pk, self._get_student_ids())
+
+        profile = student.student_profile
+        profile.group = self.other_group
+        profile.save()
+        self.assertNotIn(student.pk, self._get_student_ids())
+
+        self.other_student.student_profile.group = self.group
+        self.other_student.student_profile.save()
+        self.assertIn(self.other_student.pk, self._get_student_ids())
+
+    def test_sync_keeps_members_with_works(self):
+        self._add_groups({'groups': [self.group.pk], 'sync_members': True})
+        chapter = self.data_manager.create_chapter(self.course)
+        task = self.data_manager.create_task(chapter, self.course.get_course_member_if_exists(self.teacher))
+        StudentWork.objects.create(task=task, owner=self.course.get_course_member_if_exists(self.students[1]))
+
+        for student in self.students[1:]:
+            student.student_profile.delete()
+
+        self.assertEquals({self.students[0].pk, self.students[1].pk}, self._get_student_ids())
+
+    def test_sync_keeps_members_added_by_hand(self):
+        self._add_groups({'groups': [self.group.pk], 'sync_members': True})
+        link = CourseGroup.objects.get(course=self.course, group=self.group)
+        self.assertEquals(
+            {self.students[1].pk: link.pk, self.students[2].pk: link.pk},
+            dict(self.course.coursemember_set.exclude(course_group=None).values_list('user_id', 'course_group_id'))
+        )
+
+        for student in self.students:
+            student.student_profile.group = self.other_group
+            student.student_profile.save()
+
+        # the first student was enrolled before the group was linked
+        self.assertEquals({self.students[0].pk}, self._get_student_ids())
+
+    def test_sync_moves_members_between_linked_groups(self):
+        self._add_groups({'groups': [self.group.pk, self.other_group.pk], 'sync_members': True})
+
+        profile = self.students[1].student_profile
+        profile.group = self.other_group
+        profile.save()
+        self.assertIn(self.students[1].pk, self._get_student_ids())
+
+        # the member refers to the link of the new group
+        profile.delete()
+        self.assertNotIn(self.students[1].pk, self._get_student_ids())
+
+    def test_not_synced(self):
+        self._add_groups({'groups': [self.group.pk]})
+        student = self.data_manager.create_student('student4@test.com')
+
+        self.assertNotIn(student.pk, self._get_student_ids())
+
+
+class TaskStatsTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.student = cls.data_manager.create_student('student@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [cls.student])
+        cls.teacher_member = cls.course.get_course_member_if_exists(cls.teacher)
+        cls.chapter = cls.data_manager.create_chapter(cls.course)
+        cls.task = cls.data_manager.create_task(cls.chapter, cls.teacher_member)
+        Task.objects.filter(pk=cls.task.pk).update(deadline=timezone.now() + timedelta(days=1))
+
+    def setUp(self):
+        membership_cache.get(self.teacher)
+        membership_cache.get(self.student)
+        self.task_params = {'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'task_id': self.task.pk}
+
+    def _get_stats(self):
+        stats = TaskStats.objects.get(task=self.task)
+        return stats.assigned_count, stats.submitted_count, stats.graded_count, stats.grade_sum
+
+    def _create_work(self, user):
+        return self.get_response('studentwork-list', user, url_params=self.task_params, method='POST',
+                                 data={'answer': 'Answer'}, expected_status_code=201).data['id']
+
+    def test_work_lifecycle(self):
+        work_id = self._create_work(self.student)
+        self.assertEquals((1, 0, 0, 0), self._get_stats())
+
+        work_params = {**self.task_params, 'pk': work_id}
+        self.get_response('studentwork-submit', self.student, url_params=work_params, method='POST')
+        self.get_response('studentwork-submit', self.student, url_params=work_params, method='POST')
+        self.assertEquals((0, 1, 0, 0), self._get_stats())
+
+        grade_id = self.get_response('grade-list', self.teacher, url_params={'course_id': self.course.pk},
+                                     method='POST', data={'work': work_id, 'amount': 10},
+                                     expected_status_code=201).data['id']
+        self.assertEquals((0, 0, 1, 10), self._get_stats())
+
+        self.get_response('grade-detail', self.teacher, url_params={'course_id': self.course.pk, 'pk': grade_id},
+                          method='DELETE', expected_status_code=204)
+        self.assertEquals((0, 1, 0, 0), self._get_stats())
+
+        self.get_response('studentwork-unsubmit', self.student, url_params=work_params, method='POST')
+        self.get_response('studentwork-detail', self.student, url_params=work_params, method='DELETE',
+                          expected_status_code=204)
+        self.assertEquals((0, 0, 0, 0), self._get_stats())
+
+    def test_bulk_grading(self):
+        students = utility_funcs.populate_course_members(self.course, 3)
+        works = [StudentWork.objects.create(task=self.task, owner=self.course.get_course_member_if_exists(student),
+                                            status=StudentWork.SUBMITTED) for student in students]
+        rebuild_task_stats(Task.objects.filter(pk=self.task.pk))
+
+        self.get_response('grade-bulk-create', self.teacher, url_params={'course_id': self.course.pk},
+                          method='POST', data=[{'work': work.pk, 'amount': 6 + i} for i, work in enumerate(works[:2])],
+                          expected_status_code=201)
+
+        self.assertEquals((0, 1, 2, 13), self._get_stats())
+
+    def test_course_member_deletion(self):
+        work_id = self._create_work(self.student)
+        self.get_response('studentwork-submit', self.student, url_params={**self.task_params, 'pk': work_id},
+                          method='POST')
+        student_member = self.course.get_course_member_if_exists(self.student)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.get_response('coursemember-detail', self.teacher,
+                              url_params={'course_id': self.course.pk, 'pk': student_member.pk}, method='DELETE',
+                              expected_status_code=204)
+
+        self.assertEquals((0, 0, 0, 0), self._get_stats())
+
+    def test_user_account_deletion(self):
+        students = utility_funcs.populate_course_members(self.course, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            for student in students:
+                work = StudentWork.objects.create(task=self.task, status=StudentWork.GRADED,
+                                                  owner=self.course.get_course_member_if_exists(student))
+                Grade.objects.create(work=work, amount=7, grader=self.teacher_member)
+        self.assertEquals((0, 0, 2, 14), self._get_stats())
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            UserAccount.objects.filter(pk__in=[student.pk for student in students]).delete()
+
+        self.assertEquals((0, 0, 0, 0), self._get_stats())
+        # the works of both accounts are counted by a single rebuild
+        self.assertEquals(1, len([callback for callback in callbacks if isinstance(callback, PendingRebuild)]))
+
+    def test_untracked_changes(self):
+        work_id = self._create_work(self.student)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StudentWork.objects.filter(pk=work_id).update(status=StudentWork.GRADED)
+            Grade.objects.create(work_id=work_id, amount=8, grader=self.teacher_member)
+        self.assertEquals((0, 0, 1, 8), self._get_stats())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Grade.objects.filter(work=work_id).delete()
+        self.assertEquals((0, 0, 1, 0), self._get_stats())
+
+    def test_serialized_for_teachers(self):
+        work_id = self._create_work(self.student)
+        self.get_response('studentwork-submit', self.student, url_params={**self.task_params, 'pk': work_id},
+                          method='POST')
+        Grade.objects.create(work_id=work_id, amount=9, grader=self.teacher_member)
+        StudentWork.objects.filter(pk=work_id).update(status=StudentWork.GRADED)
+        rebuild_task_stats(Task.objects.filter(pk=self.task.pk))
+
+        url_params = {'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'pk': self.task.pk}
+        response = self.get_response('task-detail', self.teacher, url_params=url_params)
+        self.assertEquals({'assigned_count': 0, 'submitted_count': 0, 'graded_count': 1, 'average_grade': 9.0},
+                          response.data['stats'])
+
+        response = self.get_response('task-detail', self.student, url_params=url_params)
+        self.assertNotIn('stats', response.data)
+
+    def test_etag_changes_with_stats(self):
+        url_params = {'course_id': self.course.pk, 'chapter_id': self.chapter.pk, 'pk': self.task.pk}
+        etag = self.get_response('task-detail', self.teacher, url_params=url_params)['ETag']
+
+        self._create_work(self.student)
+
+        self.get_response('task-detail', self.teacher, url_params=url_params, HTTP_IF_NONE_MATCH=etag)
+
+    def test_rebuild_command(self):
+        self._create_work(self.student)
+        TaskStats.objects.all().delete()
+        other_task = self.data_manager.create_task(self.chapter, self.teacher_member)
+        TaskStats.objects.filter(task=other_task).update(assigned_count=5)
+
+        out = io.StringIO()
+        call_command('rebuild_task_stats', course_ids=[self.course.pk], stdout=out)
+
+        self.assertIn('2 tasks', out.getvalue())
+        self.assertEquals((1, 0, 0, 0), self._get_stats())
+        self.assertEquals(0, TaskStats.objects.get(task=other_task).assigned_count)
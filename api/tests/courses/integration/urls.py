@@ -0,0 +1,8 @@
+from django.urls import path, include
+
+from courses.urls import get_urlpatterns
+
+# the course endpoints with the async read views enabled
+urlpatterns = [
+    path('api/', include(get_urlpatterns(async_read_views=True))),
+]
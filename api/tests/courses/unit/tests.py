@@ -1,8 +1,16 @@
-from django.test import TestCase, RequestFactory
+import asyncio
+
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse, Http404
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
 from django.urls import resolve
 from tests import utility_funcs
 from courses.permissions import *
+from courses.cache import membership_cache
+from courses.middleware import CourseMiddleware
+from courses.routing import CourseRouteTable
 from courses.models import StudentWork
+from user_accounts.models import UserAccount
 
 
 class PermissionTestCase(TestCase):
@@ -28,6 +36,12 @@ class IsGlobalTeacherTestCase(PermissionTestCase):
         setattr(request, 'user', self.student)
         self.assertEquals(False, self.permission.has_permission(request, None))
 
+    def test_no_queries(self):
+        request = self.factory.get('api/courses/1/')
+        setattr(request, 'user', UserAccount.objects.get(pk=self.teacher.pk))
+        with self.assertNumQueries(0):
+            self.assertEquals(True, self.permission.has_permission(request, None))
+
 
 class IsGlobalTeacherOrReadOnlyTestCase(PermissionTestCase):
     def setUp(self):
@@ -122,3 +136,167 @@ class IsEditableStudentWorkTestCase(IsActiveTaskTestCase):
         current_student_work.status = StudentWork.SUBMITTED
         self.assertEquals(False, self.permission.has_object_permission(None, None, current_student_work))
 
+
+class CourseMiddlewareTestCase(PermissionTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.task, cls.student_work = utility_funcs.populate_course_content(
+            cls.course,
+            cls.course.get_course_member_if_exists(cls.teacher),
+            cls.course.get_course_member_if_exists(cls.student)
+        )
+        cls.chapter = cls.task.chapter
+        cls.outsider = UserAccount.objects.create(first_name='Outside', last_name='User', email='outsider@gmail.com')
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = CourseMiddleware(lambda request: HttpResponse())
+        membership_cache.clear_local()
+        membership_cache.get(self.teacher)
+        membership_cache.get(self.student)
+
+    def _process(self, path, user, method='get'):
+        request = getattr(self.factory, method)(path)
+        setattr(request, 'user', user)
+        return request, self.middleware(request)
+
+    def test_courses_level_queries(self):
+        with self.assertNumQueries(0):
+            self._process('/api/courses/', self.student)
+
+    def test_course_level_queries(self):
+        with self.assertNumQueries(1):
+            request, response = self._process(f'/api/{self.course.pk}/chapters/', self.student)
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(self.course, request.course)
+        self.assertEquals(CourseMember.STUDENT, request.course_member.role)
+        self.assertEquals(self.student, request.course_member.user)
+
+    def test_chapter_level_queries(self):
+        with self.assertNumQueries(1):
+            request, response = self._process(f'/api/{self.course.pk}/{self.chapter.pk}/tasks/', self.teacher)
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(self.chapter, request.chapter)
+        self.assertEquals(CourseMember.TEACHER, request.course_member.role)
+
+    def test_task_level_queries(self):
+        with self.assertNumQueries(1):
+            request, response = self._process(
+                f'/api/{self.course.pk}/{self.chapter.pk}/tasks/{self.task.pk}/student-works/',
+                self.student
+            )
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(self.task, request.task)
+        self.assertEquals(self.chapter, request.chapter)
+        self.assertEquals(self.course, request.course)
+
+    @override_settings(COURSE_MEMBERSHIP_CACHE=False)
+    def test_uncached_membership_queries(self):
+        with self.assertNumQueries(1):
+            request, response = self._process(
+                f'/api/{self.course.pk}/{self.chapter.pk}/tasks/{self.task.pk}/student-works/',
+                self.student
+            )
+
+        self.assertEquals(CourseMember.STUDENT, request.course_member.role)
+        self.assertEquals(self.task, request.task)
+
+    def test_course_does_not_exist(self):
+        self.assertRaises(Http404, self._process, '/api/2001/1/tasks/', self.student)
+
+    def test_not_enrolled(self):
+        _, response = self._process(f'/api/{self.course.pk}/2001/tasks/', self.outsider)
+        self.assertEquals(403, response.status_code)
+
+    def test_not_enrolled_enrollment(self):
+        request, response = self._process(f'/api/{self.course.pk}/course_members/', self.outsider, method='post')
+        self.assertEquals(200, response.status_code)
+        self.assertIsNone(request.course_member)
+
+    def test_chapter_does_not_exist(self):
+        _, response = self._process(f'/api/{self.course.pk}/2001/tasks/{self.task.pk}/student-works/', self.student)
+        self.assertEquals(404, response.status_code)
+        self.assertIn('chapter', response.content.decode())
+
+    def test_task_does_not_exist(self):
+        _, response = self._process(f'/api/{self.course.pk}/{self.chapter.pk}/tasks/2001/student-works/', self.student)
+        self.assertEquals(404, response.status_code)
+        self.assertIn('task', response.content.decode())
+
+    def test_async_non_course_path(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = CourseMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+
+        request = self.factory.get('/api/courses/')
+        setattr(request, 'user', self.student)
+        with self.assertNumQueries(0):
+            response = async_to_sync(middleware)(request)
+
+        self.assertEquals(200, response.status_code)
+
+
+class CourseMembershipCacheTestCase(PermissionTestCase):
+    def setUp(self):
+        membership_cache.clear_local()
+
+    def test_cached(self):
+        memberships = membership_cache.get(self.student)
+        self.assertEquals(CourseMember.STUDENT, memberships[self.course.pk][1])
+
+        with self.assertNumQueries(0):
+            self.assertEquals(memberships, membership_cache.get(self.student))
+
+    def test_invalidated_on_save(self):
+        membership_cache.get(self.student)
+        new_course = utility_funcs.populate_course(self.teacher, [self.student])
+        self.assertIn(new_course.pk, membership_cache.get(self.student))
+
+    def test_invalidated_on_delete(self):
+        membership_cache.get(self.student)
+        self.course.get_course_member_if_exists(self.student).delete()
+        self.assertNotIn(self.course.pk, membership_cache.get(self.student))
+
+
+class CourseRouteTableTestCase(SimpleTestCase):
+    course_paths = [
+        '/api/1/',
+        '/api/1/chapters/',
+        '/api/1/chapters/2/',
+        '/api/1/chapters.json',
+        '/api/1/course_members/add-members/',
+        '/api/1/2/materials/3/attachments/4/',
+        '/api/1/2/tasks/3/',
+        '/api/1/2/tasks/3/student-works/',
+        '/api/1/2/tasks/3/student-works/4/submit/',
+    ]
+    other_paths = [
+        '/admin/',
+        '/api/',
+        '/api/courses/',
+        '/api/courses/1/',
+        '/api/auth/user/',
+        '/api/structures/groups/1/',
+        '/api/1/unknown/',
+        '/api/1/2/tasks/3/unknown/',
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.route_table = CourseRouteTable()
+
+    def test_course_paths(self):
+        for path in self.course_paths:
+            view, _, kwargs = resolve(path)
+            self.assertEquals((view, kwargs), self.route_table.match(path), path)
+
+    def test_other_paths(self):
+        for path in self.other_paths:
+            self.assertIsNone(self.route_table.match(path), path)
@@ -0,0 +1,295 @@
+import smtplib
+from datetime import timedelta
+from unittest import mock
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.db import IntegrityError
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from Desk2.celery import app
+from user_accounts.models import OutgoingEmail, UserAccount
+from user_accounts import outbox
+from user_accounts.outbox import deliver_emails, purge_emails, queue_email
+from user_accounts.tasks import deliver_outbox
+from tests import utility_funcs
+from user_accounts.token_stores import get_token_store
+from user_accounts.tokens import EmailConfirmationUnregisteredTokenGenerator, PasswordChangeTokenGenerator, \
+    TwoFATokenGenerator
+
+
+class TokenObtainViewTestCase(TestCase):
+    password = 'Secret-password-1'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserAccount.objects.create_user('user@test.com', cls.password, 'John', 'Loe')
+        UserAccount.objects.filter(pk=cls.user.pk).update(email_confirmed=True, twoFA_enabled=False)
+
+    def setUp(self):
+        # the login requests are throttled
+        cache.clear()
+
+    def _login(self, expected_status_code=200, **data):
+        response = self.client.post(reverse('user_account:jwt-obtain'), {'email': self.user.email, 'password': self.password,
+                                                            **data}, content_type='application/json')
+        self.assertEquals(expected_status_code, response.status_code)
+
+        return response
+
+    def test_password_hashed_once(self):
+        with mock.patch.object(PBKDF2PasswordHasher, 'verify', autospec=True,
+                               side_effect=PBKDF2PasswordHasher.verify) as verify:
+            response = self._login()
+
+        self.assertEquals(1, verify.call_count)
+        self.assertEquals(self.user.pk, AccessToken(response.data['access'])['user_id'])
+        self.assertIn('refresh', response.data)
+
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+    def test_invalid_password(self):
+        response = self._login(expected_status_code=401, password='Wrong-password-1')
+        self.assertNotIn('access', response.data)
+
+    def test_email_not_confirmed(self):
+        UserAccount.objects.filter(pk=self.user.pk).update(email_confirmed=False)
+        response = self._login(expected_status_code=403)
+
+        self.assertNotIn('access', response.data)
+
+    @override_settings(TOKEN_STORE='user_accounts.token_stores.LocalTokenStore')
+    def test_2fa(self):
+        UserAccount.objects.filter(pk=self.user.pk).update(twoFA_enabled=True)
+        self.user.refresh_from_db()
+
+        response = self._login(expected_status_code=401)
+        self.assertNotIn('access', response.data)
+
+        response = self._login(expected_status_code=400, **{'2FA_code': 'invalid'})
+        self.assertNotIn('access', response.data)
+
+        token = TwoFATokenGenerator().make_token(self.user)
+        with mock.patch.object(PBKDF2PasswordHasher, 'verify', autospec=True,
+                               side_effect=PBKDF2PasswordHasher.verify) as verify:
+            response = self._login(**{'2FA_code': token})
+
+        self.assertEquals(1, verify.call_count)
+        self.assertIn('access', response.data)
+
+        # the code is consumed
+        self._login(expected_status_code=400, **{'2FA_code': token})
+
+
+@override_settings(TOKEN_STORE='user_accounts.token_stores.LocalTokenStore')
+class RegistrationTestCase(TestCase):
+    email = 'new@test.com'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher, _ = utility_funcs.populate_users('teacher@test.com', 'student@test.com')
+
+    def setUp(self):
+        self.token = EmailConfirmationUnregisteredTokenGenerator().make_token(self.email)
+
+    def _register(self, expected_status_code, **data):
+        profile = self.teacher.teacher_profile
+        response = self.client.post(reverse('user_account:user-list'), {
+            'email': self.email, 'password': 'Secret-password-1', 'email-token': self.token, 'profile_type': 'teacher',
+            'first_name': 'Jane', 'last_name': 'Doe', 'department': self.teacher.department_id,
+            'position': profile.position_id, 'scientific_degree': profile.scientific_degree_id, **data
+        }, content_type='application/json')
+        self.assertEquals(expected_status_code, response.status_code)
+
+        return response
+
+    def test_registered(self):
+        self._register(201)
+
+        self.assertTrue(UserAccount.objects.get(email=self.email).check_password('Secret-password-1'))
+        self.assertIsNone(get_token_store().get(f'unregistered_{self.email}'))
+
+    def test_invalid_token_rejected_before_hashing(self):
+        with mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True,
+                               side_effect=PBKDF2PasswordHasher.encode) as encode:
+            self._register(400, **{'email-token': 'invalid'})
+
+        self.assertEquals(0, encode.call_count)
+        self.assertFalse(UserAccount.objects.filter(email=self.email).exists())
+        self.assertEquals(self.token, get_token_store().get(f'unregistered_{self.email}'))
+
+    def test_token_restored_when_saving_fails(self):
+        with mock.patch('user_accounts.views.UserAccountSerializer.save', side_effect=IntegrityError):
+            self._register(400)
+
+        self.assertEquals(self.token, get_token_store().get(f'unregistered_{self.email}'))
+        self._register(201)
+
+
+@override_settings(TOKEN_STORE='user_accounts.token_stores.LocalTokenStore')
+class ResetPasswordViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserAccount.objects.create_user('user@test.com', 'Secret-password-1', 'John', 'Loe')
+
+    def _reset(self, token, password, expected_status_code):
+        response = self.client.post(reverse('user_account:reset-password'), {
+            'email': self.user.email, 'token': token, 'password': password
+        }, content_type='application/json')
+        self.assertEquals(expected_status_code, response.status_code)
+
+    def test_token_consumed_once(self):
+        token = PasswordChangeTokenGenerator().make_token(self.user)
+
+        self._reset('invalid', 'New-password-1', 400)
+        self._reset(token, 'New-password-2', 204)
+        self._reset(token, 'New-password-3', 400)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('New-password-2'))
+
+
+@override_settings(TOKEN_STORE='user_accounts.token_stores.LocalTokenStore')
+class EmailOutboxTestCase(TestCase):
+    def setUp(self):
+        # the tasks are run in the process, as no worker is available
+        eager_conf = {'task_always_eager': True, 'task_eager_propagates': True}
+        self.addCleanup(app.conf.update, {name: app.conf[name] for name in eager_conf})
+        app.conf.update(eager_conf)
+
+    def _queue_emails(self, *recipients):
+        with self.captureOnCommitCallbacks():
+            for recipient in recipients:
+                queue_email('Desk2 Team', 'Body', recipient)
+
+    def _refuse(self, *recipients):
+        send_messages = locmem.EmailBackend.send_messages
+
+        def refuse(backend, messages):
+            if messages[0].to[0] in recipients:
+                raise smtplib.SMTPRecipientsRefused({messages[0].to[0]: (550, b'Mailbox unavailable')})
+            return send_messages(backend, messages)
+
+        return mock.patch.object(locmem.EmailBackend, 'send_messages', autospec=True, side_effect=refuse)
+
+    def test_sent_after_response(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('user_account:send-token', kwargs={'token_type': 'email-confirm'}),
+                                        {'email': 'new@test.com'}, content_type='application/json')
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(0, len(mail.outbox))
+        self.assertEquals(1, OutgoingEmail.objects.count())
+
+        for callback in callbacks:
+            callback()
+
+        self.assertEquals(['new@test.com'], mail.outbox[0].to)
+        self.assertEquals(settings.DEFAULT_FROM_EMAIL, mail.outbox[0].from_email)
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+    def test_single_connection(self):
+        self._queue_emails(*[f'user{i}@test.com' for i in range(5)])
+
+        with mock.patch('user_accounts.outbox.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEquals(5, deliver_emails(batch_size=2))
+
+        self.assertEquals(1, get_connection.call_count)
+        self.assertEquals([f'user{i}@test.com' for i in range(5)], [message.to[0] for message in mail.outbox])
+
+    def test_empty_outbox_no_connection(self):
+        with mock.patch('user_accounts.outbox.get_connection') as get_connection:
+            self.assertEquals(0, deliver_emails())
+
+        get_connection.assert_not_called()
+
+    def test_claimed_messages_skipped(self):
+        self._queue_emails('user@test.com')
+        # another worker has claimed the message
+        self.assertEquals(1, len(outbox._claim_batch(10)))
+
+        with mock.patch('user_accounts.outbox.get_connection') as get_connection:
+            self.assertEquals(0, deliver_emails())
+        get_connection.assert_not_called()
+
+        # the claim expires
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEquals(1, deliver_emails())
+
+    def test_connection_error_releases_messages(self):
+        self._queue_emails('user1@test.com', 'user2@test.com')
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=smtplib.SMTPServerDisconnected):
+            self.assertRaises(smtplib.SMTPServerDisconnected, deliver_emails)
+
+        self.assertEquals(
+            [(OutgoingEmail.PENDING, 0)] * 2, list(OutgoingEmail.objects.values_list('status', 'attempts'))
+        )
+        self.assertEquals(2, deliver_emails())
+
+    def test_refused_message_retried(self):
+        self._queue_emails('bad@test.com', 'good@test.com')
+
+        with self._refuse('bad@test.com'):
+            self.assertEquals(1, deliver_emails())
+            # the next attempt is postponed
+            self.assertEquals(0, deliver_emails())
+
+        email = OutgoingEmail.objects.get()
+        self.assertEquals((OutgoingEmail.PENDING, 1), (email.status, email.attempts))
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY - 5))
+
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEquals(1, deliver_emails())
+        self.assertEquals(['good@test.com', 'bad@test.com'], [message.to[0] for message in mail.outbox])
+
+    def test_failed_after_max_attempts(self):
+        self._queue_emails('bad@test.com')
+        OutgoingEmail.objects.update(attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS - 1)
+
+        with self._refuse('bad@test.com'):
+            self.assertEquals(0, deliver_emails())
+
+        self.assertEquals(OutgoingEmail.FAILED, OutgoingEmail.objects.get().status)
+
+    def test_connection_error_retried(self):
+        self._queue_emails('user@test.com')
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=smtplib.SMTPServerDisconnected), \
+                mock.patch.object(deliver_outbox, 'retry', side_effect=Retry) as retry:
+            self.assertRaises(Retry, deliver_outbox.apply)
+
+        self.assertEquals(settings.EMAIL_OUTBOX_RETRY_DELAY, retry.call_args.kwargs['countdown'])
+        self.assertEquals((OutgoingEmail.PENDING, 0), OutgoingEmail.objects.values_list('status', 'attempts').get())
+
+    def test_purged_after_retention(self):
+        self._queue_emails('failed@test.com', 'claimed@test.com', 'pending@test.com', 'recent@test.com')
+        OutgoingEmail.objects.filter(to='failed@test.com').update(status=OutgoingEmail.FAILED)
+        OutgoingEmail.objects.filter(to='claimed@test.com').update(status=OutgoingEmail.SENDING)
+        OutgoingEmail.objects.exclude(to='recent@test.com').update(
+            created_at=timezone.now() - timedelta(seconds=settings.EMAIL_OUTBOX_RETENTION + 1)
+        )
+        OutgoingEmail.objects.filter(to='recent@test.com').update(status=OutgoingEmail.FAILED)
+
+        self.assertEquals(2, purge_emails())
+        remaining = OutgoingEmail.objects.order_by('to').values_list('to', flat=True)
+        self.assertEquals(['pending@test.com', 'recent@test.com'], list(remaining))
+
+    def test_purged_by_delivery(self):
+        self._queue_emails('bad@test.com')
+        OutgoingEmail.objects.update(
+            status=OutgoingEmail.FAILED,
+            created_at=timezone.now() - timedelta(seconds=settings.EMAIL_OUTBOX_RETENTION + 1)
+        )
+
+        deliver_outbox.apply()
+
+        self.assertFalse(OutgoingEmail.objects.exists())
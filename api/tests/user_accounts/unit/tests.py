@@ -0,0 +1,237 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from time import monotonic
+from unittest import mock
+from uuid import uuid4
+
+import fakeredis
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from tests import utility_funcs
+
+from user_accounts import token_stores
+from user_accounts.models import UserAccount, TeacherProfile, StudentProfile, StoredToken
+from user_accounts.serializers import UserAccountSerializer
+from user_accounts.signals import backfill_profile_types
+from user_accounts.tokens import EmailConfirmationUnregisteredTokenGenerator, PasswordChangeTokenGenerator, \
+    TwoFATokenGenerator
+
+
+class ProfileTypeTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher, cls.student = utility_funcs.populate_users('teacher@gmail.com', 'student@gmail.com')
+
+    def test_set_on_create(self):
+        self.assertEquals(UserAccount.TEACHER, self.teacher.profile_type)
+        self.assertEquals(UserAccount.STUDENT, UserAccount.objects.get(pk=self.student.pk).profile_type)
+
+    def test_cleared_on_delete(self):
+        self.student.student_profile.delete()
+        student = UserAccount.objects.get(pk=self.student.pk)
+
+        self.assertEquals('', student.profile_type)
+        self.assertRaises(AttributeError, getattr, student, 'profile')
+
+    def test_profile_single_query(self):
+        teacher = UserAccount.objects.get(pk=self.teacher.pk)
+        with self.assertNumQueries(1):
+            self.assertIsInstance(teacher.profile, TeacherProfile)
+
+    def test_profile_select_related(self):
+        student = UserAccount.objects.select_related('student_profile').get(pk=self.student.pk)
+        with self.assertNumQueries(0):
+            self.assertIsInstance(student.profile, StudentProfile)
+
+    def test_is_teacher_no_queries(self):
+        teacher = UserAccount.objects.get(pk=self.teacher.pk)
+        student = UserAccount.objects.get(pk=self.student.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(teacher.is_teacher)
+            self.assertFalse(student.is_teacher)
+
+    def test_not_serialized(self):
+        self.assertNotIn('profile_type', UserAccountSerializer(instance=self.teacher).data)
+
+    def test_backfill(self):
+        UserAccount.objects.update(profile_type='')
+        backfill_profile_types(sender=None)
+
+        self.assertEquals(UserAccount.TEACHER, UserAccount.objects.get(pk=self.teacher.pk).profile_type)
+        self.assertEquals(UserAccount.STUDENT, UserAccount.objects.get(pk=self.student.pk).profile_type)
+
+
+class TokenStoreConformanceMixin:
+    """
+    The behaviour every token store should have (see user_accounts.token_stores.BaseTokenStore). A test case of a
+    store defines **get_store** and **expire**, which makes the stored tokens expire.
+    """
+    def get_store(self):
+        raise NotImplementedError
+
+    def expire(self, seconds):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.get_store()
+        # the keys are unique, so the stores that outlive a test do not share its tokens
+        self.key = f'test_{uuid4().hex}'
+
+    def test_get(self):
+        self.assertIsNone(self.store.get(self.key))
+
+        self.store.set(self.key, '1234567', 60)
+        self.assertEquals('1234567', self.store.get(self.key))
+
+    def test_replaced(self):
+        self.store.set(self.key, '1234567', 60)
+        self.store.set(self.key, '7654321', 60)
+
+        self.assertEquals('7654321', self.store.get(self.key))
+        self.assertFalse(self.store.consume(self.key, '1234567'))
+        self.assertTrue(self.store.consume(self.key, '7654321'))
+
+    def test_consumed_once(self):
+        self.store.set(self.key, '1234567', 60)
+
+        self.assertTrue(self.store.consume(self.key, '1234567'))
+        self.assertFalse(self.store.consume(self.key, '1234567'))
+        self.assertIsNone(self.store.get(self.key))
+
+    def test_invalid_token_kept(self):
+        self.store.set(self.key, '1234567', 60)
+
+        self.assertFalse(self.store.consume(self.key, '7654321'))
+        self.assertFalse(self.store.consume(f'{self.key}_other', '1234567'))
+        self.assertEquals('1234567', self.store.get(self.key))
+
+    def test_delete(self):
+        self.store.set(self.key, '1234567', 60)
+        self.store.delete(self.key)
+        self.store.delete(self.key)
+
+        self.assertIsNone(self.store.get(self.key))
+        self.assertFalse(self.store.consume(self.key, '1234567'))
+
+    def test_expired(self):
+        self.store.set(self.key, '1234567', 1)
+        self.store.set(f'{self.key}_other', '1234567', 60)
+        self.expire(2)
+
+        self.assertIsNone(self.store.get(self.key))
+        self.assertFalse(self.store.consume(self.key, '1234567'))
+        self.assertTrue(self.store.consume(f'{self.key}_other', '1234567'))
+
+
+class LocalTokenStoreTestCase(TokenStoreConformanceMixin, SimpleTestCase):
+    def get_store(self):
+        return token_stores.LocalTokenStore(max_size=10)
+
+    def expire(self, seconds):
+        now = monotonic()
+        patcher = mock.patch('utils.cache.monotonic', return_value=now + seconds)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_evicted(self):
+        for i in range(11):
+            self.store.set(f'{self.key}_{i}', '1234567', 60)
+
+        self.assertIsNone(self.store.get(f'{self.key}_0'))
+        self.assertEquals('1234567', self.store.get(f'{self.key}_10'))
+
+    def test_concurrent_consume(self):
+        self.store.set(self.key, '1234567', 60)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: self.store.consume(self.key, '1234567'), range(32)))
+
+        self.assertEquals(1, results.count(True))
+
+
+class DatabaseTokenStoreTestCase(TokenStoreConformanceMixin, TestCase):
+    def get_store(self):
+        return token_stores.DatabaseTokenStore()
+
+    def expire(self, seconds):
+        now = timezone.now()
+        patcher = mock.patch('user_accounts.token_stores.timezone.now', return_value=now + timedelta(seconds=seconds))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_consume_single_query(self):
+        self.store.set(self.key, '1234567', 60)
+        with self.assertNumQueries(1):
+            self.assertTrue(self.store.consume(self.key, '1234567'))
+
+    def test_clear_expired(self):
+        self.store.set(self.key, '1234567', 1)
+        self.store.set(f'{self.key}_other', '1234567', 60)
+        self.expire(2)
+
+        self.assertEquals(1, self.store.clear_expired())
+        self.assertEquals([f'{self.key}_other'], list(StoredToken.objects.values_list('key', flat=True)))
+
+
+class RedisTokenStoreTestCase(TokenStoreConformanceMixin, SimpleTestCase):
+    """
+    Runs against an in-process redis server (fakeredis), which executes the Lua scripts as well.
+    """
+    def get_store(self):
+        patcher = mock.patch('utils.redis_client.get_redis_client', return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        return token_stores.RedisTokenStore()
+
+    def expire(self, seconds):
+        fake_time = mock.Mock(wraps=time)
+        fake_time.time.return_value = time.time() + seconds
+        patcher = mock.patch('fakeredis._server.time', fake_time)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_consume_single_command(self):
+        # the script is loaded to the server on the first call
+        self.store.consume(f'{self.key}_other', '1234567')
+        self.store.set(self.key, '1234567', 60)
+        with mock.patch.object(fakeredis.FakeRedis, 'execute_command', autospec=True,
+                               side_effect=fakeredis.FakeRedis.execute_command) as execute_command:
+            self.assertTrue(self.store.consume(self.key, '1234567'))
+
+        self.assertEquals(['EVALSHA'], [call.args[1] for call in execute_command.call_args_list])
+
+
+@override_settings(TOKEN_STORE='user_accounts.token_stores.LocalTokenStore')
+class StoredTokenGeneratorTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, _ = utility_funcs.populate_users('teacher@gmail.com', 'student@gmail.com')
+
+    def setUp(self):
+        token_stores.get_token_store().clear()
+
+    def test_consumed_once(self):
+        token_generator = TwoFATokenGenerator()
+        token = token_generator.make_token(self.user)
+
+        self.assertEquals(settings.TWO_FA_TOKEN_LENGTH, len(token))
+        self.assertFalse(token_generator.consume_token(self.user, None))
+        self.assertTrue(token_generator.consume_token(self.user, token))
+        self.assertFalse(token_generator.consume_token(self.user, token))
+
+    def test_check_token(self):
+        token_generator = EmailConfirmationUnregisteredTokenGenerator()
+        token = token_generator.make_token('new@gmail.com')
+
+        self.assertFalse(token_generator.check_token('other@gmail.com', token))
+        self.assertTrue(token_generator.check_token('new@gmail.com', token))
+        self.assertTrue(token_generator.check_token('new@gmail.com', token, remove_from_storage=True))
+        self.assertFalse(token_generator.check_token('new@gmail.com', token))
+
+    def test_keys(self):
+        token = PasswordChangeTokenGenerator().make_token(self.user)
+
+        self.assertEquals(token, token_stores.get_token_store().get(f'password_{self.user.pk}'))
+        self.assertFalse(TwoFATokenGenerator().consume_token(self.user, token))
@@ -1,3 +1,5 @@
+from time import perf_counter
+
 from university_structures import models as university_structures
 from user_accounts import models as user_accounts
 from courses import models as courses
@@ -280,7 +282,62 @@ def populate_course_content(course, teacher, student):
     return task, student_work
 
 
+# the maximum number of SQL queries per request of an endpoint (see utils.metrics.get_view_name for the names),
+# including the authentication, the course context and a membership cache miss queries. The atomic blocks of a view
+# add two savepoint queries, because a test runs in a transaction. Every request made by **ViewSetTestCase** is
+# checked.
+QUERY_BUDGETS = {
+    'ChapterViewSet.list': 6,
+    'ChapterViewSet.retrieve': 6,
+    'ChapterViewSet.partial_update': 8,
+    'ChapterViewSet.destroy': 12,
+    'CourseMemberViewSet.list': 3,
+    'CourseMemberViewSet.retrieve': 3,
+    'CourseMemberViewSet.create': 4,
+    'CourseMemberViewSet.add_student': 5,
+    'CourseMemberViewSet.bulk_add': 7,
+    'CourseMemberViewSet.bulk_status': 3,
+    'CourseMemberViewSet.add_groups': 9,
+    'CourseMemberViewSet.destroy': 15,
+    'CourseViewSet.list': 4,
+    'CourseViewSet.create': 5,
+    'CourseViewSet.update': 6,
+    'CourseViewSet.destroy': 11,
+    'GradeViewSet.list': 4,
+    'GradeViewSet.bulk_create': 9,
+    'GradebookView.get': 6,
+    'GradeViewSet.destroy': 9,
+    'MaterialViewSet.list': 5,
+    'MaterialViewSet.partial_update': 7,
+    'MaterialViewSet.destroy': 6,
+    'StudentWorkViewSet.list': 5,
+    'StudentWorkViewSet.partial_update': 9,
+    'StudentWorkViewSet.destroy': 10,
+    'TaskViewSet.list': 6,
+    'TaskViewSet.create': 7,
+    'TaskViewSet.partial_update': 7,
+    'TaskViewSet.destroy': 13,
+}
+
+
 class ViewSetTestCase(TestCase):
+    query_budgets = QUERY_BUDGETS
+
+    def assertQueryBudget(self, response, budget=None):
+        """
+        Asserts that a request did not execute more SQL queries than the budget of its endpoint.
+        :param response: a response of the test client
+        :param budget: the maximum number of queries, by default it is taken from *query_budgets*
+        """
+        request_metrics = response.wsgi_request.metrics
+        budget = budget if budget is not None else self.query_budgets.get(request_metrics.view)
+        if budget is not None:
+            self.assertLessEqual(
+                request_metrics.queries,
+                budget,
+                f'{request_metrics.view} executed {request_metrics.queries} queries, the budget is {budget}.'
+            )
+
     def _get_response(self, url_name, **kwargs):
         data = kwargs.pop('data', {})
         method = kwargs.pop('method', 'GET')
@@ -306,6 +363,7 @@ class ViewSetTestCase(TestCase):
 
         response = func(url, data, **kwargs)
         self.assertEquals(expected_status_code, response.status_code)
+        self.assertQueryBudget(response)
 
         return response
 
@@ -318,3 +376,32 @@ class AuthorizedViewSetTestCase(ViewSetTestCase):
             self.token = str(refresh.access_token)
 
         return self._get_response(url_name, HTTP_AUTHORIZATION=f'Bearer {self.token}', **kwargs)
+
+
+def run_benchmark(func, iterations, warmup=10):
+    """
+    Calls a given function *iterations* times after a few warm-up calls.
+    :return: a number of calls per second
+    """
+    for _ in range(warmup):
+        func()
+
+    start = perf_counter()
+    for _ in range(iterations):
+        func()
+
+    return iterations / (perf_counter() - start)
+
+
+def populate_course_members(course, members_number, email_template='member{}@test.com'):
+    """Creates users and enrolls them in a given course as students using bulk inserts."""
+    user_accounts.UserAccount.objects.bulk_create([
+        user_accounts.UserAccount(first_name='Dane', last_name='Green', email=email_template.format(i))
+        for i in range(members_number)
+    ])
+    users = user_accounts.UserAccount.objects.filter(email__in=[email_template.format(i) for i in range(members_number)])
+    courses.CourseMember.objects.bulk_create([
+        courses.CourseMember(user=user, course=course, role=courses.CourseMember.STUDENT) for user in users
+    ])
+
+    return list(users)
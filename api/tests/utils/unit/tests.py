@@ -1,11 +1,27 @@
-from django.test import SimpleTestCase, TestCase
-from django.db import models
+from unittest import mock
+
+import redis
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, models
+from django.urls import reverse, resolve, NoReverseMatch
+from rest_framework_simplejwt.tokens import RefreshToken
 from tests import utility_funcs
 
+from utils import loaders
+from utils import metrics
 from utils import normalizers
+from utils import querysets
+from utils import redis_client
 from utils import serializers
+from utils import throttling
+from utils import urls
 from utils import validators
 
+from courses.models import Attachment, Chapter, Material, StudentWork, Task
+from courses.serializers import ChapterSerializer, StudentWorkSerializer, TaskSerializer
 from user_accounts.serializers import UserAccountSerializer
 
 
@@ -107,3 +123,346 @@ class RegexValidatorTestCase(SimpleTestCase):
     def test_cyrillic(self):
         validator = validators.get_regex_validator('test')
         validator('Український текст і буква ґ')
+
+
+class RequestMetricsTestCase(utility_funcs.AuthorizedViewSetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data_manager = utility_funcs.TestDataManager()
+        cls.teacher = cls.data_manager.create_teacher('teacher@test.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [])
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_request_metrics(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_response('chapter-list', self.teacher, url_params={'course_id': self.course.pk})
+
+        request_metrics = response.wsgi_request.metrics
+        self.assertEquals('ChapterViewSet.list', request_metrics.view)
+        self.assertEquals(len(context.captured_queries), request_metrics.queries)
+        self.assertGreater(request_metrics.db_duration, 0)
+
+    @override_settings(METRICS_TOKEN='metrics-token')
+    def test_metrics_view(self):
+        self.get_response('chapter-list', self.teacher, url_params={'course_id': self.course.pk})
+        content = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer metrics-token').content.decode()
+
+        for metric in ('http_request_duration_seconds', 'http_request_db_queries', 'http_request_db_duration_seconds',
+                       'http_response_size_bytes'):
+            self.assertIn(f'{metric}_count{{view="ChapterViewSet.list"}}', content)
+
+        self.assertIn('http_request_auth_lookups_total{view="ChapterViewSet.list"}', content)
+
+    @override_settings(METRICS_TOKEN='metrics-token')
+    def test_metrics_view_requires_token(self):
+        self.assertEquals(403, self.client.get(reverse('metrics')).status_code)
+        self.assertEquals(403, self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code)
+        # a user token is not accepted
+        self.assertEquals(403, self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.teacher).access_token}'
+        ).status_code)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_view_disabled(self):
+        self.assertEquals(403, self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code)
+
+    def test_custom_action_view_name(self):
+        request = self.factory.post('/api/1/2/tasks/3/student-works/4/submit/')
+        self.assertEquals('StudentWorkViewSet.submit', metrics.get_view_name(request))
+
+    def test_unresolved_view_name(self):
+        request = self.factory.get('/api/1/unknown/')
+        self.assertEquals(metrics.UNRESOLVED_VIEW, metrics.get_view_name(request))
+
+    def test_query_budget(self):
+        response = self.get_response('chapter-list', self.teacher, url_params={'course_id': self.course.pk})
+        self.assertRaises(AssertionError, self.assertQueryBudget, response, 0)
+
+
+class QuerysetOptimizationTestCase(SimpleTestCase):
+    def test_nested_serializers(self):
+        optimization = querysets.QuerysetOptimization(StudentWorkSerializer(), StudentWork)
+
+        self.assertEquals(['owner', 'owner__user', 'grade', 'grade__grader', 'grade__grader__user'],
+                          optimization.select_related)
+        # loaded by the list serializer
+        self.assertEquals([], optimization.prefetch_related)
+
+        # the public user serializer reads model fields only, so the other user fields are not loaded
+        self.assertIn('owner__user__first_name', optimization.only)
+        self.assertNotIn('owner__user__email', optimization.only)
+        self.assertIn('owner__role', optimization.only)
+
+    def test_reverse_relations(self):
+        optimization = querysets.QuerysetOptimization(ChapterSerializer(), Chapter)
+
+        self.assertEquals([], optimization.select_related)
+        self.assertEquals(['task_set', 'material_set'], optimization.prefetch_related)
+
+    def test_apply_read_only(self):
+        optimization = querysets.QuerysetOptimization(ChapterSerializer(), Chapter)
+        queryset = optimization.apply(Chapter.objects.all(), read_only=True)
+
+        self.assertEquals(['task_set', 'material_set'],
+                          [lookup.prefetch_to for lookup in queryset._prefetch_related_lookups])
+        self.assertTrue(queryset.query.deferred_loading[0])
+
+    def test_prefetch_only(self):
+        optimization = querysets.QuerysetOptimization(ChapterSerializer(fields=['id', 'task_set']), Chapter)
+
+        # the primary key and the foreign key the tasks are joined by are kept
+        self.assertEquals((Task, ['chapter', 'deadline', 'id', 'is_archived', 'published_at', 'title']),
+                          optimization.prefetch_only['task_set'])
+        self.assertNotIn('material_set', optimization.prefetch_only)
+
+    def test_apply_write(self):
+        optimization = querysets.QuerysetOptimization(StudentWorkSerializer(), StudentWork)
+
+        queryset = optimization.apply(StudentWork.objects.all())
+
+        self.assertIn('owner', queryset.query.select_related)
+        self.assertFalse(queryset.query.deferred_loading[0])
+
+    def test_apply_without_relations(self):
+        optimization = querysets.QuerysetOptimization(ChapterSerializer(), Chapter)
+
+        queryset = optimization.apply(Chapter.objects.all())
+
+        self.assertEquals((), queryset._prefetch_related_lookups)
+
+    def test_attribute_sources(self):
+        optimization = querysets.QuerysetOptimization(TaskSerializer(), Task)
+
+        # *deadline_passed* and *is_planned* are properties, their sources are declared by the serializer
+        self.assertIn('deadline', optimization.only)
+        self.assertIn('published_at', optimization.only)
+        self.assertIn('author__role', optimization.only)
+
+    def test_sparse_fieldset(self):
+        sparse_fieldset = serializers.SparseFieldset(frozenset(['id', 'title', 'deadline_passed']), frozenset())
+        optimization = querysets.get_queryset_optimization(TaskSerializer, Task, sparse_fieldset)
+
+        self.assertEquals([], optimization.select_related)
+        self.assertEquals(['deadline', 'id', 'title'], optimization.only)
+        self.assertIs(optimization, querysets.get_queryset_optimization(TaskSerializer, Task, sparse_fieldset))
+
+
+class SparseFieldsetMixinTestCase(SimpleTestCase):
+    def test_fields(self):
+        serializer = TaskSerializer(fields=['id', 'title', 'author', 'unknown'])
+        self.assertEquals(['id', 'title', 'author'], list(serializer.fields))
+
+    def test_expand(self):
+        fields = TaskSerializer(expand=['attachment_set']).fields
+
+        self.assertIn('attachment_set', fields)
+        self.assertIn('body', fields)
+        self.assertNotIn('author', fields)
+
+    def test_no_fieldset(self):
+        fields = TaskSerializer().fields
+        self.assertIn('author', fields)
+        self.assertIn('attachment_set', fields)
+
+    def test_many(self):
+        serializer = TaskSerializer([], many=True, fields=['id'])
+        self.assertEquals(['id'], list(serializer.child.fields))
+
+class LoadGenericRelationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher, cls.student = utility_funcs.populate_users('teacher@gmail.com', 'student@gmail.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [cls.student])
+        cls.task, cls.student_work = utility_funcs.populate_course_content(
+            cls.course,
+            cls.course.get_course_member_if_exists(cls.teacher),
+            cls.course.get_course_member_if_exists(cls.student)
+        )
+        cls.material = Material.objects.create(title='Test material', body='Body.', published_at=cls.task.published_at,
+                                               chapter=cls.task.chapter, author=cls.task.author)
+
+        # the task and the material can have the same primary key, so the attachments are grouped by the content type
+        cls.attachments = {}
+        for target_object in (cls.task, cls.task, cls.material, cls.student_work):
+            cls.attachments.setdefault(target_object, []).append(Attachment.objects.create(
+                content_type=ContentType.objects.get_for_model(target_object),
+                object_id=target_object.pk,
+                file='attachments/file.txt'
+            ))
+
+    def test_single_query(self):
+        instances = [Task.objects.get(pk=self.task.pk), Material.objects.get(pk=self.material.pk),
+                     StudentWork.objects.get(pk=self.student_work.pk)]
+        ContentType.objects.get_for_models(Task, Material, StudentWork)
+
+        with self.assertNumQueries(1):
+            loaders.load_generic_relation(instances, 'attachment_set')
+
+        with self.assertNumQueries(0):
+            for instance, target_object in zip(instances, (self.task, self.material, self.student_work)):
+                self.assertEquals(self.attachments[target_object], list(instance.attachment_set.all()))
+
+    def test_prefetched_instances_skipped(self):
+        instances = list(Task.objects.prefetch_related('attachment_set'))
+
+        with self.assertNumQueries(0):
+            loaders.load_generic_relation(instances, 'attachment_set')
+
+
+class URLTemplateTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher, cls.student = utility_funcs.populate_users('teacher@gmail.com', 'student@gmail.com')
+        cls.course = utility_funcs.populate_course(cls.teacher, [cls.student])
+        cls.task, _ = utility_funcs.populate_course_content(
+            cls.course,
+            cls.course.get_course_member_if_exists(cls.teacher),
+            cls.course.get_course_member_if_exists(cls.student)
+        )
+        Material.objects.bulk_create([
+            Material(title='Test material', body='Body.', published_at=cls.task.published_at,
+                     chapter=cls.task.chapter, author=cls.task.author)
+            for _ in range(5)
+        ])
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.kwargs = {'course_id': self.course.pk, 'chapter_id': self.task.chapter_id, 'pk': self.task.pk}
+
+    def test_equals_reverse(self):
+        request = self.factory.get('/')
+
+        self.assertEquals(reverse('task-detail', kwargs=self.kwargs),
+                          urls.reverse_from_template('task-detail', self.kwargs))
+        self.assertEquals(request.build_absolute_uri(reverse('task-detail', kwargs=self.kwargs)),
+                          urls.reverse_from_template('task-detail', self.kwargs, request=request))
+
+    def test_format_suffix(self):
+        self.assertEquals(reverse('task-detail', kwargs={**self.kwargs, 'format': 'json'}),
+                          urls.reverse_from_template('task-detail', self.kwargs, format='json'))
+
+    def test_no_match(self):
+        self.assertRaises(NoReverseMatch, urls.reverse_from_template, 'unknown-detail', self.kwargs)
+        self.assertRaises(NoReverseMatch, urls.reverse_from_template, 'task-detail', {'pk': self.task.pk})
+
+    def test_chapter_detail_urls_without_queries(self):
+        request = self.factory.get(reverse('chapter-list', kwargs={'course_id': self.course.pk}))
+        request.resolver_match = resolve(request.path_info)
+        chapters = list(Chapter.objects.filter(course=self.course).prefetch_related('task_set', 'material_set'))
+
+        with self.assertNumQueries(0):
+            data = ChapterSerializer(chapters, many=True, context={'request': request}).data
+
+        self.assertEquals(5, len(data[0]['material_set']))
+        self.assertEquals(request.build_absolute_uri(reverse('task-detail', kwargs=self.kwargs)),
+                          data[0]['task_set'][0]['detail_url'])
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.circuit_breaker = redis_client.CircuitBreaker(failure_threshold=2, recovery_timeout=10)
+        patcher = mock.patch.object(redis_client, 'monotonic', return_value=100)
+        self.monotonic = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _open(self):
+        for _ in range(2):
+            self.circuit_breaker.before_call()
+            self.circuit_breaker.record_failure()
+
+    def test_opened_by_consecutive_failures(self):
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_success()
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.before_call()
+
+        self.circuit_breaker.record_failure()
+        self.assertEquals(redis_client.CircuitBreaker.OPEN, self.circuit_breaker.state)
+        self.assertRaises(redis_client.CircuitOpenError, self.circuit_breaker.before_call)
+
+    def test_single_trial(self):
+        self._open()
+        self.monotonic.return_value = 110
+
+        self.circuit_breaker.before_call()
+        self.assertEquals(redis_client.CircuitBreaker.HALF_OPEN, self.circuit_breaker.state)
+        self.assertRaises(redis_client.CircuitOpenError, self.circuit_breaker.before_call)
+
+        self.circuit_breaker.record_success()
+        self.assertEquals(redis_client.CircuitBreaker.CLOSED, self.circuit_breaker.state)
+        self.circuit_breaker.before_call()
+
+    def test_failed_trial(self):
+        self._open()
+        self.monotonic.return_value = 110
+
+        self.circuit_breaker.before_call()
+        self.circuit_breaker.record_failure()
+
+        self.assertEquals(redis_client.CircuitBreaker.OPEN, self.circuit_breaker.state)
+        self.assertRaises(redis_client.CircuitOpenError, self.circuit_breaker.before_call)
+
+
+class RedisClientTestCase(SimpleTestCase):
+    db = 15
+
+    def setUp(self):
+        # nothing listens on the port, so the connections are refused
+        self.client = redis_client.InstrumentedRedis(
+            redis_client.CircuitBreaker(failure_threshold=2, recovery_timeout=60),
+            connection_pool=redis_client.InstrumentedConnectionPool(
+                self.db, host='localhost', port=1, max_connections=2, timeout=0.1, socket_connect_timeout=0.1
+            )
+        )
+
+    def _get_sample_value(self, name, **labels):
+        return metrics.REGISTRY.get_sample_value(name, {'db': str(self.db), **labels}) or 0
+
+    def test_circuit_opened(self):
+        failures = self._get_sample_value('redis_command_failures_total', command='GET')
+        rejections = self._get_sample_value('redis_circuit_rejections_total')
+
+        for _ in range(2):
+            self.assertRaises(redis.ConnectionError, self.client.get, 'key')
+        self.assertRaises(redis_client.CircuitOpenError, self.client.get, 'key')
+        self.assertRaises(redis_client.CircuitOpenError, self.client.pipeline().set('key', 1).execute)
+
+        self.assertEquals(failures + 2, self._get_sample_value('redis_command_failures_total', command='GET'))
+        self.assertEquals(rejections + 2, self._get_sample_value('redis_circuit_rejections_total'))
+        self.assertEquals(0, self._get_sample_value('redis_pool_connections_in_use'))
+        self.assertEquals(2, self._get_sample_value('redis_pool_max_connections'))
+
+    def test_pool_connections_in_use(self):
+        with mock.patch.object(redis.Connection, 'connect'), mock.patch.object(redis.Connection, 'can_read',
+                                                                               return_value=False):
+            connections = [self.client.connection_pool.get_connection('GET') for _ in range(2)]
+            self.assertEquals(2, self._get_sample_value('redis_pool_connections_in_use'))
+            # the pool is bounded
+            self.assertRaises(redis.ConnectionError, self.client.connection_pool.get_connection, 'GET')
+
+            self.client.connection_pool.release(connections[0])
+            self.assertEquals(1, self._get_sample_value('redis_pool_connections_in_use'))
+
+    def test_shared_clients(self):
+        client = redis_client.get_redis_client(0)
+
+        self.assertIs(client, redis_client.get_redis_client(0))
+        self.assertIs(client.circuit_breaker, redis_client.get_redis_client(1).circuit_breaker)
+        self.assertEquals(client, redis_client.lazy_redis_client(0))
+
+
+class RedisThrottleCacheTestCase(SimpleTestCase):
+    def test_fallback(self):
+        throttle_cache = throttling.RedisThrottleCache()
+        cache.clear()
+
+        with mock.patch.object(throttling, 'redis_client') as client:
+            client.get.side_effect = client.set.side_effect = redis_client.CircuitOpenError
+
+            self.assertEquals([], throttle_cache.get('key', []))
+            throttle_cache.set('key', [1.5], 60)
+            self.assertEquals([1.5], throttle_cache.get('key', []))
+
+        cache.clear()
@@ -21,22 +21,21 @@ class UserAccountAdmin(admin.ModelAdmin):
     model = UserAccount
     # list page
     list_display = ['first_name', 'last_name', 'email', 'department', 'registration_type', 'is_active']
-    list_filter = ['department', 'is_active', 'registration_type']
+    list_filter = ['department', 'is_active', 'registration_type', 'profile_type']
     search_fields = ['first_name', 'last_name', 'email']
 
     # detail page
-    readonly_fields = ['last_login', 'registration_type']
+    readonly_fields = ['last_login', 'registration_type', 'profile_type']
     exclude = ['password']
 
     def get_inlines(self, request, obj):
-        try:
-            profile_instance = obj.profile
-            if isinstance(profile_instance, StudentProfile):
-                return [StudentProfileModelInline]
+        if obj and obj.is_student:
+            return [StudentProfileModelInline]
 
+        if obj and obj.is_teacher:
             return [TeacherProfileModelInline]
-        except AttributeError:
-            return []
+
+        return []
 
 
 class StudentInline(ReadOnlyInlineMixin, admin.TabularInline):
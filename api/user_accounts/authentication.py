@@ -0,0 +1,32 @@
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+class RequestCachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that verifies a token only once per request. The result (or the raised exception) is stored on
+    the django request object, so **CourseMiddleware** and the DRF views share one signature verification and one
+    **UserAccount** lookup.
+
+    The number of performed lookups is available as *request.auth_lookups* for request instrumentation.
+    """
+    result_attribute = '_jwt_authentication_result'
+
+    def authenticate(self, request):
+        # DRF passes its own Request object that wraps the django one
+        request = getattr(request, '_request', request)
+
+        if not hasattr(request, self.result_attribute):
+            try:
+                result = (super().authenticate(request), None)
+            except AuthenticationFailed as exc:
+                result = (None, exc)
+
+            setattr(request, self.result_attribute, result)
+            setattr(request, 'auth_lookups', getattr(request, 'auth_lookups', 0) + 1)
+
+        authentication_result, exc = getattr(request, self.result_attribute)
+        if exc:
+            raise exc
+
+        return authentication_result
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from user_accounts.token_stores import DatabaseTokenStore
+
+
+class Command(BaseCommand):
+    help = 'Removes the expired tokens stored in the database (see DatabaseTokenStore).'
+
+    def handle(self, *args, **options):
+        deleted_number = DatabaseTokenStore().clear_expired()
+        self.stdout.write(self.style.SUCCESS(f'Removed {deleted_number} expired tokens.'))
@@ -1,6 +1,7 @@
 from functools import partial
 
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 
 from university_structures.models import Department, Group, Degree, Position
@@ -75,6 +76,14 @@ class UserAccount(AbstractBaseUser):
     # WARNING: won`t change if the user is_admin will be set to true in the admin
     registration_type = models.CharField(choices=STATUSES, blank=True, max_length=1)
 
+    PROFILE_TYPES = (
+        (TEACHER, 'Teacher'),
+        (STUDENT, 'Student'),
+    )
+
+    # the type of the related profile object, kept consistent by signals of the profile models (see signals.py)
+    profile_type = models.CharField(choices=PROFILE_TYPES, blank=True, max_length=1, editable=False)
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
@@ -85,20 +94,25 @@ class UserAccount(AbstractBaseUser):
     @property
     def profile(self):
         """
-        Returns an associated profile object.
+        Returns an associated profile object. The profile type is read from the *profile_type* field, so at most one
+        query is executed (none if the profile was selected with select_related).
         :return: an StudentProfile or TeacherProfile object.
         """
+        if self.profile_type == self.STUDENT:
+            return self.student_profile
+
+        if self.profile_type == self.TEACHER:
+            return self.teacher_profile
 
-        try:
-            model = self.student_profile
-            return model
-        except StudentProfile.DoesNotExist:
-            try:
-                model = self.teacher_profile
-            except TeacherProfile.DoesNotExist:
-                raise AttributeError('There is not any profile object related to this user.')
+        raise AttributeError('There is not any profile object related to this user.')
 
-        return model
+    @property
+    def is_teacher(self):
+        return self.profile_type == self.TEACHER
+
+    @property
+    def is_student(self):
+        return self.profile_type == self.STUDENT
 
     def get_course_members_queryset(self, **kwargs):
         """
@@ -132,6 +146,8 @@ class TeacherProfile(models.Model):
 
     user = models.OneToOneField(UserAccount, related_name='teacher_profile', on_delete=models.CASCADE)
 
+    profile_type = UserAccount.TEACHER
+
     def __str__(self):
         return f'Teacher information'
 
@@ -142,7 +158,50 @@ class StudentProfile(models.Model):
 
     group = models.ForeignKey(Group, on_delete=models.CASCADE)
 
+    profile_type = UserAccount.STUDENT
+
     def __str__(self):
         return f'Student information'
 
 
+class StoredToken(models.Model):
+    """
+    A token sent to a user, stored by user_accounts.token_stores.DatabaseTokenStore.
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    token = models.CharField(max_length=255)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'Token {self.key}'
+
+
+class OutgoingEmail(models.Model):
+    """
+    A message of the outbox, it is sent by a celery worker (see user_accounts.outbox) and removed once it is sent.
+    A message claimed by a worker is *SENDING* until *next_attempt_at*, when the claim expires.
+    The message that was refused by the SMTP server is retried later, it is marked as failed after
+    *EMAIL_OUTBOX_MAX_ATTEMPTS* attempts and removed after *EMAIL_OUTBOX_RETENTION* seconds.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.EmailField()
+    to = models.EmailField()
+
+    PENDING = 'P'
+    SENDING = 'S'
+    FAILED = 'F'
+
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (FAILED, 'Failed'),
+    )
+    status = models.CharField(max_length=1, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Email to {self.to}'
@@ -0,0 +1,157 @@
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+
+from .models import OutgoingEmail
+
+# the errors of a single message, the other errors of the SMTP backend are the errors of the connection
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def queue_email(subject, body, to):
+    """
+    Adds a message to the outbox. The delivery is scheduled after the transaction is committed, so a request does not
+    wait for the SMTP server.
+    :param to: the email address of the recipient
+    """
+    OutgoingEmail.objects.create(subject=subject, body=body, from_email=settings.DEFAULT_FROM_EMAIL, to=to)
+    transaction.on_commit(schedule_delivery)
+
+
+def schedule_delivery():
+    # imported here, as the tasks module imports this one
+    from .tasks import deliver_outbox
+
+    try:
+        deliver_outbox.apply_async(retry=False)
+    except OperationalError:
+        # the broker is not available, the message is sent by the periodic delivery (see CELERY_BEAT_SCHEDULE)
+        pass
+
+
+def deliver_emails(batch_size=None):
+    """
+    Sends the due messages of the outbox in batches of *EMAIL_OUTBOX_BATCH_SIZE*. A batch is claimed by a short
+    transaction (see **_claim_batch**), the messages are sent outside of it and the results are recorded by another
+    short one, so no rows are locked during the SMTP round trips. The SMTP connection is opened once, when the first
+    batch is claimed. A message refused by the server is retried with an exponential backoff
+    (see **_record_failure**).
+    :raise OSError: if the connection fails, the messages that are not sent are released to be retried
+    :return: the number of the sent messages
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    sent_number = 0
+    connection = None
+
+    try:
+        while True:
+            emails = _claim_batch(batch_size)
+            if not emails:
+                return sent_number
+
+            sent_ids, failures, error = [], [], None
+            try:
+                if connection is None:
+                    connection = get_connection(fail_silently=False)
+                    connection.open()
+
+                for email in emails:
+                    message = EmailMessage(email.subject, email.body, email.from_email, [email.to],
+                                           connection=connection)
+                    try:
+                        connection.send_messages([message])
+                    except MESSAGE_ERRORS as exc:
+                        failures.append((email, exc))
+                    else:
+                        sent_ids.append(email.pk)
+            except OSError as exc:
+                error = exc
+
+            _record_results(emails, sent_ids, failures)
+            sent_number += len(sent_ids)
+            if error is not None:
+                raise error
+
+            if len(emails) < batch_size:
+                return sent_number
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+def purge_emails():
+    """
+    Removes the messages that have failed and the messages whose claim has expired, once they are older than
+    *EMAIL_OUTBOX_RETENTION* seconds. The bodies contain the tokens sent to the users, so they are not kept longer
+    than needed to look into the failures.
+    :return: the number of the removed messages
+    """
+    now = timezone.now()
+    deleted_number, _ = OutgoingEmail.objects.filter(
+        Q(status=OutgoingEmail.FAILED) | Q(status=OutgoingEmail.SENDING, next_attempt_at__lte=now),
+        created_at__lt=now - timedelta(seconds=settings.EMAIL_OUTBOX_RETENTION)
+    ).delete()
+
+    return deleted_number
+
+
+def _claim_batch(batch_size):
+    """
+    Marks a batch of the due messages as being sent. The claim expires in *EMAIL_OUTBOX_CLAIM_TIMEOUT* seconds, so
+    the messages of a worker that has died are sent by the next delivery.
+    :return: a list of the claimed messages
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(OutgoingEmail.objects.select_for_update(skip_locked=True).filter(
+            status__in=[OutgoingEmail.PENDING, OutgoingEmail.SENDING],
+            next_attempt_at__lte=now
+        ).order_by('next_attempt_at', 'pk')[:batch_size])
+
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status=OutgoingEmail.SENDING,
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT)
+        )
+
+    return emails
+
+
+def _record_results(emails, sent_ids, failures):
+    """
+    Removes the sent messages, postpones the refused ones and releases the messages that were not sent (e.g. because
+    the connection failed), so they are retried at once.
+    :param failures: a list of tuples (email, exception)
+    """
+    now = timezone.now()
+    processed_ids = set(sent_ids) | {email.pk for email, _ in failures}
+
+    with transaction.atomic():
+        OutgoingEmail.objects.filter(pk__in=sent_ids).delete()
+        for email, exc in failures:
+            _record_failure(email, exc, now)
+
+        OutgoingEmail.objects.filter(
+            pk__in=[email.pk for email in emails if email.pk not in processed_ids]
+        ).update(status=OutgoingEmail.PENDING, next_attempt_at=now)
+
+
+def _record_failure(email, exc, now):
+    """
+    Postpones the next attempt to send a message by *EMAIL_OUTBOX_RETRY_DELAY* seconds, the delay is doubled by every
+    failed attempt.
+    """
+    email.attempts += 1
+    email.last_error = str(exc)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutgoingEmail.FAILED
+    else:
+        email.status = OutgoingEmail.PENDING
+        email.next_attempt_at = now + timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1))
+
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
@@ -1,6 +1,8 @@
 from django.contrib.auth.password_validation import validate_password
 from rest_framework.serializers import ModelSerializer, Serializer, ValidationError
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainSerializer
+from rest_framework_simplejwt.tokens import RefreshToken
 
 from .models import UserAccount, TeacherProfile, StudentProfile
 from utils.normalizers import Normalizer
@@ -14,7 +16,8 @@ class UserAccountSerializer(NormalizedModelSerializer):
 
     class Meta:
         model = UserAccount
-        exclude = ['password', 'registration_type']
+        # profile_type is an internal denormalization of the profile relation, it is not a part of the API
+        exclude = ['password', 'registration_type', 'profile_type']
         read_only_fields = ['is_active', 'is_admin', 'edited', 'created', 'last_login', 'id', 'email', 'email_confirmed']
         normalize_for_type = {str: Normalizer.first_capital}
 
@@ -77,3 +80,18 @@ class PasswordSerializer(Serializer):
         instance.save()
 
         return instance
+
+
+class CredentialsSerializer(TokenObtainSerializer):
+    """
+    Verifies the credentials of a login and sets the authenticated *user*, the password is hashed once. Unlike
+    **TokenObtainPairSerializer**, the tokens are not issued on validation, so the view can check the user first and
+    issue them by **get_tokens**.
+    """
+    @classmethod
+    def get_token(cls, user):
+        return RefreshToken.for_user(user)
+
+    def get_tokens(self):
+        refresh = self.get_token(self.user)
+        return {'refresh': str(refresh), 'access': str(refresh.access_token)}
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import UserAccount, TeacherProfile, StudentProfile
+
+
+def _set_profile_type(profile, profile_type):
+    UserAccount.objects.filter(pk=profile.user_id).update(profile_type=profile_type)
+
+    user_field = profile._meta.get_field('user')
+    if user_field.is_cached(profile):
+        profile.user.profile_type = profile_type
+
+
+@receiver(post_save, sender=TeacherProfile)
+@receiver(post_save, sender=StudentProfile)
+def set_profile_type(sender, instance, created, **kwargs):
+    if created:
+        _set_profile_type(instance, instance.profile_type)
+
+
+@receiver(post_delete, sender=TeacherProfile)
+@receiver(post_delete, sender=StudentProfile)
+def clear_profile_type(sender, instance, **kwargs):
+    _set_profile_type(instance, '')
+
+
+def backfill_profile_types(sender, using='default', **kwargs):
+    """Sets UserAccount.profile_type of the users that have a profile object, but have not got this field set."""
+    users = UserAccount.objects.using(using).filter(profile_type='')
+    users.filter(student_profile__isnull=False).update(profile_type=UserAccount.STUDENT)
+    users.filter(teacher_profile__isnull=False).update(profile_type=UserAccount.TEACHER)
@@ -1,24 +1,18 @@
-from Desk2.celery import app
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.conf import settings
 
-from .tokens import TwoFATokenGenerator
-from .models import UserAccount
+from Desk2.celery import app
+from .outbox import deliver_emails, purge_emails
 
 
-@app.task
-def send_2fa_token(user_id):
+@app.task(bind=True, max_retries=settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+def deliver_outbox(self):
     """
-    Sends token for 2FA authentication asynchronously using celery queue.
+    Sends the due messages of the outbox using celery queue (see user_accounts.outbox). If the SMTP server is not
+    available, the delivery is retried with an exponential backoff. The failed messages that are past the retention
+    period are removed first.
     """
-    user = UserAccount.objects.get(pk=user_id)
-    print('hello guy')
-    token_generator = TwoFATokenGenerator()
-    email_body = render_to_string(f'email/twoFA-auth.html', {
-        'user': user,
-        'token': token_generator.make_token(user),
-    })
-
-    return send_mail('Desk2 Team', email_body, 'noreply@desk2.com', [user.email], fail_silently=False)
-
-
+    purge_emails()
+    try:
+        return deliver_emails()
+    except OSError as exc:
+        raise self.retry(exc=exc, countdown=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** self.request.retries)
@@ -0,0 +1,148 @@
+from datetime import timedelta
+from functools import lru_cache
+from threading import Lock
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from utils.cache import LocalLRUCache
+from utils.redis_client import lazy_redis_client
+from .models import StoredToken
+
+
+def get_token_store():
+    """
+    :return: the store of the tokens configured by *TOKEN_STORE* setting, shared by the process
+    """
+    return _get_token_store(settings.TOKEN_STORE)
+
+
+@lru_cache(maxsize=None)
+def _get_token_store(path):
+    return import_string(path)()
+
+
+class BaseTokenStore:
+    """
+    Stores the tokens sent to the users (see user_accounts.tokens) under a key for a limited time. A token is
+    verified and removed by a single atomic **consume**, so the concurrent requests can not use it twice.
+    """
+    def set(self, key, token, timeout):
+        """
+        Stores a token, the token stored under the key before is replaced.
+        :param timeout: the number of seconds the token is valid for
+        """
+        raise NotImplementedError('set() must be implemented.')
+
+    def get(self, key):
+        """
+        :return: the stored token or None if it does not exist or has expired
+        """
+        raise NotImplementedError('get() must be implemented.')
+
+    def consume(self, key, token):
+        """
+        Removes the stored token if it matches a given one.
+        :return: True if the token matched
+        """
+        raise NotImplementedError('consume() must be implemented.')
+
+    def delete(self, key):
+        raise NotImplementedError('delete() must be implemented.')
+
+
+# deletes a stored token only if it matches a given one, so a token is verified and consumed by a single round trip
+CONSUME_TOKEN_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisTokenStore(BaseTokenStore):
+    """
+    Stores the tokens in *REDIS_TOKENS_STORAGE* database, the tokens are expired by redis. Every operation costs one
+    round trip.
+    """
+    def __init__(self):
+        self.redis_client = lazy_redis_client(settings.REDIS_TOKENS_STORAGE)
+        self._consume_script = None
+
+    def set(self, key, token, timeout):
+        self.redis_client.set(key, token, ex=timeout)
+
+    def get(self, key):
+        token = self.redis_client.get(key)
+        return token.decode('utf-8') if token else None
+
+    def consume(self, key, token):
+        if self._consume_script is None:
+            self._consume_script = self.redis_client.register_script(CONSUME_TOKEN_SCRIPT)
+
+        return bool(self._consume_script(keys=[key], args=[token]))
+
+    def delete(self, key):
+        self.redis_client.delete(key)
+
+
+class LocalTokenStore(BaseTokenStore):
+    """
+    Stores the tokens in a process-local LRU cache of *LOCAL_TOKEN_STORE_SIZE* entries, the least recently used
+    tokens are evicted on overflow.
+
+    NOTE: the tokens are not shared by the processes, so it fits only the single-process deployments and the tests.
+    """
+    def __init__(self, max_size=None):
+        self._tokens = LocalLRUCache(max_size or settings.LOCAL_TOKEN_STORE_SIZE)
+        self._lock = Lock()
+
+    def set(self, key, token, timeout):
+        with self._lock:
+            self._tokens.set(key, token, timeout)
+
+    def get(self, key):
+        return self._tokens.get(key)
+
+    def consume(self, key, token):
+        with self._lock:
+            return self._tokens.get(key) == token and self._tokens.delete(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._tokens.delete(key)
+
+    def clear(self):
+        self._tokens.clear()
+
+
+class DatabaseTokenStore(BaseTokenStore):
+    """
+    Stores the tokens in a table of the default database (see StoredToken). A token is consumed by a single DELETE
+    query. The expired tokens are not read, they are removed by *clear_expired_tokens* management command.
+    """
+    def set(self, key, token, timeout):
+        StoredToken.objects.update_or_create(key=key, defaults={
+            'token': token,
+            'expires_at': timezone.now() + timedelta(seconds=timeout),
+        })
+
+    def get(self, key):
+        return StoredToken.objects.filter(key=key, expires_at__gt=timezone.now()).values_list(
+            'token', flat=True
+        ).first()
+
+    def consume(self, key, token):
+        deleted_number, _ = StoredToken.objects.filter(key=key, token=token, expires_at__gt=timezone.now()).delete()
+        return bool(deleted_number)
+
+    def delete(self, key):
+        StoredToken.objects.filter(key=key).delete()
+
+    def clear_expired(self):
+        """
+        :return: the number of the removed tokens
+        """
+        deleted_number, _ = StoredToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted_number
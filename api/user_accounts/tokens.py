@@ -1,15 +1,12 @@
 from datetime import datetime
 
 from django.core.exceptions import ImproperlyConfigured
-import redis
 
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.conf import settings
 
 from .models import UserAccount
-
-if settings.REDIS_STORED_TOKENS:
-    redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_TOKENS_STORAGE)
+from .token_stores import get_token_store
 
 
 def round_timestamp(timestamp, minute):
@@ -39,63 +36,73 @@ def check_token(token_gen_class, email, token):
     return user and token_generator.check_token(user, token)
 
 
-class RedisTokenMixin:
+class StoredTokenMixin:
     """
-    Provides functionality for storing tokens in redis storage.
+    Provides functionality for storing tokens in the token store (see user_accounts.token_stores), so a token can be
+    used once.
     """
-    def _get_redis_key_basename(self):
+    def _get_key_basename(self):
         try:
-            return getattr(self, 'redis_key_basename')
+            return getattr(self, 'key_basename')
         except AttributeError:
-            raise ImproperlyConfigured('Token generator that inherits from RedisTokenMixin class'
-                                       ' requires redis_key_basename class variable to be defined.')
+            raise ImproperlyConfigured('Token generator that inherits from StoredTokenMixin class'
+                                       ' requires key_basename class variable to be defined.')
 
     def _get_token_length(self):
         try:
             return getattr(self, 'token_length')
         except AttributeError:
-            raise ImproperlyConfigured('Token generator that inherits from RedisTokenMixin class'
+            raise ImproperlyConfigured('Token generator that inherits from StoredTokenMixin class'
                                        ' requires token_length class variable to be defined.')
 
     def _get_token_timeout(self):
         try:
             return getattr(self, 'token_timeout')
         except AttributeError:
-            raise ImproperlyConfigured('Token generator that inherits from RedisTokenMixin class'
+            raise ImproperlyConfigured('Token generator that inherits from StoredTokenMixin class'
                                        ' requires token_timeout class variable to be defined.')
 
+    def _get_key(self, user):
+        return self._get_key_basename() + '_' + str(user.pk)
+
     def make_token(self, user):
         token = super().make_token(user)[-self._get_token_length():]
-        if settings.REDIS_STORED_TOKENS:
-            redis_client.set(
-                str(self._get_redis_key_basename() + '_' + str(user.pk)),
-                token,
-                ex=self._get_token_timeout()
-            )
+        get_token_store().set(self._get_key(user), token, self._get_token_timeout())
 
         return token
 
     def check_token(self, user, token, remove_from_storage=False):
-        if settings.REDIS_STORED_TOKENS:
-            redis_key_name = self._get_redis_key_basename() + '_' + str(user.pk)
-            genuine_token = redis_client.get(redis_key_name)
-            if not genuine_token:
-                return False
+        genuine_token = get_token_store().get(self._get_key(user))
+        if not genuine_token:
+            return False
+
+        if remove_from_storage:
+            get_token_store().delete(self._get_key(user))
 
-            genuine_token = genuine_token.decode('utf-8')
-            if remove_from_storage:
-                redis_client.delete(redis_key_name)
+        return token == genuine_token
 
-            return token == genuine_token
+    def consume_token(self, user, token):
+        """
+        Verifies a token and removes it from the storage, so it can be used once. Costs one round trip to the store.
+        """
+        if not isinstance(token, str):
+            return False
 
-        return token == self.make_token(user)
+        return get_token_store().consume(self._get_key(user), token)
 
+    def restore_token(self, user, token):
+        """
+        Stores a consumed token again, e.g. when the action it confirmed has failed. The token is valid for the full
+        timeout again.
+        """
+        get_token_store().set(self._get_key(user), token, self._get_token_timeout())
 
-class EmailConfirmationTokenGenerator(RedisTokenMixin, PasswordResetTokenGenerator):
+
+class EmailConfirmationTokenGenerator(StoredTokenMixin, PasswordResetTokenGenerator):
     """
     Used to generate 7-digit token for email confirmation.
     """
-    redis_key_basename = 'email'
+    key_basename = 'email'
     token_length = settings.EMAIL_CONFIRM_TOKEN_LENGTH
     token_timeout = settings.EMAIL_CONFIRM_TOKEN_TIMEOUT
 
@@ -103,47 +110,24 @@ class EmailConfirmationTokenGenerator(RedisTokenMixin, PasswordResetTokenGenerat
         return str(user.pk) + str(round_timestamp(timestamp, 5)) + str(user.is_active)
 
 
-class EmailConfirmationUnregisteredTokenGenerator(PasswordResetTokenGenerator):
+class EmailConfirmationUnregisteredTokenGenerator(StoredTokenMixin, PasswordResetTokenGenerator):
     """Used to generate tokens to confirm emails independent of user model."""
+    key_basename = 'unregistered'
     token_length = settings.EMAIL_CONFIRM_TOKEN_LENGTH
     token_timeout = settings.EMAIL_CONFIRM_TOKEN_TIMEOUT
-    basename = 'unregistered'
-
-    def make_token(self, email):
-        token = super().make_token(email)[-self.token_length:]
-        if settings.REDIS_STORED_TOKENS:
-            redis_client.set(
-                str(self.basename + '_' + email),
-                token,
-                ex=self.token_timeout
-            )
-
-        return token
-
-    def check_token(self, email, token, remove_from_storage=False):
-        if settings.REDIS_STORED_TOKENS:
-            redis_key_name = self.basename + '_' + str(email)
-            genuine_token = redis_client.get(redis_key_name)
-            if not genuine_token:
-                return False
-
-            genuine_token = genuine_token.decode('utf-8')
-            if remove_from_storage:
-                redis_client.delete(redis_key_name)
-
-            return token == genuine_token
 
-        return token == self.make_token(email)
+    def _get_key(self, email):
+        return self.key_basename + '_' + str(email)
 
     def _make_hash_value(self, email, timestamp):
         return str(email) + str(round_timestamp(timestamp, 5))
 
 
-class PasswordChangeTokenGenerator(RedisTokenMixin, PasswordResetTokenGenerator):
+class PasswordChangeTokenGenerator(StoredTokenMixin, PasswordResetTokenGenerator):
     """
     Used to generate 7-digit token for password reset.
     """
-    redis_key_basename = 'password'
+    key_basename = 'password'
     token_length = settings.PASSWORD_RESET_TOKEN_LENGTH
     token_timeout = settings.PASSWORD_RESET_TOKEN_TIMEOUT
 
@@ -151,11 +135,11 @@ class PasswordChangeTokenGenerator(RedisTokenMixin, PasswordResetTokenGenerator)
         return str(user.pk) + str(round_timestamp(timestamp, 5)) + str(user.password)
 
 
-class TwoFATokenGenerator(RedisTokenMixin, PasswordResetTokenGenerator):
+class TwoFATokenGenerator(StoredTokenMixin, PasswordResetTokenGenerator):
     """
     Used to generate 7-digit token for password reset.
     """
-    redis_key_basename = '2fa'
+    key_basename = '2fa'
     token_length = settings.TWO_FA_TOKEN_LENGTH
     token_timeout = settings.TWO_FA_TOKEN_TIMEOUT
 
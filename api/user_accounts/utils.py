@@ -1,9 +1,11 @@
+from django.template.loader import render_to_string
 from django.utils.encoding import force_text
 from django.utils.http import urlsafe_base64_decode
 
 from .serializers import TeacherProfileSerializer, StudentProfileSerializer
 from .models import TeacherProfile, StudentProfile, UserAccount
-from .tokens import EmailConfirmationTokenGenerator
+from .outbox import queue_email
+from .tokens import EmailConfirmationTokenGenerator, TwoFATokenGenerator
 
 
 def get_serializer_for_profile(request_data):
@@ -57,3 +59,14 @@ def confirm_user_email(uidb64, token):
         user.save()
 
         return user
+
+
+def send_2fa_token(user):
+    """
+    Makes a token for 2FA authentication and adds its email to the outbox, it is sent asynchronously.
+    """
+    email_body = render_to_string('email/twoFA-auth.html', {
+        'user': user,
+        'token': TwoFATokenGenerator().make_token(user),
+    })
+    queue_email('Desk2 Team', email_body, user.email)
@@ -1,9 +1,7 @@
-from datetime import datetime
-
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.core.validators import validate_email, ValidationError
-from django.contrib.auth import authenticate
+from django.contrib.auth.models import update_last_login
+from django.db import transaction
 
 from rest_framework.viewsets import ViewSet
 from rest_framework.permissions import IsAuthenticated
@@ -14,12 +12,12 @@ from rest_framework.decorators import action
 
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-from .utils import get_serializer_for_profile, get_serializer_for_profile_obj, serializer_check_save
-from .serializers import UserAccountSerializer, PasswordSerializer
+from .utils import get_serializer_for_profile, get_serializer_for_profile_obj, serializer_check_save, send_2fa_token
+from .serializers import UserAccountSerializer, PasswordSerializer, CredentialsSerializer
 from .models import UserAccount
 from .tokens import check_token, PasswordChangeTokenGenerator, TwoFATokenGenerator, \
     EmailConfirmationUnregisteredTokenGenerator
-from .tasks import send_2fa_token
+from .outbox import queue_email
 
 
 class AuthenticationViewSet(ViewSet):
@@ -58,24 +56,27 @@ class AuthenticationViewSet(ViewSet):
                 {'profile_type': 'Invalid profile type. Should be student or teacher.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if not user_serializer.is_valid():
+            return Response(user_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if not profile_serializer.is_valid():
+            return Response(profile_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
         token_generator = EmailConfirmationUnregisteredTokenGenerator()
-        if not token_generator.check_token(email, token, remove_from_storage=False):
+        if not token_generator.consume_token(email, token):
             return Response({'email-token': 'Given token is invalid. Make sure to check your email.'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        user_saved, user = serializer_check_save(user_serializer, False, password=password, email=email, email_confirmed=True)
-
-        if not user_saved:
-            return Response(user, status=status.HTTP_400_BAD_REQUEST)
-
-        profile_saved, result = serializer_check_save(profile_serializer, False, user=user)
-
-        if not profile_saved:
-            user.delete()
-            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        # the token is consumed before the password is hashed and the user is saved, so an invalid token is rejected
+        # cheaply. It is restored if saving fails, so the user can try again.
+        try:
+            with transaction.atomic():
+                user = user_serializer.save(password=password, email=email, email_confirmed=True)
+                profile_serializer.save(user=user)
+        except Exception:
+            token_generator.restore_token(email, token)
+            raise
 
-        # FIXME: use remove_token method instead when it will be created
-        token_generator.check_token(email, token, remove_from_storage=True)
         user.type = user.STUDENT if request.data['profile_type'] == 'student' else user.TEACHER
         response_dict = user_serializer.data
         response_dict.update(profile_serializer.data)
@@ -165,13 +166,10 @@ class ResetPasswordView(APIView):
             return Response({'detail': 'password, token or email fields are not specified.'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        if user and password and token_generator.check_token(user, token, remove_from_storage=False):
+        if user and password and token_generator.consume_token(user, token):
             user.set_password(password)
             user.save()
 
-            # FIXME: use remove_token method instead when it will be created
-            token_generator.check_token(user, token, remove_from_storage=True)
-
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response({'detail': 'Confirmation token is not valid.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -196,7 +194,7 @@ class ChangeEmailView(APIView):
         except ValidationError:
             return Response({'email': 'Given email address is not valid.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not EmailConfirmationUnregisteredTokenGenerator().check_token(email, token, remove_from_storage=True):
+        if not EmailConfirmationUnregisteredTokenGenerator().consume_token(email, token):
             return Response({'token': 'Given token is invalid. Make sure to check your email'},
                             status=status.HTTP_400_BAD_REQUEST)
 
@@ -273,7 +271,7 @@ class SendTokenView(APIView):
         if not token_generator:
             return Response({'detail': 'Invalid token type.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        send_mail('Desk2 Team', email_body, 'noreply@desk2.com', [email], fail_silently=False)
+        queue_email('Desk2 Team', email_body, email)
         return Response({'detail': 'Token sent.'}, status=status.HTTP_200_OK)
 
     def _get_user_if_exists(self, email):
@@ -285,11 +283,16 @@ class SendTokenView(APIView):
 
 class TokenObtainView(TokenObtainPairView):
     throttle_scope = 'token-check'
+    serializer_class = CredentialsSerializer
 
     def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-
-        user = authenticate(username=request.data['email'], password=request.data['password'])
+        """
+        Issues the tokens after the credentials, the email confirmation and the 2FA code of a user are checked. The
+        password is verified once, the authenticated user is used by the other checks.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.user
 
         if not user.email_confirmed:
             return Response({'detail': 'Mail verification is needed.'},
@@ -297,16 +300,13 @@ class TokenObtainView(TokenObtainPairView):
 
         elif user.twoFA_enabled:
             if '2FA_code' not in request.data.keys():
-                send_2fa_token.run(user.pk)  # TODO: change to async mode after SMTP server will ge configured
+                send_2fa_token(user)
                 return Response({'detail': '2FA verification is needed.'}, status=status.HTTP_401_UNAUTHORIZED)
 
-            token_generator = TwoFATokenGenerator()
-            if not token_generator.check_token(user, request.data['2FA_code']):
+            if not TwoFATokenGenerator().consume_token(user, request.data['2FA_code']):
                 return Response({'detail': '2FA token is not valid.'}, status=status.HTTP_400_BAD_REQUEST)
 
-            # FIXME: use remove_token method instead when it will be created
-            token_generator.check_token(user, request.data['2FA_code'], remove_from_storage=True)
-        user.last_login = datetime.now()
-        user.save()
+        tokens = serializer.get_tokens()
+        update_last_login(None, user)
 
-        return response
+        return Response(tokens, status=status.HTTP_200_OK)
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LocalLRUCache:
+    """
+    A small thread-safe process-local cache with a least recently used eviction policy.
+    **settings:**
+        * `max_size` - the maximum number of stored entries, the least recently used entry is evicted on overflow.
+
+        * `timeout` - the number of seconds an entry is valid for. None means that entries do not expire.
+    """
+    def __init__(self, max_size, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries[key]
+            except KeyError:
+                return default
+
+            if expires_at is not None and expires_at <= monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        expires_at = monotonic() + timeout if timeout is not None else None
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,24 @@
+from asgiref.sync import SyncToAsync
+from django.db import close_old_connections
+
+
+class DatabaseSyncToAsync(SyncToAsync):
+    """
+    SyncToAsync that runs database work in the thread pool instead of the single thread-sensitive thread, so the
+    concurrent requests of an ASGI server are not serialized by it.
+
+    The database connections of a pool thread outlive the request, so they are closed (or reused, depending on
+    *CONN_MAX_AGE*) before and after every call in the same way the request handler does it for the request thread.
+    """
+    def __init__(self, func):
+        super().__init__(func, thread_sensitive=False)
+
+    def thread_handler(self, loop, *args, **kwargs):
+        close_old_connections()
+        try:
+            return super().thread_handler(loop, *args, **kwargs)
+        finally:
+            close_old_connections()
+
+
+database_sync_to_async = DatabaseSyncToAsync
@@ -2,6 +2,7 @@ from rest_framework.views import exception_handler
 from rest_framework.response import Response
 from rest_framework import status
 from django.db import IntegrityError
+from redis import RedisError
 
 
 def view_exception_handler(exc, context):
@@ -10,4 +11,9 @@ def view_exception_handler(exc, context):
     if isinstance(exc, IntegrityError) and not response:
         response = Response({'detail': context['view'].db_exception_msg}, status=status.HTTP_400_BAD_REQUEST)
 
+    # the redis stored data (e.g. the tokens) can not be replaced, the code that has a fallback handles the errors
+    if isinstance(exc, RedisError) and not response:
+        response = Response({'detail': 'The service is temporarily unavailable. Try again later.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
     return response
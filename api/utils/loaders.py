@@ -0,0 +1,49 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+
+def load_generic_relation(instances, relation_name):
+    """
+    Loads a generic relation (e.g. *attachment_set*) of all given instances by a single query. The instances can be
+    of different models, the content types of the models are resolved at once. The loaded objects are stored as
+    prefetched, so *instance.<relation_name>.all()* does not query the database. The instances that already have the
+    relation prefetched are skipped.
+    :param instances: a list of model instances that have a GenericRelation named *relation_name*
+    """
+    instances = [instance for instance in instances
+                 if relation_name not in getattr(instance, '_prefetched_objects_cache', {})]
+    if not instances:
+        return
+
+    relation = instances[0]._meta.get_field(relation_name)
+    content_type_field = relation.content_type_field_name
+    content_type_attname = relation.related_model._meta.get_field(content_type_field).attname
+    object_id_field = relation.object_id_field_name
+
+    instances_by_model = defaultdict(list)
+    for instance in instances:
+        instances_by_model[type(instance)].append(instance)
+
+    content_types = ContentType.objects.get_for_models(*instances_by_model.keys(), for_concrete_models=relation.for_concrete_model)
+    condition = Q()
+    for model, model_instances in instances_by_model.items():
+        condition |= Q(**{
+            content_type_field: content_types[model],
+            f'{object_id_field}__in': [instance.pk for instance in model_instances],
+        })
+
+    related_objects = defaultdict(list)
+    for related_object in relation.related_model._base_manager.filter(condition).order_by('pk'):
+        key = (getattr(related_object, content_type_attname), getattr(related_object, object_id_field))
+        related_objects[key].append(related_object)
+
+    for instance in instances:
+        queryset = getattr(instance, relation_name).all()
+        queryset._result_cache = related_objects[(content_types[type(instance)].pk, instance.pk)]
+        queryset._prefetch_done = True
+
+        if not hasattr(instance, '_prefetched_objects_cache'):
+            instance._prefetched_objects_cache = {}
+        instance._prefetched_objects_cache[relation.attname] = queryset
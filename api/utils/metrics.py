@@ -0,0 +1,220 @@
+import asyncio
+import hmac
+import os
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.urls import resolve, Resolver404
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+UNRESOLVED_VIEW = 'unresolved'
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Request latency by view',
+    ['view'],
+)
+REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries',
+    'Number of SQL queries executed by a request',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float('inf')),
+)
+REQUEST_DB_DURATION = Histogram(
+    'http_request_db_duration_seconds',
+    'Total time of SQL queries executed by a request',
+    ['view'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float('inf')),
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes',
+    'Response body size by view',
+    ['view'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, float('inf')),
+)
+AUTH_LOOKUPS = Counter(
+    'http_request_auth_lookups',
+    'Number of JWT authentication lookups performed by requests',
+    ['view'],
+)
+REDIS_COMMAND_LATENCY = Histogram(
+    'redis_command_duration_seconds',
+    'Latency of redis commands by database (see utils.redis_client)',
+    ['db', 'command'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float('inf')),
+)
+REDIS_COMMAND_FAILURES = Counter(
+    'redis_command_failures',
+    'Number of redis commands failed by a connection error or a timeout',
+    ['db', 'command'],
+)
+REDIS_CIRCUIT_REJECTIONS = Counter(
+    'redis_circuit_rejections',
+    'Number of redis commands rejected without being sent while the circuit was open',
+    ['db'],
+)
+REDIS_POOL_CONNECTIONS_IN_USE = Gauge(
+    'redis_pool_connections_in_use',
+    'Number of the connections of a redis connection pool that are used by commands',
+    ['db'],
+    multiprocess_mode='livesum',
+)
+REDIS_POOL_MAX_CONNECTIONS = Gauge(
+    'redis_pool_max_connections',
+    'Size of a redis connection pool',
+    ['db'],
+    multiprocess_mode='livesum',
+)
+
+_current_request_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Measurements of a single request. The SQL queries are recorded for every connection used while processing the
+    request, including the ones of the thread pool threads (the context is copied by *sync_to_async*).
+    """
+    def __init__(self):
+        self.view = UNRESOLVED_VIEW
+        self.queries = 0
+        self.db_duration = 0.0
+
+    def __repr__(self):
+        return f'<RequestMetrics view={self.view} queries={self.queries} db_duration={self.db_duration:.4f}>'
+
+
+def record_query(execute, sql, params, many, context):
+    request_metrics = _current_request_metrics.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.queries += 1
+        request_metrics.db_duration += perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def get_view_name(request):
+    """
+    :return: a name of the view that processed a request, e.g. *ChapterViewSet.list* or *StudentWorkViewSet.submit*
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        # the request was answered by a middleware before the view was resolved
+        try:
+            resolver_match = resolve(request.path_info)
+        except Resolver404:
+            return UNRESOLVED_VIEW
+
+    view = resolver_match.func
+    view_class = getattr(view, 'cls', None)
+    if view_class is None:
+        return resolver_match.view_name
+
+    actions = getattr(view, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the latency, the number of SQL queries, the total time of SQL queries and the response size of every
+    request as Prometheus histograms labeled by the processed view and its action (see **get_view_name**). The
+    metrics are exported by **metrics_view**.
+
+    The measurements are also available as *request.metrics* (see **RequestMetrics**), e.g. for the query budget
+    assertions of the tests. It should be the first middleware, so the queries of the other middleware are counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        # the connections opened before the middleware is loaded (e.g. the ones of the management commands)
+        for connection in connections.all():
+            install_query_recorder(connection)
+        connection_created.connect(install_query_recorder, dispatch_uid='utils.metrics.install_query_recorder')
+
+        if asyncio.iscoroutinefunction(self.get_response):
+            # the request handler checks it to await the middleware instead of wrapping it into async_to_sync
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        request_metrics, token, start = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request_metrics.reset(token)
+
+        self._observe(request, response, request_metrics, perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics, token, start = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_request_metrics.reset(token)
+
+        self._observe(request, response, request_metrics, perf_counter() - start)
+        return response
+
+    def _start(self, request):
+        request_metrics = RequestMetrics()
+        setattr(request, 'metrics', request_metrics)
+
+        return request_metrics, _current_request_metrics.set(request_metrics), perf_counter()
+
+    def _observe(self, request, response, request_metrics, latency):
+        request_metrics.view = view = get_view_name(request)
+
+        REQUEST_LATENCY.labels(view).observe(latency)
+        REQUEST_DB_QUERIES.labels(view).observe(request_metrics.queries)
+        REQUEST_DB_DURATION.labels(view).observe(request_metrics.db_duration)
+        AUTH_LOOKUPS.labels(view).inc(getattr(request, 'auth_lookups', 0))
+
+        if not response.streaming:
+            RESPONSE_SIZE.labels(view).observe(len(response.content))
+
+
+def has_metrics_token(request):
+    """
+    :return: True if a request is authorized by *METRICS_TOKEN*, it is always False if the setting is empty
+    """
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(
+        token.encode(), settings.METRICS_TOKEN.encode()
+    )
+
+
+def metrics_view(request):
+    """
+    Exports the metrics in the Prometheus text format to the scrapers that send *METRICS_TOKEN* as a bearer token.
+    If *PROMETHEUS_MULTIPROC_DIR* environment variable is set (several worker processes), the metrics of all the
+    processes are collected.
+    """
+    if not has_metrics_token(request):
+        return HttpResponseForbidden()
+
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
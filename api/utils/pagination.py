@@ -0,0 +1,24 @@
+from rest_framework import pagination
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination: a page is selected by a position in the ordering instead of an offset, so every page costs
+    the same as the first one if the ordering is backed by an index.
+
+    **settings (attributes of a view):**
+        * `ordering` - the ordering of pages, by default the *ordering* of the model Meta is used. The first field
+        should be unchanging and nearly unique (e.g. a creation timestamp).
+
+        * `page_size` - the default page size of the view. The client can set it by the *page-size* query
+        parameter up to *max_page_size*.
+    """
+    page_size = 20
+    page_size_query_param = 'page-size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = getattr(view, 'page_size', self.page_size)
+        self.ordering = getattr(view, 'ordering', None) or queryset.model._meta.ordering
+
+        return super().paginate_queryset(queryset, request, view)
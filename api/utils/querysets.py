@@ -0,0 +1,273 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import Prefetch
+from rest_framework.relations import ManyRelatedField, RelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+class QuerysetOptimization:
+    """
+    The lookups a queryset needs to be serialized by a given serializer without a query per row:
+
+    * `select_related` - the forward and one-to-one relations serialized by nested serializers.
+
+    * `prefetch_related` - the many relations (reverse foreign keys, many-to-many, generic relations) and everything
+    nested in them.
+
+    * `only` - the fields loaded for the selected models. A model is restricted only if all the fields of its
+    serializer are model fields (a property, a method field or an identity field can use any attribute), otherwise
+    all its concrete fields are loaded.
+
+    * `prefetch_only` - the same for the prefetched models: a dict in format lookup:(model, fields), the fields
+    include the primary key and the key the prefetched objects are joined by. The prefetched querysets are
+    restricted by **apply** and by **get_prefetch_queryset**.
+
+    **settings:**
+        * `attribute_sources` - dict that expects entries in format field_name:list_of_model_field_names, specified
+        in the Meta of a serializer. The model fields read by a property or a method field, so the serializer model
+        can still be restricted.
+    """
+    def __init__(self, serializer, model):
+        self.select_related = []
+        self.prefetch_related = []
+        self.only = []
+        self.prefetch_only = {}
+        self._is_restricted = False
+
+        self._collect(serializer, model, prefix='', in_prefetch=False)
+        if not self._is_restricted:
+            self.only = []
+
+    def apply(self, queryset, read_only=False):
+        """
+        :param read_only: whether the instances are only serialized. Otherwise (the instances are updated or deleted)
+        only *select_related* is applied: the prefetched objects are discarded on update and the instances should
+        not be partially loaded.
+        """
+        if self.select_related and queryset.query.select_related is not True:
+            queryset = queryset.select_related(*self.select_related)
+
+        if not read_only:
+            return queryset
+
+        # the lookups that are already prefetched by a view (e.g. by a filtered Prefetch object) are kept as is
+        existing_lookups = {
+            lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+            for lookup in queryset._prefetch_related_lookups
+        }
+        prefetch_related = [
+            Prefetch(lookup, queryset=self.prefetch_only[lookup][0]._default_manager.only(
+                *self.prefetch_only[lookup][1]
+            )) if lookup in self.prefetch_only else lookup
+            for lookup in self.prefetch_related if lookup not in existing_lookups
+        ]
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+
+        if self.only and not queryset.query.deferred_loading[0]:
+            queryset = queryset.only(*self.only)
+
+        return queryset
+
+    def get_prefetch_queryset(self, lookup, queryset):
+        """
+        Restricts the fields of a queryset that a view prefetches by itself (e.g. by a filtered Prefetch object).
+        """
+        if lookup in self.prefetch_only:
+            return queryset.only(*self.prefetch_only[lookup][1])
+
+        return queryset
+
+    def _collect(self, serializer, model, prefix, in_prefetch, join_fields=None):
+        """
+        :param join_fields: the fields the objects of a prefetched model are joined by, None if the model is not
+        prefetched or can not be restricted (e.g. it is prefetched through several relations)
+        """
+        only = {model._meta.pk.name}
+        is_restricted = True
+        # the relations that the list serializer of the top-level serializer loads by itself (see
+        # utils.serializers.BatchLoadingListSerializer)
+        batch_loaded_relations = getattr(getattr(serializer, 'Meta', None), 'batch_loaded_relations', []) \
+            if not prefix else []
+        attribute_sources = getattr(getattr(serializer, 'Meta', None), 'attribute_sources', {})
+
+        for field in serializer.fields.values():
+            if field.write_only or field.source in batch_loaded_relations:
+                continue
+
+            if field.field_name in attribute_sources:
+                only.update(attribute_sources[field.field_name])
+                continue
+
+            if field.source == '*':
+                is_restricted = False
+                continue
+
+            path, related_model, is_many = self._resolve_source(model, field.source_attrs)
+            if not path:
+                if field.source_attrs[0] in self._get_concrete_field_names(model):
+                    only.add(field.source_attrs[0])
+                else:
+                    is_restricted = False
+                continue
+
+            nested = field.child if isinstance(field, ListSerializer) else field
+            nested = nested.child_relation if isinstance(nested, ManyRelatedField) else nested
+
+            if path[0] in self._get_concrete_field_names(model):
+                only.add(path[0])
+            if len(path) < len(field.source_attrs) and not isinstance(nested, BaseSerializer):
+                # e.g. *source='task.title'*, the fields of the related model are not collected
+                is_restricted = False
+
+            # a related field that represents an object by its primary key uses the foreign key column only
+            if len(path) == 1 and not is_many and isinstance(nested, RelatedField) and \
+                    nested.use_pk_only_optimization():
+                continue
+
+            lookup = prefix + '__'.join(path)
+            if is_many or in_prefetch or related_model is None:
+                self.prefetch_related.append(lookup)
+            else:
+                self.select_related.append(lookup)
+
+            if isinstance(nested, BaseSerializer) and related_model is not None:
+                is_prefetched = is_many or in_prefetch
+                nested_join_fields = self._get_join_fields(model, path) if is_prefetched else None
+                self._collect(nested, related_model, lookup + '__', is_prefetched, nested_join_fields)
+
+        if in_prefetch:
+            if is_restricted and join_fields is not None:
+                self.prefetch_only[prefix[:-len('__')]] = (model, sorted(only | join_fields))
+            return
+
+        if is_restricted:
+            self._is_restricted = True
+        else:
+            only = self._get_concrete_field_names(model)
+
+        self.only.extend(prefix + name for name in sorted(only))
+
+    def _resolve_source(self, model, source_attrs):
+        """
+        :return: a tuple (path, related_model, is_many), where the path is a list of the relation names the source
+        goes through. The path is empty if the source does not start with a relation.
+        """
+        path = []
+        is_many = False
+
+        for attr in source_attrs:
+            model_field = self._get_model_field(model, attr)
+            if model_field is None:
+                break
+
+            if not model_field.is_relation:
+                break
+
+            path.append(attr)
+            is_many = is_many or model_field.one_to_many or model_field.many_to_many
+            model = model_field.related_model
+            if model is None:  # a generic foreign key
+                break
+
+        return path, model if path else None, is_many
+
+    def _get_join_fields(self, model, path):
+        """
+        :return: the fields of a related model the prefetched objects are joined by, None if they are not known
+        """
+        if len(path) != 1:
+            return None
+
+        model_field = self._get_model_field(model, path[0])
+        if model_field.many_to_many:
+            # joined by the through table
+            return set()
+        if hasattr(model_field, 'object_id_field_name'):
+            # a generic relation
+            return {model_field.object_id_field_name, model_field.content_type_field_name}
+        if model_field.auto_created and not model_field.concrete:
+            # a reverse foreign key or one-to-one relation
+            return {model_field.field.name}
+
+        # a forward relation, joined by the primary key
+        return set()
+
+    def _get_model_field(self, model, attr):
+        try:
+            return model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            # the reverse relations are serialized by their accessor names, e.g. *task_set*
+            for related_object in model._meta.related_objects:
+                if related_object.get_accessor_name() == attr:
+                    return related_object
+
+        return None
+
+    def _get_concrete_field_names(self, model):
+        return {field.name for field in model._meta.concrete_fields}
+
+
+@lru_cache(maxsize=512)
+def get_queryset_optimization(serializer_class, model, sparse_fieldset=None):
+    """
+    The fields of a serializer do not depend on a request, so the tree is inspected once per serializer class and
+    its sparse fieldset (see utils.serializers.SparseFieldsetMixin). The number of the fieldsets requested by the
+    clients is not limited, so the least recently used optimizations are discarded.
+    """
+    kwargs = sparse_fieldset._asdict() if sparse_fieldset is not None else {}
+    return QuerysetOptimization(serializer_class(**kwargs), model)
+
+
+def insert_from_select(model, fields, queryset):
+    """
+    Inserts the rows selected by a queryset by a single *INSERT ... SELECT* query, the rows are not loaded to python.
+    The rows that conflict with a unique constraint are skipped. No signals are sent.
+    :param fields: the names of the model fields, in the order of the values of the queryset
+    :param queryset: a *values_list* queryset that selects a value per field
+    :return: the number of the inserted rows
+    """
+    connection = connections[queryset.db]
+    select_sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+
+    return _insert(connection, model, fields, select_sql, params)
+
+
+def insert_values(model, fields, rows, returning, using='default'):
+    """
+    Inserts the rows by a single *INSERT ... VALUES ... RETURNING* query. The rows that conflict with a unique
+    constraint are skipped and are not returned, so the caller knows exactly which rows it has inserted (unlike
+    bulk_create() with *ignore_conflicts*). No signals are sent. It needs a database that supports *RETURNING*
+    (PostgreSQL, SQLite 3.35+).
+    :param fields: the names of the model fields, in the order of the values of a row
+    :param rows: a list of tuples of the python values of the fields, they are converted by the fields
+    :param returning: the name of a field, its values are returned for the inserted rows
+    :return: a list of the values of *returning* field of the inserted rows
+    """
+    if not rows:
+        return []
+
+    connection = connections[using]
+    model_fields = [model._meta.get_field(name) for name in fields]
+    row_sql = f'({", ".join(["%s"] * len(fields))})'
+    params = [field.get_db_prep_save(value, connection) for row in rows for field, value in zip(model_fields, row)]
+
+    return _insert(connection, model, fields, f'VALUES {", ".join([row_sql] * len(rows))}', params, returning)
+
+
+def _insert(connection, model, fields, source_sql, params, returning=None):
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in fields)
+
+    sql = f'{connection.ops.insert_statement(ignore_conflicts=True)} {connection.ops.quote_name(model._meta.db_table)} ' \
+          f'({columns}) {source_sql} {connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+    if returning is not None:
+        sql += f' RETURNING {connection.ops.quote_name(model._meta.get_field(returning).column)}'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        if returning is not None:
+            return [row[0] for row in cursor.fetchall()]
+
+        return cursor.rowcount
@@ -0,0 +1,212 @@
+from threading import Lock
+from time import monotonic, perf_counter
+
+import redis
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from redis.client import Pipeline
+
+from .metrics import REDIS_COMMAND_LATENCY, REDIS_COMMAND_FAILURES, REDIS_CIRCUIT_REJECTIONS, \
+    REDIS_POOL_CONNECTIONS_IN_USE, REDIS_POOL_MAX_CONNECTIONS
+
+
+class CircuitOpenError(redis.ConnectionError):
+    """
+    Raised instead of sending a command while the circuit is open. It is a *redis.ConnectionError*, so the code that
+    falls back when redis is not available (e.g. the caches) handles it as well.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops sending commands to a redis server that failed (refused a connection or timed out) *failure_threshold*
+    times in a row, so the requests do not wait for the socket timeout of every command while the server is down or
+    overloaded. The commands are rejected by **CircuitOpenError** for *recovery_timeout* seconds, then a single trial
+    command is let through: the circuit is closed if it succeeds and is opened again otherwise.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold, recovery_timeout):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._lock = Lock()
+
+    def before_call(self):
+        """
+        :raise CircuitOpenError: if a command should not be sent
+        """
+        if self.state == self.CLOSED:
+            return
+
+        with self._lock:
+            # a new trial is let through if the previous one has not finished in time as well
+            if self.state != self.CLOSED and monotonic() - self._opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._opened_at = monotonic()
+                return
+
+        if self.state != self.CLOSED:
+            raise CircuitOpenError('Redis is not available, the command is not sent.')
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self._failures:
+            return
+
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = monotonic()
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """
+    A bounded connection pool: a command waits at most *timeout* seconds for a free connection and fails by a
+    *redis.ConnectionError* after that. The number of used connections is exported as a metric.
+    """
+    def __init__(self, db, **kwargs):
+        self._in_use = set()
+        super().__init__(db=db, **kwargs)
+        REDIS_POOL_MAX_CONNECTIONS.labels(db).set(self.max_connections)
+
+    def reset(self):
+        # called after a fork as well, the connections of the parent process are not used
+        super().reset()
+        self._in_use = set()
+        self._observe()
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super().get_connection(command_name, *keys, **options)
+        self._in_use.add(connection)
+        self._observe()
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        self._in_use.discard(connection)
+        self._observe()
+
+    def _observe(self):
+        REDIS_POOL_CONNECTIONS_IN_USE.labels(self.connection_kwargs['db']).set(len(self._in_use))
+
+
+class InstrumentedCommandsMixin:
+    """
+    Sends the commands through the circuit breaker of a client and records their latency. The errors replied by the
+    server do not open the circuit, as the server is available.
+    """
+    def _call(self, command_name, func, *args, **kwargs):
+        db = self.connection_pool.connection_kwargs['db']
+        try:
+            self.circuit_breaker.before_call()
+        except CircuitOpenError:
+            REDIS_CIRCUIT_REJECTIONS.labels(db).inc()
+            raise
+
+        start = perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except (redis.ConnectionError, redis.TimeoutError):
+            self.circuit_breaker.record_failure()
+            REDIS_COMMAND_FAILURES.labels(db, command_name).inc()
+            raise
+        except redis.RedisError:
+            self.circuit_breaker.record_success()
+            raise
+        finally:
+            REDIS_COMMAND_LATENCY.labels(db, command_name).observe(perf_counter() - start)
+
+        self.circuit_breaker.record_success()
+        return result
+
+
+class InstrumentedPipeline(InstrumentedCommandsMixin, Pipeline):
+    def __init__(self, circuit_breaker, *args, **kwargs):
+        self.circuit_breaker = circuit_breaker
+        super().__init__(*args, **kwargs)
+
+    def execute(self, raise_on_error=True):
+        return self._call('PIPELINE', super().execute, raise_on_error)
+
+
+class InstrumentedRedis(InstrumentedCommandsMixin, redis.Redis):
+    """
+    A redis client with a bounded connection pool (see **InstrumentedConnectionPool**) that sends the commands and
+    the pipelines through a circuit breaker (see **CircuitBreaker**).
+    """
+    def __init__(self, circuit_breaker, **kwargs):
+        self.circuit_breaker = circuit_breaker
+        super().__init__(**kwargs)
+
+    def execute_command(self, *args, **options):
+        return self._call(args[0], super().execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.circuit_breaker,
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint
+        )
+
+
+_clients = {}
+_circuit_breakers = {}
+_lock = Lock()
+
+
+def get_redis_client(db):
+    """
+    Returns the client of a redis database shared by the code of a process: the token generators, the caches and the
+    throttles. The client is created on the first call and the connections are opened on demand, so the processes
+    that do not use redis (e.g. the management commands) do not connect to it. The clients of all the databases
+    share the circuit breaker of the server.
+    """
+    client = _clients.get(db)
+    if client is not None:
+        return client
+
+    with _lock:
+        if db not in _clients:
+            server = (settings.REDIS_HOST, settings.REDIS_PORT)
+            if server not in _circuit_breakers:
+                _circuit_breakers[server] = CircuitBreaker(
+                    settings.REDIS_CIRCUIT_FAILURE_THRESHOLD,
+                    settings.REDIS_CIRCUIT_RECOVERY_TIMEOUT
+                )
+
+            _clients[db] = InstrumentedRedis(
+                _circuit_breakers[server],
+                connection_pool=InstrumentedConnectionPool(
+                    db,
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    max_connections=settings.REDIS_MAX_CONNECTIONS,
+                    timeout=settings.REDIS_POOL_TIMEOUT,
+                    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+                    retry_on_timeout=settings.REDIS_RETRY_ON_TIMEOUT,
+                    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+                )
+            )
+
+    return _clients[db]
+
+
+def lazy_redis_client(db):
+    """
+    :return: a proxy of the shared client of a database (see **get_redis_client**) that can be created at import time,
+    the client is looked up on the first command.
+    """
+    return SimpleLazyObject(lambda: get_redis_client(db))
@@ -0,0 +1,36 @@
+import csv
+
+from rest_framework.renderers import BaseRenderer
+
+
+class _Echo:
+    """A file-like object that returns a written value instead of storing it, see **iter_csv**."""
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """
+    Formats rows as CSV lines one by one, e.g. for the content of a *StreamingHttpResponse*.
+    :param rows: an iterable of lists of values
+    """
+    writer = csv.writer(_Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renders a list of rows (or a dict, e.g. an error response, as rows of key and value) as CSV. The views that export
+    large tables should return a *StreamingHttpResponse* of **iter_csv** when this renderer is accepted.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        rows = data.items() if isinstance(data, dict) else data
+        return ''.join(iter_csv(rows)).encode(self.charset)
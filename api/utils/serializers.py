@@ -1,5 +1,12 @@
+from collections import namedtuple
 from itertools import chain
-from rest_framework.serializers import ModelSerializer, PrimaryKeyRelatedField
+from django.db.models import Manager
+from rest_framework.serializers import ListSerializer, ModelSerializer, PrimaryKeyRelatedField, ValidationError
+from rest_framework.settings import api_settings
+
+from .loaders import load_generic_relation
+
+SparseFieldset = namedtuple('SparseFieldset', ['fields', 'expand'])
 
 
 class NormalizedModelSerializer(ModelSerializer):
@@ -86,3 +93,110 @@ class PrimaryKeyWriteMixin:
     def to_internal_value(self, data):
         rel_field = PrimaryKeyRelatedField(queryset=self.get_primary_key_queryset(self._get_model_class()))
         return rel_field.to_internal_value(data)
+
+
+class BatchLoadingListSerializer(ListSerializer):
+    """
+    The list serializer that loads the generic relations of all the serialized objects by a single query before
+    serializing them (see utils.loaders.load_generic_relation).
+    **settings:**
+        * `batch_loaded_relations` - the list of GenericRelation names, specified in the Meta of the child serializer.
+
+    To use it, set **Meta.list_serializer_class** of a serializer to this class.
+    """
+    def to_representation(self, data):
+        instances = list(data.all() if isinstance(data, Manager) else data)
+        for relation_name in getattr(self.child.Meta, 'batch_loaded_relations', []):
+            # the relation can be excluded by a sparse fieldset
+            if relation_name in self.child.fields:
+                load_generic_relation(instances, relation_name)
+
+        return super().to_representation(instances)
+
+
+class BulkListSerializer(ListSerializer):
+    """
+    The list serializer of the bulk endpoints. Every item is validated and the errors are returned per item, so a
+    client can fix all of them at once. The checks that need the database should be done for all the items together
+    by **validate_items**, not by the child serializer.
+    **settings:**
+        * `max_items` - the maximum length of the list.
+    """
+    max_items = 500
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            return super().to_internal_value(data)
+
+        if len(data) > self.max_items:
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [f'Ensure this list has no more than {self.max_items} items.']
+            })
+
+        items = []
+        errors = []
+        for item in data:
+            try:
+                items.append(self.child.run_validation(item))
+                errors.append({})
+            except ValidationError as exc:
+                items.append(None)
+                errors.append(exc.detail)
+
+        self.validate_items(items, errors)
+        if any(errors):
+            raise ValidationError(errors)
+
+        return items
+
+    def validate_items(self, items, errors):
+        """
+        :param items: the validated items, None for the invalid ones
+        :param errors: the dicts of the errors of the items, the new errors are added to them
+        """
+        pass
+
+
+class SparseFieldsetMixin:
+    """
+    Allows to serialize only the selected fields of a serializer, e.g. the ones requested by the *fields* and *expand*
+    query parameters (see utils.views.SparseFieldsetViewMixin).
+    **settings:**
+        * `expandable_fields` - the list of the fields (usually nested objects) that are serialized only if they are
+        expanded, specified in Meta.
+
+    **arguments:**
+        * `fields` - the names of the serialized fields. If not given, all the fields that are not expandable are
+        serialized.
+
+        * `expand` - the names of the expandable fields to serialize.
+
+    If neither argument is given, all the fields are serialized. Unknown names are ignored.
+    """
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sparse_fieldset = None
+        if fields is not None or expand is not None:
+            self.sparse_fieldset = SparseFieldset(
+                frozenset(fields) if fields is not None else None,
+                frozenset(expand) if expand is not None else frozenset()
+            )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.sparse_fieldset is None:
+            return fields
+
+        selected, expanded = self.sparse_fieldset
+        expandable_fields = getattr(self.Meta, 'expandable_fields', [])
+
+        for name in list(fields):
+            if name in expandable_fields:
+                is_serialized = name in expanded or (selected is not None and name in selected)
+            else:
+                is_serialized = selected is None or name in selected
+
+            if not is_serialized:
+                del fields[name]
+
+        return fields
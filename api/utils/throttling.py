@@ -0,0 +1,40 @@
+import json
+from math import ceil
+
+import redis
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from rest_framework import throttling
+
+from .redis_client import lazy_redis_client
+
+redis_client = lazy_redis_client(settings.REDIS_CACHE_STORAGE)
+
+
+class RedisThrottleCache:
+    """
+    Stores the request histories of the throttles in redis, so the rate is limited across the processes. The default
+    django cache is used while redis is not available, so the requests are still throttled per process.
+    """
+    redis_key_basename = 'throttle'
+
+    def get(self, key, default=None):
+        try:
+            raw_history = redis_client.get(self._get_redis_key_name(key))
+        except redis.RedisError:
+            return default_cache.get(key, default)
+
+        return json.loads(raw_history) if raw_history else default
+
+    def set(self, key, value, timeout):
+        try:
+            redis_client.set(self._get_redis_key_name(key), json.dumps(value), ex=max(ceil(timeout), 1))
+        except redis.RedisError:
+            default_cache.set(key, value, timeout)
+
+    def _get_redis_key_name(self, key):
+        return self.redis_key_basename + '_' + key
+
+
+class ScopedRateThrottle(throttling.ScopedRateThrottle):
+    cache = RedisThrottleCache()
@@ -0,0 +1,194 @@
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.urls import URLPattern
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .db import database_sync_to_async
+from .querysets import get_queryset_optimization
+from .serializers import SparseFieldsetMixin
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def async_read_view(view):
+    """
+    Wraps a synchronous view (e.g. the one generated by a DRF router) into a coroutine function, so an ASGI request
+    handler runs it natively. Read requests are processed and rendered in a single thread pool hop (see utils.db),
+    which lets the reads of concurrent requests run in parallel. Other methods keep running in the thread-sensitive
+    thread as the synchronous views do.
+
+    The attributes of the wrapped view (*cls*, *actions*, *csrf_exempt* etc.) are kept.
+    """
+    def process_read(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+
+        # the request handler renders a template response in the thread-sensitive thread, so a DRF response is
+        # rendered here and returned as a plain one
+        if callable(getattr(response, 'render', None)):
+            response.render()
+            rendered_response = HttpResponse(response.content, status=response.status_code)
+            for header, value in response.items():
+                rendered_response[header] = value
+            rendered_response.cookies = response.cookies
+
+            return rendered_response
+
+        return response
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await database_sync_to_async(process_read)(request, *args, **kwargs)
+
+        return await sync_to_async(view)(request, *args, **kwargs)
+
+    return async_view
+
+
+def with_async_read_views(url_patterns, names):
+    """
+    :param url_patterns: a list of url patterns, e.g. *router.urls*
+    :param names: names of the url patterns which views should be wrapped by **async_read_view**
+    :return: a new list of url patterns
+    """
+    return [
+        URLPattern(pattern.pattern, async_read_view(pattern.callback), pattern.default_args, pattern.name)
+        if isinstance(pattern, URLPattern) and pattern.name in names else pattern
+        for pattern in url_patterns
+    ]
+
+
+class QuerysetOptimizationMixin:
+    """
+    Applies the *select_related*, *prefetch_related* and *only* lookups derived from the serializer tree of a view
+    to its queryset (see utils.querysets.QuerysetOptimization), so a list is serialized by a constant number of
+    queries. The lookups are applied after *get_queryset*, the ones that a view prefetches by itself are kept. The
+    requests that change data get *select_related* only.
+
+    Should be used only with GenericAPIView subclasses and placed before them in the bases.
+    """
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return self.get_queryset_optimization(queryset.model).apply(
+            queryset,
+            read_only=self.request.method in SAFE_METHODS
+        )
+
+    def get_queryset_optimization(self, model):
+        # the serializer fields are not built here, the optimization of a fieldset is cached
+        serializer = self.get_serializer()
+        return get_queryset_optimization(type(serializer), model, getattr(serializer, 'sparse_fieldset', None))
+
+
+class SparseFieldsetViewMixin:
+    """
+    Passes the *fields* and *expand* query parameters of the read requests to a serializer that supports sparse
+    fieldsets (see utils.serializers.SparseFieldsetMixin). The parameters are comma-separated field names, e.g.
+    *?fields=id,title,deadline&expand=author*. Combined with QuerysetOptimizationMixin, the fields that are not
+    serialized are not loaded from the database.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request is not None and self.request.method in SAFE_METHODS and \
+                issubclass(self.get_serializer_class(), SparseFieldsetMixin):
+            for kwarg, query_param in (('fields', self.fields_query_param), ('expand', self.expand_query_param)):
+                if query_param in self.request.query_params:
+                    kwargs.setdefault(kwarg, [
+                        name.strip() for name in self.request.query_params[query_param].split(',') if name.strip()
+                    ])
+
+        return super().get_serializer(*args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    Answers the conditional *list* and *retrieve* requests (*If-None-Match*, *If-Modified-Since*) by *304 Not
+    Modified* before the queryset is loaded and serialized. The validators are computed from the state the response
+    depends on, which is usually selected by a single aggregate query.
+
+    **settings:**
+        * `get_validators` - a method that returns a tuple (etag_state, last_modified). The *etag_state* is a list of
+        the values the response depends on (e.g. the number of objects and their maximum modification time), the
+        ETag is a hash of the values, the requested path and the accepted media type. If it is None, the request is
+        processed as usual. The *last_modified* is a datetime or None.
+
+    Should be used only with GenericAPIView subclasses and placed before them in the bases.
+    """
+    vary_headers = ('Accept', 'Authorization')
+
+    def get_validators(self):
+        return None, None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        etag_state, last_modified = self.get_validators()
+        if etag_state is None:
+            return handler(request, *args, **kwargs)
+
+        etag = quote_etag(hashlib.md5(
+            repr((request.get_full_path(), request.accepted_media_type, etag_state)).encode()
+        ).hexdigest())
+        last_modified = timegm(last_modified.utctimetuple()) if last_modified is not None else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+
+        patch_vary_headers(response, self.vary_headers)
+        return response
+
+
+class ResponseCacheMixin:
+    """
+    Serves the *list* and *retrieve* responses from a cache of the serialized data, so a cache hit does not load and
+    serialize the queryset. The permissions are checked as usual.
+
+    **settings:**
+        * `get_cached_data` - a method that returns the cached data of a request or None.
+
+        * `cache_data` - a method that caches the data of a successful response.
+
+    Should be used only with GenericAPIView subclasses and placed before them (and after ConditionalGetMixin, so the
+    conditional requests are answered first) in the bases.
+    """
+    def get_cached_data(self):
+        return None
+
+    def cache_data(self, data):
+        pass
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        data = self.get_cached_data()
+        if data is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            self.cache_data(response.data)
+
+        return response
@@ -12,6 +12,9 @@ docker build --file deploy/api.dockerfile -t desk2-api .
 echo "Running unit tests in a container..."
 docker run -d -e "SECRET_KEY='django-insecure-123'" -e "EMAIL_BACKEND='django.core.mail.backends.console.EmailBackend'" -e "EMAIL_HOST_USER='123'" -e "EMAIL_HOST_PASSWORD='123'" --name test-desk2-api -i --entrypoint /usr/bin/dash desk2-api
 
+# installing test-only dependencies
+echo -e "pip install -r requirements-dev.txt --no-cache-dir\n" | docker exec -i test-desk2-api /usr/bin/dash
+
 # executing migrations
 echo -e "echo \"1\n''\n1\n''\n2\n\" | python manage.py makemigrations\n" | docker exec -i test-desk2-api /usr/bin/dash
 echo -e "python manage.py migrate\n" | docker exec -i test-desk2-api /usr/bin/dash